@@ -1,18 +1,80 @@
 #!/usr/bin/env python3
 
-import sys,os,re
+import sys,os,re,math
+import time # for time elapsed
+
+def get_launch_time():
+    """
+    Returns when this process was started according to the OS (where it says), which is well before this line runs: python 
+    has to start up and compile this script first.
+    """
+    try:
+        with open("/proc/self/stat", "r") as fp:
+            start_ticks = float(fp.read().rsplit(")", 1)[1].split()[19]) # field 22, counting from after "pid (command)"
+        with open("/proc/uptime", "r") as fp:
+            uptime = float(fp.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (IOError, OSError, ValueError, IndexError):
+        return time.time()
+LAUNCH_TIME = get_launch_time() # for measuring how long we take to get going (see Tester.process_spawned)
+perf_counter = getattr(time, 'perf_counter', time.time) # for the profiler (python 2.x lacks perf_counter) [PY2]
+
+import importlib # for LazyModule
 import json # for reading our config as well as gradescope stuff
-import shutil # for copying files
 import subprocess # for launching stuff
-import xml.etree.ElementTree as ET # for parsing Logisim XML
 import argparse # for command line switches
-import time # for time elapsed
-import glob # for clean support
+import threading # for enforcing timeouts while we wait on a child
+import signal # for recognizing which limit killed a child
+import hashlib # for recognizing targets we've seen before
+import copy # for cloning settings
+import weakref # for keeping track of generated tests
+import contextlib # for timing profiled phases
+import atexit # for finishing --profile
+import mmap # for reading the test archive
+import struct # for finding our way around the test archive
 from collections import OrderedDict # to keep json read in-order
+try:
+    from collections.abc import Mapping # for LazySuites
+except ImportError:
+    from collections import Mapping # for python 2.x [PY2]
+
+class LazyModule(object):
+    """
+    Stands in for a module that's imported the first time one of its attributes is used: most runs need only a few of the
+    modules below, and importing the rest would be a good part of a short run's startup time.
+    """
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+    def __getattr__(self, attr):
+        self.__dict__.update(importlib.import_module(self._lazy_name).__dict__) # so later lookups don't come back here
+        try:
+            return self.__dict__[attr]
+        except KeyError:
+            raise AttributeError("module '%s' has no attribute '%s'" % (self._lazy_name, attr))
+        
+shutil = LazyModule("shutil") # for copying files
+ET = LazyModule("xml.etree.ElementTree") # for parsing Logisim XML
+glob = LazyModule("glob") # for clean support
+multiprocessing = LazyModule("multiprocessing") # for the cpu count
+csv = LazyModule("csv") # for batch score summaries
+socket = LazyModule("socket") # for --serve
+tempfile = LazyModule("tempfile") # for scratch output of served requests
+zipfile = LazyModule("zipfile") # for the test archive
+cProfile = LazyModule("cProfile") # for --profile
+sqlite3 = LazyModule("sqlite3") # for the run history
+asyncio = LazyModule("asyncio") # for Tester.run_suites_async (which python 2.x doesn't have) [PY2]
 try:
     from itertools import zip_longest
 except ImportError:
     from itertools import izip_longest as zip_longest # for python 2.x [PY2]
+try:
+    import queue # for collecting results from worker threads
+except ImportError:
+    import Queue as queue # for python 2.x [PY2]
+try:
+    import resource # for limiting test children
+except ImportError:
+    resource = None # not on windows
 try:
     from subprocess import DEVNULL
 except ImportError: 
@@ -36,6 +98,8 @@ SETTINGS_FILENAME = 'settings.json' #  to be found in the test_dir
 
 VALID_TEST_MODES = ["exe", "spim", "logisim", "java"]
 VALID_DIFF_TYPES = ["normal", "float"]
+VALID_MEMCHECK_TYPES = ["valgrind", "asan"]
+VALID_TIMEOUT_KINDS = ["wall", "cpu"]
 
 # the gradescope top-level message starts with this.
 GRADESCOPE_MESSAGE_HEADER = \
@@ -48,18 +112,71 @@ grade is posted.
 
 SETTINGS_DEFAULT = {
     'timeout': 10,
+    'timeout_kind': "wall",         # what 'timeout' bounds: "wall" clock time or "cpu" time consumed (which isn't thrown off by a busy machine)
+    'cpu_timeout_wall_factor': 5,   # with timeout_kind "cpu", a wall-clock backstop of this many times the timeout still applies (for programs that block)
     'spim_command': "spim",
     'logisim_jar': "logisim_ev_cli.jar",
+    'memcheck': "valgrind",  # how penalty_valgrind is checked: "valgrind" (run each test again under valgrind) or "asan" (run once as a sanitizer build)
+    'asan_cc': "cc",         # compiler used to make the sanitizer build for memcheck="asan"
+    'asan_cflags': [],       # extra compiler flags for the sanitizer build (e.g. ["-fsanitize=undefined"] to also penalize undefined behavior, which valgrind doesn't catch)
+    'timing_history': "timing_history.json", # where (within the test_dir) to remember how long each test took, for scheduling; written only by the runs that schedule (-j, --shard/--merge, --batch); null to disable
+    'run_history': None, # a SQLite database (within the test_dir) to record every test run in, for --report (see RunHistory); null to not keep one
+    'calibration': "calibration.json",       # where (within the test_dir) --calibrate stores the reference solution's run times
+    'adaptive_timeout': None, # e.g. {"multiplier": 10, "floor": 0.5}: derive each test's timeout from its calibration (see Test.get_timeout)
+    'logisim_result_cache': None, # directory (within the test_dir) to cache logisim suites' results in, by circuit fingerprint (see LogisimFingerprint); null to disable
+    'test_archive': "tests.zip", # where (within the test_dir) --pack puts the expected outputs and stdin files, which are then read from there (see TestArchive)
+    'diff_max_hunks': 10,     # a failed test's message shows at most this many hunks of the diff (see OutputSummarizer)
+    'diff_context_lines': 2,  # ...each with this many lines of the expected output around it
+    'results_max_bytes': 4*1024*1024, # test messages are cut down to share about this much of results.json fairly; null for no limit
 }
 
 OUTPUT_MAX_BYTES = 1024*1024  # truncate diff/actual to at most this many bytes in gradescope output
+MESSAGE_MIN_BYTES = 1024      # when sharing out results_max_bytes, no test's message is cut shorter than this
+MESSAGE_SPILL_BYTES = 64*1024 # test messages longer than this are kept on disk until needed (see MessageSpill)
 
 EXITCODE_VALGRIND_ERROR = 88 # arbitrary, just needs to not match a common exit code
 EXITCODE_SEGFAULT = -11      # exitcode received from check_call on segfault
 EXITCODE_TIMEOUT = -999      # exitcode to synthesize if a timeout is encountered
 
+# the 'limits' setting: name -> (resource name, multiplier to get to the units setrlimit wants, error flag when exceeded). the
+# processes limit has no flag: hitting it just makes fork() fail inside the program, which we can't tell from other failures
+LIMIT_TYPES = OrderedDict([
+    ('cpu_seconds',  ('RLIMIT_CPU',   1,         'cpu_limit')),
+    ('memory_mb',    ('RLIMIT_AS',    1024*1024, 'memory_limit')),
+    ('file_size_mb', ('RLIMIT_FSIZE', 1024*1024, 'file_size_limit')),
+    ('processes',    ('RLIMIT_NPROC', 1,         None)),
+])
+MEMORY_LIMIT_DETECT_FRACTION = 0.75 # a child that failed after its own RSS reached this fraction of memory_mb is presumed to have hit the limit
+
+# rough cost of one test's child process by mode, for deciding how many to run at once: (cores kept busy, MB of memory)
+MODE_COSTS = {
+    "exe":     (1.0, 32),
+    "spim":    (1.0, 32),
+    "java":    (2.0, 256), # the JVM's JIT and GC threads keep more than one core busy
+    "logisim": (2.0, 384),
+}
+MEMCHECK_COST_MULTIPLIER = 3     # valgrind and sanitizer builds are slower and hungrier
+CONCURRENCY_SAMPLE_INTERVAL = 0.5 # seconds between looks at the machine's load when running tests in parallel
+MEMORY_RESERVE_FRACTION = 0.1    # when running in parallel, don't start tests that would leave less than this fraction of memory available
+TIMING_HISTORY_TARGETS_PER_TEST = 20 # how many distinct targets' timings to remember for each test
+BENCHMARK_SCALES = [10, 100]       # --benchmark runs each workload with this many tests...
+BENCHMARK_JOBS = [1, 4]            # ...at each of these -j levels
+BENCHMARK_OUTPUT_BYTES = 256*1024  # size of each test's output in the large_output workload
+BENCHMARK_FLOAT_LINES = 2000       # lines of each test's output in the float_diff workload
+BENCHMARK_FILTER_PASSES = 10       # how many times the output_filters workload applies its filters
+BENCHMARK_CIRCUIT_COMPONENTS = 1000 # gates per .circ file in the logisim_parse workload (about the size of a CPU homework)
+RUN_HISTORY_REPORT_RUNS = 200      # --report looks at (at most) this many of the latest runs
+RUN_HISTORY_REPORT_ROWS = 10       # ...and lists at most this many tests in each section
+RUN_HISTORY_RECENT_RUNS = 5        # a test's latest this-many runs are compared against those before them to spot regressions
+RUN_HISTORY_REGRESSION_FACTOR = 1.5 # ...and it's reported if it got at least this many times slower
+RUN_HISTORY_REGRESSION_FLOOR = 0.05 # ...and by at least this many seconds
+ADAPTIVE_TIMEOUT_DEFAULTS = {"multiplier": 10, "floor": 0.5, "percentile": 99} # for settings missing from 'adaptive_timeout'
+
+ASAN_CFLAGS = ["-g", "-fsanitize=address", "-fsanitize-recover=address", "-fno-omit-frame-pointer"] # recovering, like valgrind, so errors don't cut the output short
+
 verbose = False  # if true, command executions get echoed. set by -v option
 has_valgrind = True
+first_spawn_time = None # when the first test process was started (see Tester.process_spawned)
 
 # ternary operator
 def iff(c,a,b):
@@ -86,6 +203,173 @@ class TextColors:
     BLUE = "\033[0;34m"
     END = "\033[0m"
     
+class ResourceUsage(object):
+    """
+    Resources consumed by one child process, as reported by the OS when the process was reaped (see Utility.run_process).
+    Any field the platform can't tell us about is left as None.
+    """
+    
+    FIELDS = ["wall_time", "user_time", "sys_time", "max_rss_kb", "output_bytes", "voluntary_context_switches", "involuntary_context_switches"]
+    
+    def __init__(self):
+        for field in ResourceUsage.FIELDS:
+            setattr(self, field, None)
+            
+    def set_rusage(self, rusage, rss_floor_kb=None):
+        """
+        Fill in our fields from a resource.struct_rusage, like the one returned by os.wait4. Linux carries the forking parent's 
+        RSS across exec, so a child that never grew past it reports the parent's figure rather than its own; given the most it
+        could have inherited (rss_floor_kb), max_rss_kb is only kept if it's above that, i.e. really the child's own peak.
+        """
+        self.user_time = rusage.ru_utime
+        self.sys_time = rusage.ru_stime
+        self.max_rss_kb = iff(sys.platform == "darwin", rusage.ru_maxrss // 1024, rusage.ru_maxrss) # mac reports bytes, everyone else KiB
+        if rss_floor_kb is not None and self.max_rss_kb <= rss_floor_kb:
+            self.max_rss_kb = None # no more than the harness's own, whatever it was
+        self.voluntary_context_switches = rusage.ru_nvcsw
+        self.involuntary_context_switches = rusage.ru_nivcsw
+        
+    def get_cpu_time(self):
+        """
+        Returns user+system CPU seconds, or None if unknown.
+        """
+        if self.user_time is None:
+            return None
+        return self.user_time + self.sys_time
+        
+    def to_dictionary(self):
+        """
+        Returns a dictionary appropriate for JSON-ifying.
+        """
+        return OrderedDict((field, getattr(self, field)) for field in ResourceUsage.FIELDS)
+        
+    @staticmethod
+    def from_dictionary(d):
+        """
+        The inverse of to_dictionary().
+        """
+        usage = ResourceUsage()
+        for field in ResourceUsage.FIELDS:
+            setattr(usage, field, d.get(field, None))
+        return usage
+        
+    def get_summary(self):
+        """
+        Returns a one-line human readable summary, for verbose mode.
+        """
+        def fmt(format_str, *values):
+            if any(v is None for v in values):
+                return "?"
+            return format_str % values
+        return "wall %s  cpu %s  maxrss %s  output %s  ctxsw %s" % (
+            fmt("%.3fs", self.wall_time),
+            fmt("%.3fs user + %.3fs sys", self.user_time, self.sys_time),
+            fmt("%d KiB", self.max_rss_kb),
+            fmt("%d bytes", self.output_bytes),
+            fmt("%d voluntary/%d involuntary", self.voluntary_context_switches, self.involuntary_context_switches))
+
+class HarnessCounters(object):
+    """
+    The system work the harness itself did while running a test (see Test.run), as opposed to what the test's programs did:
+    processes spawned (the test's, plus the likes of diff and which) and files opened, both as seen by python's audit hooks 
+    (python 3.8+), and bytes read and written, as the kernel counts them for the thread (linux only; pipes included). A test
+    runs on a single thread and one test at a time runs on each thread, so the thread's counts are the test's. Any field that
+    can't be counted here is left as None.
+    """
+    
+    FIELDS = ["spawns", "file_opens", "bytes_read", "bytes_written"]
+    
+    __slots__ = FIELDS + ['start_io']
+    
+    local = threading.local() # .counters: the HarnessCounters of the test running on this thread, if any
+    is_hooked = False
+    hook_lock = threading.Lock()
+    
+    def __init__(self):
+        for field in HarnessCounters.FIELDS:
+            setattr(self, field, None)
+        self.start_io = None
+            
+    @staticmethod
+    def audit_hook(event, args):
+        counters = getattr(HarnessCounters.local, 'counters', None)
+        if counters is None:
+            return
+        if event == "open":
+            counters.file_opens += 1
+        elif event == "subprocess.Popen":
+            counters.spawns += 1
+            
+    @staticmethod
+    def read_thread_io():
+        """
+        Returns (bytes read, bytes written) by this thread so far, or None if the OS won't say.
+        """
+        try:
+            with open("/proc/thread-self/io", "r") as fp:
+                io = dict(line.split(": ") for line in fp.read().splitlines())
+            return int(io['rchar']), int(io['wchar'])
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        
+    def start(self):
+        """
+        Start counting what this thread does.
+        """
+        with HarnessCounters.hook_lock:
+            if not HarnessCounters.is_hooked and hasattr(sys, 'addaudithook'): # python 3.8+; hooks can't be removed, so just the one [PY2]
+                sys.addaudithook(HarnessCounters.audit_hook)
+                HarnessCounters.is_hooked = True
+        if HarnessCounters.is_hooked:
+            self.spawns = self.file_opens = 0
+        self.start_io = HarnessCounters.read_thread_io()
+        HarnessCounters.local.counters = self
+        
+    def stop(self):
+        HarnessCounters.local.counters = None
+        io = HarnessCounters.read_thread_io()
+        if io is not None and self.start_io is not None:
+            self.bytes_read, self.bytes_written = io[0] - self.start_io[0], io[1] - self.start_io[1]
+            
+    @staticmethod
+    def total(counters_list):
+        """
+        Returns the sum of the given HarnessCounters (a field is None if it's None in all of them), or None if there are none.
+        """
+        counters_list = [counters for counters in counters_list if counters is not None]
+        if not counters_list:
+            return None
+        total = HarnessCounters()
+        for field in HarnessCounters.FIELDS:
+            values = [getattr(counters, field) for counters in counters_list if getattr(counters, field) is not None]
+            setattr(total, field, iff(values, sum(values), None))
+        return total
+        
+    def to_dictionary(self):
+        """
+        Returns a dictionary appropriate for JSON-ifying.
+        """
+        return OrderedDict((field, getattr(self, field)) for field in HarnessCounters.FIELDS)
+        
+    @staticmethod
+    def from_dictionary(d):
+        """
+        The inverse of to_dictionary().
+        """
+        counters = HarnessCounters()
+        for field in HarnessCounters.FIELDS:
+            setattr(counters, field, d.get(field, None))
+        return counters
+        
+    def get_summary(self):
+        """
+        Returns a one-line human readable summary, for verbose mode.
+        """
+        def fmt(format_str, value):
+            return "?" if value is None else format_str % value
+        return "harness: spawns %s  file opens %s  read %s  written %s" % (fmt("%d", self.spawns), fmt("%d", self.file_opens), 
+            fmt("%d bytes", self.bytes_read), fmt("%d bytes", self.bytes_written))
+
 class Utility:
     @staticmethod
     def logisim_get_components(filename):
@@ -143,6 +427,56 @@ class Utility:
         else:
             return None
         
+    @staticmethod
+    def hash_file(filename):
+        """
+        Returns the SHA-1 hex digest of the given file's content, or None if it can't be read.
+        """
+        h = hashlib.sha1()
+        try:
+            with open(filename, "rb") as fp:
+                for chunk in iter(lambda: fp.read(1024*1024), b""):
+                    h.update(chunk)
+        except (IOError, OSError):
+            return None
+        return h.hexdigest()
+        
+    @staticmethod
+    def percentile(values, p):
+        """
+        Returns the p'th percentile of the given values (nearest-rank method).
+        """
+        values = sorted(values)
+        rank = int(math.ceil(p / 100.0 * len(values)))
+        return values[max(rank, 1) - 1]
+        
+    @staticmethod
+    def write_file_atomically(filename, content):
+        """
+        Write the given string to a file such that readers see either the old content or the new, never a partial file.
+        """
+        tmp_filename = Utility.temp_filename_for(filename)
+        with open(tmp_filename, "w") as fp:
+            fp.write(content)
+        Utility.replace_file(tmp_filename, filename)
+        
+    @staticmethod
+    def temp_filename_for(filename):
+        """
+        Returns a name for a temporary file to be renamed over the given one by replace_file().
+        """
+        return "%s.tmp%d.%d" % (filename, os.getpid(), threading.current_thread().ident)
+        
+    @staticmethod
+    def replace_file(src, dest):
+        """
+        Atomically rename src over dest.
+        """
+        if hasattr(os, 'replace'):
+            os.replace(src, dest)
+        else:
+            os.rename(src, dest) # atomic on POSIX anyway [PY2]
+        
     found_java=None
     @staticmethod
     def find_java():
@@ -212,24 +546,30 @@ class Utility:
 
     # wrapper for subprocess.check_call to include timeout if and only if python version is 3.x (ugly hack to support python 2 and 3 at same time) [PY2]
     @staticmethod
-    def my_check_call(args, stdin=None, stdout=None, stderr=None, shell=False, timeout=None):
+    def my_check_call(args, stdin=None, stdout=None, stderr=None, shell=False, timeout=None, env=None, preexec_fn=None, cwd=None):
         if sys.version_info[0]==2: # python 2.x has no timeout support [PY2]
-            return subprocess.check_call(args,stdin=stdin,stdout=stdout,stderr=stdout,shell=shell)
+            return subprocess.check_call(args,stdin=stdin,stdout=stdout,stderr=stdout,shell=shell,env=env,preexec_fn=preexec_fn,cwd=cwd)
         elif sys.version_info[0]==3:
-            return subprocess.check_call(args,stdin=stdin,stdout=stdout,stderr=stdout,shell=shell,timeout=timeout)
+            return subprocess.check_call(args,stdin=stdin,stdout=stdout,stderr=stdout,shell=shell,timeout=timeout,env=env,preexec_fn=preexec_fn,cwd=cwd)
         else:
             raise Exception("Unrecognized python version")
 
     @staticmethod
-    def run_process(command_argv, output_file=None, input_file=None, timeout=None, shell=False):
+    def run_process(command_argv, output_file=None, input_file=None, timeout=None, shell=False, env=None, usage=None, rlimits=None, cwd=None, on_spawn=None):
         """
         Execute a shell command and return exit code, or -1 if the process launch failed.
             command_argv: The program name and its arguments, like C's argv
             output_file: file to write output (stdout+stderr), set to DEVNULL to discard, else it's not redirected
             input_file: file to read as stdin, omit to use the default stdin
-            timeout: abort after the given delay (python3 only!)
+            timeout: abort after the given delay (python3 only, unless the platform has os.wait4)
+            env: environment for the child, omit to inherit ours
+            usage: a ResourceUsage object to fill in with what the child consumed, if desired
+            rlimits: list of (resource.RLIMIT_*, value) pairs to impose on the child (see Utility.get_rlimit_preexec)
+            cwd: directory to run the child in, omit to use ours
+            on_spawn: function to call with the child's Popen object once it's started (only where the platform has os.wait4)
         """
         cmd_str = "$ %s" % ' '.join(command_argv)
+        files_to_close = [] # files we open here are ours to close when the child is done
 
         # handle input_file, opening if needed
         if input_file is None:
@@ -238,6 +578,7 @@ class Utility:
             # given a filename, open it
             cmd_str += "  < %s" % input_file
             input_file = open(input_file, "r")
+            files_to_close.append(input_file)
         elif hasattr(input_file, 'read'): 
             # given a readable file-like object
             cmd_str += "  < ..."
@@ -253,6 +594,7 @@ class Utility:
             # given a filename, open it
             cmd_str += "  >& %s" % output_file
             output_file = open(output_file, "w")
+            files_to_close.append(output_file)
         elif hasattr(output_file, 'write'): 
             # given a writable file-like object
             cmd_str += "  >& ..."
@@ -261,17 +603,90 @@ class Utility:
             
         verbose_print(TextColors.BLUE + cmd_str + TextColors.END)
             
+        preexec_fn = Utility.get_rlimit_preexec(rlimits)
+        start_time = time.time()
         try:
-            return Utility.my_check_call(command_argv, stdout=output_file, stderr=output_file, stdin=input_file, timeout=timeout, shell=shell)
+            if hasattr(os, 'wait4'):
+                exitcode = Utility.wait4_call(command_argv, stdout=output_file, stdin=input_file, timeout=timeout, shell=shell, env=env, usage=usage, preexec_fn=preexec_fn, cwd=cwd, on_spawn=on_spawn)
+            else:
+                exitcode = Utility.my_check_call(command_argv, stdout=output_file, stderr=output_file, stdin=input_file, timeout=timeout, shell=shell, env=env, preexec_fn=preexec_fn, cwd=cwd)
         except subprocess.CalledProcessError as exception:
-            return exception.returncode
+            exitcode = exception.returncode
         except Exception as exception:
             if sys.version_info[0]==3 and isinstance(exception,subprocess.TimeoutExpired):
                 # we do this ugly hack instead of just catching that exception type in order to support python 2 (god i can't want to get rid of python 2) [PY2]
-                return EXITCODE_TIMEOUT
+                exitcode = EXITCODE_TIMEOUT
             else:
                 print("run_process: %s" % exception)
-                return -1
+                exitcode = -1
+                
+        if usage is not None:
+            usage.wall_time = time.time() - start_time
+            if output_file is not None and output_file is not DEVNULL and hasattr(output_file, 'fileno'):
+                usage.output_bytes = os.fstat(output_file.fileno()).st_size
+        for f in files_to_close:
+            f.close()
+        return exitcode
+        
+    @staticmethod
+    def get_rlimit_preexec(rlimits):
+        """
+        Given a list of (resource.RLIMIT_*, value) pairs, return a function that applies them, to be run in the child between fork and exec
+        (Popen's preexec_fn). Returns None if there's nothing to apply.
+        """
+        if not rlimits or resource is None:
+            return None
+        def preexec():
+            for which, value in rlimits:
+                soft = value
+                hard = iff(which == resource.RLIMIT_CPU, value + 1, value) # one extra CPU second so SIGXCPU is delivered before the SIGKILL
+                old_soft, old_hard = resource.getrlimit(which)
+                if old_hard != resource.RLIM_INFINITY: # we can only ever lower a hard limit
+                    soft = min(soft, old_hard)
+                    hard = min(hard, old_hard)
+                resource.setrlimit(which, (soft, hard))
+        return preexec
+        
+    @staticmethod
+    def wait4_call(args, stdin=None, stdout=None, shell=False, timeout=None, env=None, usage=None, preexec_fn=None, cwd=None, on_spawn=None):
+        """
+        Like my_check_call, but reaps the child with os.wait4 so we learn what it consumed (filled into usage, if given).
+        Returns the exit code (negative signal number if killed by a signal, like subprocess does), or EXITCODE_TIMEOUT.
+        If on_spawn is given, it's called with the Popen object once the child has started.
+        """
+        process = subprocess.Popen(args, stdin=stdin, stdout=stdout, stderr=stdout, shell=shell, env=env, preexec_fn=preexec_fn, cwd=cwd)
+        rss_floor_kb = None
+        if sys.platform.startswith("linux"):
+            rss_floor_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # our high-water mark since the fork, so at least what the child inherited
+        if on_spawn is not None:
+            on_spawn(process)
+        
+        # rather than polling, block in wait4 and let a timer kill the child if it overstays
+        timed_out = []
+        def on_timeout():
+            timed_out.append(True)
+            process.kill()
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, on_timeout)
+            timer.daemon = True
+            timer.start()
+        try:
+            pid, status, rusage = os.wait4(process.pid, 0)
+        finally:
+            if timer is not None:
+                timer.cancel()
+                
+        if os.WIFSIGNALED(status):
+            exitcode = -os.WTERMSIG(status)
+        else:
+            exitcode = os.WEXITSTATUS(status)
+        process.returncode = exitcode # we reaped it ourselves, so let Popen know it's done
+        if usage is not None:
+            usage.set_rusage(rusage, rss_floor_kb=rss_floor_kb)
+        if timed_out:
+            return EXITCODE_TIMEOUT
+        return exitcode
 
 class Diff(object):
     """
@@ -290,6 +705,29 @@ class Diff(object):
         else:
             raise Exception("Unknown diff type: %s" % diff_type)
             
+    @staticmethod
+    def quick_match(diff_type, expected, actual_filename):
+        """
+        Compare the expected output (bytes, or None if there's none) with the actual output file in-process: returns true if
+        they certainly match as far as the given type of diff is concerned, else false, in which case the diff should be run to 
+        see. For a normal diff, matching means the same lines once all whitespace and blank lines are ignored (as with diff -bwB).
+        """
+        if expected is None:
+            return False
+        try:
+            if os.path.getsize(actual_filename) > 2*len(expected) + 4096:
+                return False # not worth reading it all in to find that out (think infinite loops)
+            with open(actual_filename, "rb") as fp:
+                actual = fp.read()
+        except (IOError, OSError):
+            return False
+        if actual == expected:
+            return True
+        if diff_type == 'normal':
+            normalize = lambda data: [line for line in (b"".join(line.split()) for line in data.split(b"\n")) if line]
+            return normalize(actual) == normalize(expected)
+        return False
+        
     @staticmethod
     def normal_diff(filename1, filename2, diff_filename):
         """
@@ -352,6 +790,164 @@ class Diff(object):
         return is_pass
 
 
+class OutputSummarizer(object):
+    """
+    Boils a (possibly huge) diff or output file down to something fit for a results.json: the first few diff hunks, each with 
+    a little context, a count of the lines and bytes left out, and a hash of the whole file, so it can be told apart from (or 
+    matched to) another. Also shares a results file's byte budget fairly among the tests' messages (see fit_messages).
+    
+    Files are streamed, so their size only costs time. Sizes of messages are measured in characters.
+    """
+    
+    HUNK_HEADER = re.compile(r'^(\d+)(?:,(\d+))?([acd])(\d+)(?:,(\d+))?$') # as in the output of a normal diff, e.g. "12,14c12"
+    
+    @staticmethod
+    def decode(line):
+        return line.decode('utf-8', 'replace') # output may be any old bytes
+        
+    @staticmethod
+    def get_elision_note(what, num_lines, num_bytes, h, hint=""):
+        return "\n###### ... %d more lines (%d bytes) of the %s not shown.%s The whole %s has SHA-1 %s.\n" % (num_lines, num_bytes, what, hint, what, h.hexdigest())
+        
+    @staticmethod
+    def summarize_diff(diff_filename, expected_filename, max_hunks, context_lines, max_bytes=OUTPUT_MAX_BYTES):
+        """
+        Returns the first max_hunks hunks of the given diff (up to max_bytes of it), with context_lines lines of the expected 
+        output around each hunk of a normal diff (a float diff has no line numbers, so each "< >" pair is a hunk by itself).
+        """
+        hunks = [] # lists of lines, the first being the header (if any)
+        h = hashlib.sha1()
+        num_lines = num_bytes = 0
+        kept_lines = kept_bytes = 0
+        previous = ""
+        with open(diff_filename, "rb") as fp:
+            for raw_line in fp:
+                h.update(raw_line)
+                num_lines += 1
+                num_bytes += len(raw_line)
+                line = OutputSummarizer.decode(raw_line)
+                if num_lines == 1 or OutputSummarizer.HUNK_HEADER.match(line.rstrip("\n")) or (line.startswith("< ") and previous.startswith("> ")):
+                    if len(hunks) == max_hunks:
+                        break
+                    hunks.append([])
+                if kept_bytes + len(raw_line) > max_bytes:
+                    break
+                hunks[-1].append(line)
+                kept_lines += 1
+                kept_bytes += len(raw_line)
+                previous = line
+            for chunk in iter(lambda: fp.read(1024*1024), b""): # the rest only needs counting
+                h.update(chunk)
+                num_lines += chunk.count(b"\n")
+                num_bytes += len(chunk)
+                
+        # find the context lines: before and after the lines of the expected output each hunk is about
+        contexts = []
+        wanted = set()
+        for hunk in hunks:
+            m = OutputSummarizer.HUNK_HEADER.match(hunk[0].rstrip("\n"))
+            if m is None or not context_lines:
+                contexts.append(([], []))
+                continue
+            first = int(m.group(1))
+            last = int(m.group(2) or first)
+            if m.group(3) == 'a': # lines added after line 'first'
+                before, after = range(first - context_lines + 1, first + 1), range(first + 1, first + context_lines + 1)
+            else:
+                before, after = range(first - context_lines, first), range(last + 1, last + context_lines + 1)
+            contexts.append(([n for n in before if n >= 1], list(after)))
+            wanted.update(contexts[-1][0] + contexts[-1][1])
+        expected_lines = {}
+        if wanted:
+            with open(expected_filename, "rb") as fp:
+                for n, raw_line in enumerate(fp, 1):
+                    if n > max(wanted):
+                        break
+                    if n in wanted:
+                        expected_lines[n] = OutputSummarizer.decode(raw_line).rstrip("\n")
+                        
+        summary = ""
+        for hunk, (before, after) in zip(hunks, contexts):
+            header, body = iff(before or after, (hunk[:1], hunk[1:]), ([], hunk))
+            summary += "".join(header)
+            summary += "".join("  %s\n" % expected_lines[n] for n in before if n in expected_lines)
+            summary += "".join(body)
+            summary += "".join("  %s\n" % expected_lines[n] for n in after if n in expected_lines)
+        if kept_lines < num_lines:
+            hint = " (Only the first %d hunks are shown.)" % len(hunks)
+            summary += OutputSummarizer.get_elision_note("diff", num_lines - kept_lines, num_bytes - kept_bytes, h, hint)
+        return summary
+        
+    @staticmethod
+    def summarize_file(filename, max_bytes=OUTPUT_MAX_BYTES):
+        """
+        Returns the beginning of the given file (whole lines, up to max_bytes of it).
+        """
+        summary = ""
+        h = hashlib.sha1()
+        num_lines = num_bytes = 0
+        kept_lines = kept_bytes = 0
+        with open(filename, "rb") as fp:
+            for raw_line in fp:
+                h.update(raw_line)
+                num_lines += 1
+                num_bytes += len(raw_line)
+                if kept_bytes + len(raw_line) > max_bytes:
+                    break
+                summary += OutputSummarizer.decode(raw_line)
+                kept_lines += 1
+                kept_bytes += len(raw_line)
+            for chunk in iter(lambda: fp.read(1024*1024), b""): # the rest only needs counting
+                h.update(chunk)
+                num_lines += chunk.count(b"\n")
+                num_bytes += len(chunk)
+        if kept_lines < num_lines:
+            summary += OutputSummarizer.get_elision_note("output", num_lines - kept_lines, num_bytes - kept_bytes, h, " Infinite loop?")
+        return summary
+        
+    @staticmethod
+    def get_fair_share(sizes, budget):
+        """
+        Water-filling: returns the largest cap such that capping each of the given sizes to it makes them add up to at most 
+        budget -- so small ones keep everything and the big ones share what's left equally. None if they fit as they are.
+        """
+        if sum(sizes) <= budget:
+            return None
+        remaining = budget
+        sizes = sorted(sizes)
+        for i, size in enumerate(sizes):
+            share = remaining // (len(sizes) - i)
+            if size > share:
+                return share
+            remaining -= size
+            
+    @staticmethod
+    def shorten(message, max_bytes):
+        """
+        Cut the given message down to about max_bytes, taking out the middle (the end often has notes about penalties).
+        """
+        if len(message) <= max_bytes:
+            return message
+        h = hashlib.sha1(message.encode('utf-8'))
+        tail_length = min(max_bytes // 4, 2048)
+        head = message[:max(max_bytes - tail_length - 200, 0)] # leaving room for the note
+        head = head[:head.rfind("\n") + 1] or head
+        tail = message[len(message) - tail_length:]
+        tail = tail[tail.find("\n") + 1:] or tail
+        removed = message[len(head):len(message) - len(tail)]
+        return head + OutputSummarizer.get_elision_note("message", removed.count("\n"), len(removed), h, " (Cut to keep results.json small.)") + tail
+        
+    @staticmethod
+    def fit_messages(gradescope_tests, budget):
+        """
+        Shorten the "output" of the given tests' gradescope dictionaries to share the given budget fairly (see get_fair_share),
+        though none is cut below MESSAGE_MIN_BYTES.
+        """
+        share = OutputSummarizer.get_fair_share([len(d["output"]) for d in gradescope_tests], budget)
+        if share is not None:
+            for d in gradescope_tests:
+                d["output"] = OutputSummarizer.shorten(d["output"], max(share, MESSAGE_MIN_BYTES))
+                
 class CodeCheck:
     """
     Functions for running various penalty checks on code/circuits.
@@ -441,6 +1037,230 @@ class CodeCheck:
             verbose_print("check_c_math_h_used: %s" % e)
             return False
 
+class LogisimFingerprint(object):
+    """
+    Computes a structural fingerprint of a Logisim circuit file: a hash of its netlist -- which components, with which 
+    attributes, have connection points on which nets -- that stays the same when components are moved, wires are rerouted,
+    labels are edited, or the library tool defaults (like the VHDL template embedded in cpu.circ) change. Files with the same 
+    fingerprint are expected to simulate identically, so the fingerprint can stand in for the file when caching results.
+    
+    How it works, for each circuit in the file:
+      - Each component becomes a node labeled by its library, name and attributes (minus cosmetic ones); a subcircuit 
+        instance is labeled by that subcircuit's own fingerprint. Text annotations are dropped.
+      - Wires are merged into nets (by their endpoints, including endpoints that land in the middle of another wire).
+      - The file doesn't say where a component's pins are, so each component is tied to every net with a point (a wire end or
+        a component anchor) within its pin radius, by the offset of that point from its anchor. Moving a component along
+        with its wires keeps these offsets; connecting it differently changes them.
+      - The component/net graph is hashed by Weisfeiler-Lehman refinement: every node's label is repeatedly replaced by a 
+        hash of itself and its neighbors' labels, until that stops telling any more nodes apart.
+        
+    This errs on the side of changing the fingerprint, but it's a heuristic: a pin beyond its component's estimated radius, a
+    wire running straight through a pin, or a pair of graphs WL refinement can't tell apart could make two different circuits
+    collide. That's why caching results by fingerprint is opt-in (see the 'logisim_result_cache' setting).
+    """
+    
+    # attributes that only change how a component looks
+    COSMETIC_ATTRIBUTES = set(["labelfont", "labelloc", "labelcolor", "labelvisible", "font", "halign", "valign"])
+    COSMETIC_CIRCUIT_ATTRIBUTES = set(["clabel", "clabelup", "clabelfont", "circuitvhdlpath"])
+    # components whose label means something (the rest are just annotation)
+    LABELED_COMPONENTS = set(["Pin", "Tunnel", "Probe", "Clock", "Register", "Counter", "Shift Register", "RAM", "ROM"])
+    # components whose one and only pin is at their anchor
+    SINGLE_PIN_COMPONENTS = set(["Pin", "Tunnel", "Probe", "Constant", "Clock", "Power", "Ground"])
+    PIN_RADIUS = 100 # how far from its anchor an ordinary component's pins may be
+    MEMORY_PIN_RADIUS = 400 # same, for the big #Memory components
+    MAX_REFINEMENT_ROUNDS = 50
+    
+    def __init__(self, filename):
+        self.filename = filename
+        root = ET.parse(filename).getroot()
+        self.libs = dict((lib.attrib['name'], lib.attrib.get('desc', '')) for lib in root.findall('lib'))
+        self.circuits = OrderedDict((circuit.attrib['name'], circuit) for circuit in root.findall('circuit'))
+        self.main = root.find('main')
+        self.options = root.find('options')
+        self.circuit_fingerprints = {} # name -> fingerprint, computed on first use by get_circuit_fingerprint()
+        self.circuit_radii = {}        # name -> pin radius of an instance of it
+        self.in_progress = set()
+        
+    @staticmethod
+    def fingerprint_file(filename, seen_files=None):
+        """
+        Returns the fingerprint (a hex digest) of the given .circ file, including the circuit files it loads as libraries.
+        """
+        return LogisimFingerprint(filename).get_fingerprint(seen_files)
+        
+    @staticmethod
+    def digest(*parts):
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+        
+    @staticmethod
+    def parse_point(s):
+        m = re.match(r'\s*\(?\s*(-?\d+)\s*,\s*(-?\d+)\s*\)?\s*$', s)
+        return (int(m.group(1)), int(m.group(2)))
+        
+    @staticmethod
+    def get_attributes(element, ignore=()):
+        """
+        Returns the <a name=... val=...> attributes of the given element as a sorted list of (name, value) tuples.
+        """
+        attributes = []
+        for a in element.findall('a'):
+            if a.attrib['name'] not in ignore:
+                attributes.append((a.attrib['name'], a.attrib.get('val', a.text or '')))
+        return sorted(attributes)
+        
+    def get_fingerprint(self, seen_files=None):
+        """
+        Returns the fingerprint of the whole file: its circuits (by name, as penalty checks care about names), which is main, 
+        and the simulation options.
+        """
+        seen_files = set(seen_files or []) | set([os.path.abspath(self.filename)])
+        libs = sorted(self.get_lib_identity(desc, seen_files) for desc in self.libs.values())
+        circuits = [(name, self.get_circuit_fingerprint(name)) for name in sorted(self.circuits)]
+        main = iff(self.main is None, None, self.main.attrib.get('name'))
+        options = iff(self.options is None, lambda: [], lambda: self.get_attributes(self.options))()
+        return self.digest("logisim", libs, circuits, main, options)
+        
+    def get_lib_identity(self, desc, seen_files):
+        """
+        Built-in libraries are identified by their description (e.g. "#Gates"); circuit files loaded as libraries by their own
+        fingerprint.
+        """
+        if not desc.startswith("file#"):
+            return desc
+        filename = os.path.join(os.path.dirname(self.filename), desc[len("file#"):])
+        if os.path.abspath(filename) in seen_files or not os.path.isfile(filename):
+            return desc
+        return "file#" + LogisimFingerprint.fingerprint_file(filename, seen_files)
+        
+    def get_component_identity(self, comp):
+        """
+        Returns (label, pin radius) for a <comp> element, or None for a component that's only annotation.
+        """
+        lib = self.libs.get(comp.attrib.get('lib'))
+        name = comp.attrib['name']
+        if lib == "#Base" and name == "Text":
+            return None
+        ignore = set(LogisimFingerprint.COSMETIC_ATTRIBUTES)
+        if name not in LogisimFingerprint.LABELED_COMPONENTS and not (lib is None and name in self.circuits):
+            ignore.add("label")
+        attributes = dict(self.get_attributes(comp, ignore))
+        
+        if lib is None and name in self.circuits:
+            return self.digest("circuit", name, self.get_circuit_fingerprint(name), sorted(attributes.items())), self.circuit_radii[name]
+        label = self.digest(lib, name, sorted(attributes.items()))
+        if name in LogisimFingerprint.SINGLE_PIN_COMPONENTS:
+            return label, 0
+        if name == "Splitter":
+            return label, 10 * int(attributes.get('spacing', '1')) * (int(attributes.get('fanout', '2')) + 2)
+        if lib == "#Memory":
+            return label, LogisimFingerprint.MEMORY_PIN_RADIUS
+        inputs = int(attributes.get('inputs', '0')) if attributes.get('inputs', '').isdigit() else 0
+        selects = int(attributes.get('select', '0')) if attributes.get('select', '').isdigit() else 0
+        return label, LogisimFingerprint.PIN_RADIUS + 10*inputs + iff(selects, 10 * 2**selects, 0)
+        
+    def get_circuit_fingerprint(self, name):
+        """
+        Returns the fingerprint of the named circuit (memoized), also working out the pin radius of its instances.
+        """
+        if name in self.circuit_fingerprints:
+            return self.circuit_fingerprints[name]
+        if name in self.in_progress:
+            raise ValueError("%s: circuit '%s' contains itself" % (self.filename, name))
+        self.in_progress.add(name)
+        circuit = self.circuits[name]
+        
+        # components: (label, anchor, pin radius)
+        components = []
+        for comp in circuit.findall('comp'):
+            identity = self.get_component_identity(comp)
+            if identity is not None:
+                components.append((identity[0], self.parse_point(comp.attrib['loc']), identity[1]))
+        wires = [(self.parse_point(wire.attrib['from']), self.parse_point(wire.attrib['to'])) for wire in circuit.findall('wire')]
+        
+        # nets: union-find over the points, i.e. wire ends and component anchors
+        parent = {}
+        def find(p):
+            while parent[p] != p:
+                parent[p] = parent[parent[p]]
+                p = parent[p]
+            return p
+        def union(p, q):
+            parent[find(p)] = find(q)
+        for wire in wires:
+            for p in wire:
+                parent.setdefault(p, p)
+        for label, anchor, radius in components:
+            parent.setdefault(anchor, anchor)
+        horizontal = {} # y -> wires along it
+        vertical = {}   # x -> wires along it
+        for a, b in wires:
+            union(a, b)
+            if a[1] == b[1]:
+                horizontal.setdefault(a[1], []).append((min(a[0], b[0]), max(a[0], b[0]), a))
+            elif a[0] == b[0]:
+                vertical.setdefault(a[0], []).append((min(a[1], b[1]), max(a[1], b[1]), a))
+        for p in list(parent):
+            for lo, hi, end in horizontal.get(p[1], []):
+                if lo < p[0] < hi:
+                    union(p, end)
+            for lo, hi, end in vertical.get(p[0], []):
+                if lo < p[1] < hi:
+                    union(p, end)
+                    
+        # tie each component to the nets of the points within its pin radius (found via a grid of buckets that size)
+        bucket_size = max([radius for label, anchor, radius in components] + [LogisimFingerprint.PIN_RADIUS])
+        buckets = {}
+        for p in parent:
+            buckets.setdefault((p[0] // bucket_size, p[1] // bucket_size), []).append(p)
+        component_edges = [] # per component, (offset, net)
+        net_edges = {}       # net -> [(offset, component index)]
+        for i, (label, anchor, radius) in enumerate(components):
+            edges = []
+            bx, by = anchor[0] // bucket_size, anchor[1] // bucket_size
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for p in buckets.get((bx+dx, by+dy), []):
+                        offset = (p[0]-anchor[0], p[1]-anchor[1])
+                        if max(abs(offset[0]), abs(offset[1])) <= radius:
+                            net = find(p)
+                            edges.append((offset, net))
+                            net_edges.setdefault(net, []).append((offset, i))
+            component_edges.append(edges)
+            
+        # Weisfeiler-Lehman refinement
+        component_colors = [label for label, anchor, radius in components]
+        net_colors = dict((net, "net") for net in net_edges)
+        num_classes = 0
+        for i in range(LogisimFingerprint.MAX_REFINEMENT_ROUNDS):
+            component_colors, net_colors = (
+                [self.digest(component_colors[c], sorted((offset, net_colors[net]) for offset, net in component_edges[c])) for c in range(len(components))],
+                dict((net, self.digest(sorted((offset, component_colors[c]) for offset, c in edges))) for net, edges in net_edges.items()))
+            new_num_classes = len(set(component_colors)) + len(set(net_colors.values()))
+            if new_num_classes == num_classes:
+                break
+            num_classes = new_num_classes
+            
+        # the custom appearance decides where an instance's pins are; its ports are identified by the pins they stand for
+        appearance = []
+        radius = LogisimFingerprint.PIN_RADIUS + 20 * sum(1 for comp in circuit.findall('comp') if comp.attrib['name'] == "Pin")
+        appear = circuit.find('appear')
+        anchor = None if appear is None else appear.find('circ-anchor')
+        if anchor is not None:
+            anchor_point = (int(float(anchor.attrib['x'])), int(float(anchor.attrib['y'])))
+            color_at = dict((components[c][1], component_colors[c]) for c in range(len(components)))
+            for port in appear.findall('circ-port'):
+                offset = (int(float(port.attrib['x'])) - anchor_point[0], int(float(port.attrib['y'])) - anchor_point[1])
+                appearance.append((offset, port.attrib.get('width'), port.attrib.get('height'), color_at.get(self.parse_point(port.attrib['pin']))))
+                radius = max(radius, abs(offset[0]) + 20, abs(offset[1]) + 20)
+            appearance.sort()
+            appearance.append(anchor.attrib.get('facing'))
+            
+        self.circuit_fingerprints[name] = self.digest(self.get_attributes(circuit, LogisimFingerprint.COSMETIC_CIRCUIT_ATTRIBUTES),
+            appearance, sorted(component_colors), sorted(net_colors.values()))
+        self.circuit_radii[name] = radius
+        self.in_progress.discard(name)
+        return self.circuit_fingerprints[name]
+
 class FileFilter(object):
     """
     Methods to filter output files. Allows easy composition of filters to do multiple things at once. 
@@ -606,46 +1426,146 @@ class JSONWrapper(object):
     # these other dict-alike methods taken from https://stackoverflow.com/questions/3387691/how-to-perfectly-override-a-dict
     def __setitem__(self,k,v):
         self.json[k] = v
+        self.settings_changed()
     def __iter__(self):
         return iter(self.json)
     def __delitem__(self, key):
-        del self.store[key]
+        del self.json[key]
+        self.settings_changed()
     def __len__(self):
         return len(self.json)
         
+    def settings_changed(self):
+        # called when a setting is changed through this object; for subclasses that keep anything worked out from the settings
+        pass
+        
     def __repr__(self):
         return str(self.json)
     __str__ = __repr__
 
+class MessageSpill(object):
+    """
+    Somewhere to keep long test messages out of memory until they're needed: they're appended to an anonymous temporary file
+    (which goes away when closed, at the latest when the process ends) and read back by position. Each Tester has one, shared
+    by its threads. Whatever grades many submissions in one process closes each one's spill once it's done with the results
+    (see BatchGrader.finish and GradingServer.grade), so as not to hold a file open per submission.
+    """
+    
+    def __init__(self):
+        self.file = None # created on first use
+        self.lock = threading.Lock()
+        
+    def put(self, message):
+        """
+        Store the given message, returning the key to get() it back with.
+        """
+        if not isinstance(message, bytes): # a str is already bytes in python 2 [PY2]
+            message = message.encode('utf-8')
+        with self.lock:
+            if self.file is None:
+                self.file = tempfile.TemporaryFile()
+            self.file.seek(0, os.SEEK_END)
+            offset = self.file.tell()
+            self.file.write(message)
+            return (offset, len(message))
+            
+    def get(self, key):
+        offset, length = key
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(length).decode('utf-8')
+            
+    def close(self):
+        """
+        Discard the stored messages. Results whose messages were spilled can't be read after this.
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            
 class TestResult(object):
     """
-    Encapsulates the result of a test execution.
+    Encapsulates the result of a test execution. Slotted, as there can be a great many of them (see also MessageSpill), and 
+    holding on to just what it needs of the test rather than the Test itself, so generated tests can go once they've run.
     """
     
-    def __init__(self, test, is_pass, points, message, error_flags):
-        self.test = test # reference to the test object
+    __slots__ = ('suite', 'test_num', 'desc', 'is_pass', 'points', '_message', '_spilled_message', 'error_flags', 'usage', 'elapsed_time', 'max_points', 'visibility', 'counters')
+    
+    def __init__(self, test, is_pass, points, message, error_flags, usage=None, elapsed_time=None, counters=None):
+        self.suite = test.suite
+        self.test_num = test.test_num
+        self.desc = test['desc']
         self.is_pass = is_pass
         self.points = points # will be None if this isnt the grader
         self.message = message # long form output string for use in gradescope result
         self.error_flags = error_flags # short form string tokens for use in tester stdout
+        self.usage = usage # ResourceUsage of the test's main execution, if known
+        self.elapsed_time = elapsed_time # wall clock seconds for the whole test, including diffing and valgrind
+        self.counters = counters # HarnessCounters of the harness's own work on the test, if known
         self.max_points = test.get("points",None) # will be None if this isnt the grader
         self.visibility = test.get("visibility","visible")
         
+    @property
+    def name(self):
+        return "%s test %d: %s" % (self.suite.name, self.test_num, self.desc)
+        
+    @property
+    def message(self):
+        if self._spilled_message is not None:
+            return self.suite.tester.message_spill.get(self._spilled_message)
+        return self._message
+        
+    @message.setter
+    def message(self, message):
+        if len(message) > MESSAGE_SPILL_BYTES:
+            self._message, self._spilled_message = None, self.suite.tester.message_spill.put(message)
+        else:
+            self._message, self._spilled_message = message, None
+        
     def to_gradescope_dictionary(self):
         """
         Returns a dictionary appropriate for JSON-ifying and including in GradeScope's results.json
         """
-        return {   
-            "name": self.test.name,
+        d = {   
+            "name": self.name,
             "score": self.points,
             "max_score": self.max_points,
             "output": self.message,
             "visibility": self.visibility
         }
+        if self.usage is not None:
+            d["extra_data"] = {"usage": self.usage.to_dictionary()}
+        return d
+        
+    def to_dictionary(self):
+        """
+        Returns a dictionary appropriate for JSON-ifying, from which from_dictionary() can recreate this result.
+        """
+        return OrderedDict([
+            ("test_num", self.test_num),
+            ("is_pass", self.is_pass),
+            ("points", self.points),
+            ("message", self.message),
+            ("error_flags", self.error_flags),
+            ("usage", None if self.usage is None else self.usage.to_dictionary()),
+            ("elapsed_time", self.elapsed_time),
+            ("counters", None if self.counters is None else self.counters.to_dictionary()),
+        ])
+        
+    @staticmethod
+    def from_dictionary(suite, d):
+        """
+        The inverse of to_dictionary(), for a result of one of the given suite's tests.
+        """
+        return TestResult(suite.tests[d['test_num']], d['is_pass'], d['points'], d['message'], d['error_flags'], 
+            usage=ResourceUsage.from_dictionary(d['usage'] or {}), elapsed_time=d['elapsed_time'],
+            counters=None if d.get('counters', None) is None else HarnessCounters.from_dictionary(d['counters']))
         
-    def get_console_line(self):
+    def get_console_line(self, show_suite=False):
         """
-        Returns a one-line string suitable for printing straight to the console
+        Returns a one-line string suitable for printing straight to the console. 
+        If show_suite is true, the suite name is included (for when results of different suites are interleaved).
         """
         if self.is_pass:
             status = TextColors.GREEN + "Pass" + TextColors.END
@@ -657,32 +1577,54 @@ class TestResult(object):
         else:
             error_flag_str = ""
             
+        test_str = "Test %d " % self.test_num
+        if show_suite:
+            test_str = "%s %s" % (self.suite.name, test_str)
         if self.max_points is not None:
             scoring = "%0.2f/%0.2f" % (self.points, self.max_points)
-            return "%-10s %-50s %-20s %-15s %s" % ("Test %d " % self.test.test_num, self.test['desc'], status, scoring, error_flag_str)
+            return "%-10s %-50s %-20s %-15s %s" % (test_str, self.desc, status, scoring, error_flag_str)
         else:
-            return "%-10s %-50s %-20s %s" % ("Test %d " % self.test.test_num, self.test['desc'], status, error_flag_str)
+            return "%-10s %-50s %-20s %s" % (test_str, self.desc, status, error_flag_str)
 
 class TestResultSet(object):
     """
     Encapsulates the result of running a number of test suites. Meant to be created, then appended to with test results 
     (via .add_result()) and top-level messages (via .append_message()).
     
-    Two TestResultSets can be added together, combining their test results, message, etc.
+    Two TestResultSets can be added together, combining their test results, message, etc. Use += to accumulate many of them,
+    as that appends in place.
     
     Once built, you can do get_points(), get_max_points(), and generate_gradescope_results().
     """
     
     def __init__(self, test_results=None, message="", elapsed_time=0):
         self.test_results = iff(test_results is None,[],test_results) # array of TestResult objects, one for each test run
-        self.message = message # to be included in top-level output in the gradescope results
+        self.message_chunks = iff(message, [message], []) # to be included in top-level output in the gradescope results (see message)
         self.elapsed_time = elapsed_time # to be included in gradescope results
         
+    @property
+    def message(self):
+        if len(self.message_chunks) > 1:
+            self.message_chunks = ["".join(self.message_chunks)]
+        return "".join(self.message_chunks)
+        
     def __add__(self, other):
         """
         Allow concatenation of two TestResultSet objects -- this lets us combine results for multiple suites.
         """
-        return TestResultSet(self.test_results + other.test_results, self.message + other.message, self.elapsed_time + other.elapsed_time)
+        test_result_set = TestResultSet(list(self.test_results), elapsed_time=self.elapsed_time)
+        test_result_set.message_chunks = list(self.message_chunks)
+        test_result_set += other
+        return test_result_set
+        
+    def __iadd__(self, other):
+        """
+        In-place flavor of __add__, for accumulating results without copying them over and over.
+        """
+        self.test_results.extend(other.test_results)
+        self.message_chunks.extend(other.message_chunks)
+        self.elapsed_time += other.elapsed_time
+        return self
         
     def add_result(self, test_result):
         """
@@ -708,7 +1650,8 @@ class TestResultSet(object):
         """
         Add to the top-level message included in GradeScope results.
         """
-        self.message += message
+        if message:
+            self.message_chunks.append(message)
         
     def get_points(self):
         """
@@ -722,11 +1665,21 @@ class TestResultSet(object):
         """
         return sum(tr.max_points for tr in self.test_results)
         
-    def generate_gradescope_results(self, json_filename="results.json", compile_output_filename="compile_output.txt"):
+    def generate_gradescope_results(self, json_filename="results.json", compile_output_filename="compile_output.txt", extra_data=None):
+        """
+        Generate a results.json compatible with GradeScope (see get_gradescope_dictionary).
+        """
+        gradescope_result = self.get_gradescope_dictionary(compile_output_filename, extra_data)
+
+        # write it (atomically, so a reader -- or a resumed batch run -- never sees half a file)
+        Utility.write_file_atomically(json_filename, json.dumps(gradescope_result, indent=2, separators=(',', ': ')))
+        
+    def get_gradescope_dictionary(self, compile_output_filename="compile_output.txt", extra_data=None):
         """
-        Generate a results.json compatible with GradeScope. Incorporates test results as well as a 
+        Returns the content of a GradeScope results.json. Incorporates test results as well as a 
         top-level message that includes the append_message provided at object creation time. Also folds in
-        compiler output from a given text file, if available.
+        compiler output from a given text file, if available, and the given extra_data dictionary, if any.
+        Test messages are shortened as needed to keep the whole within the 'results_max_bytes' setting.
         """
         
         # top level message for gradescope
@@ -740,37 +1693,116 @@ class TestResultSet(object):
             
         message += self.message
         
+        # the individual test result jsons, sharing what room there is
+        tests = [tr.to_gradescope_dictionary() for tr in self.test_results]
+        max_bytes = iff(self.test_results, lambda: self.test_results[0].suite.get('results_max_bytes', None), lambda: None)()
+        if max_bytes:
+            OutputSummarizer.fit_messages(tests, max(max_bytes - len(message), 0))
+        
         # this is the top-level json for gradescope; it incorates the individual test result jsons
         gradescope_result = {
             "score": self.get_points(),
             "stdout_visibility": "hidden",
             "output": message,
-            "tests": [tr.to_gradescope_dictionary() for tr in self.test_results],
+            "tests": tests,
             "execution_time": self.elapsed_time
         }
-
-        # write it
-        with open(json_filename, "w+") as result_file:
-            json.dump(gradescope_result, result_file, indent=2, separators=(',', ': '))
+        if extra_data:
+            gradescope_result["extra_data"] = extra_data
+        return gradescope_result
 
 class PrereqMissing(Exception): 
     """
     Special exception class for when a pre-req to a test execution is missing (like missing the executable, the spim tool, etc.)
     """
     pass
+    
+class Cancelled(Exception):
+    """
+    Raised by a test that was cut short because its Tester was cancelled (see Tester.cancel).
+    """
+    pass
 
+class TestSpec(object):
+    """
+    A test's settings compiled for fast access: all of its effective settings in one flat dictionary (the Test -> Suite -> 
+    Tester inheritance resolved once), plus the things worked out from them again and again -- the command, target and file 
+    names. Read-only: settings are changed through the Test, Suite or Tester, which then has the affected specs recompiled.
+    """
+    
+    __slots__ = ('settings', 'mode', 'command', 'uses_java', 'target', 'target_filename', 'expected_output_filename', 
+        'actual_output_filename', 'diff_filename', 'asan_log_prefix')
+    
+    def __init__(self, test):
+        suite = test.suite
+        settings = dict(suite.tester.json)
+        settings.update(suite.json)
+        settings.update(test.json)
+        assign = lambda name, value: object.__setattr__(self, name, value)
+        assign('settings', settings)
+        assign('mode', suite['mode']) # tests don't have modes of their own
+        assign('target', suite.get_target())
+        assign('target_filename', suite.get_target_filename())
+        
+        # the command, less the java executable, which isn't looked for until needed (see Test.get_command)
+        assign('uses_java', self.mode in ("java","logisim"))
+        if self.mode == "exe":
+            assign('command', [self.target] + settings['args'])
+        elif self.mode == "java":
+            assign('command', [self.target] + settings['args'])
+        elif self.mode == "spim":
+            assign('command', [settings['spim_command'], "-f", self.target]) # Note: "args" field is not used in this mode
+        elif self.mode == "logisim":
+            assign('command', ["-jar", suite.tester.harness_path(settings['logisim_jar']), "-f", self.target] + settings['args'])
+        else:
+            raise Exception("Internal error determining test target")
+            
+        # filenames for the expected/generated files associated with the test
+        if 'oracle' in settings: # then the expected output is generated for each run
+            assign('expected_output_filename', os.path.join(settings['output_dir'], "%s_oracle_%d.txt" % (suite.name, test.test_num)))
+        else:
+            assign('expected_output_filename', os.path.join(settings['test_dir'], "%s_expected_%d.txt" % (suite.name, test.test_num)))
+        assign('actual_output_filename', os.path.join(settings['output_dir'], "%s_actual_%d.txt" % (suite.name, test.test_num)))
+        assign('diff_filename', os.path.join(settings['output_dir'], "%s_diff_%d.txt" % (suite.name, test.test_num)))
+        assign('asan_log_prefix', os.path.abspath(os.path.join(settings['output_dir'], "%s_asan_%d.log" % (suite.name, test.test_num)))) # sanitizers append .PID
+        
+    def __setattr__(self, name, value):
+        raise AttributeError("TestSpec is read-only")
+        
 class Test(JSONWrapper):
     """
     Encapsulates a single test, i.e. the one element in the settings['test_suites'][suite_name]['tests'] list.
-    It's parent is its TestSuite.
+    It's parent is its TestSuite. Settings are looked up in its TestSpec rather than up the chain of parents.
     """
-    def __init__(self, suite, test_num):
-        super(Test,self).__init__(suite.json['tests'][test_num], parent=suite)
+    def __init__(self, suite, test_num, settings=None):
+        if settings is None: # (it's given for generated tests; see TestGenerator)
+            settings = suite.json['tests'][test_num]
+        super(Test,self).__init__(settings, parent=suite)
         self.suite = suite
         self.test_num = test_num
+        self.spec = None # compiled on first use by get_spec()
         
         self.name = "%s test %d: %s" % (self.suite.name, self.test_num, self['desc'])
         
+    def get_spec(self):
+        """
+        Returns this test's TestSpec, compiling it if it hasn't been since the settings last changed.
+        """
+        spec = self.spec
+        if spec is None:
+            spec = self.spec = TestSpec(self)
+        return spec
+        
+    def settings_changed(self):
+        self.spec = None
+        
+    def __getitem__(self, k):
+        return self.get_spec().settings[k]
+    def get(self, k, default):
+        return self.get_spec().settings.get(k, default)
+    def has(self, k):
+        return k in self.get_spec().settings
+        
     def __repr__(self):
         return "Test '%s' {%s}" % (self.name, ", ".join("%s: %s" %(k,v) for k,v in self.json.items()))
     __str__ = __repr__
@@ -779,23 +1811,17 @@ class Test(JSONWrapper):
         """
         Returns a tuple of the full argv of the command, including the base command (argv[0]) and all arguments after the command it (argv[1:])
         """
-        mode = self.suite['mode']
-        if mode == "exe":
-            return [self.suite.get_target()] + self['args']
-        elif mode == "java":
-            return [Utility.find_java(), self.suite.get_target()] + self['args']
-        elif mode == "spim":
-            return [self['spim_command'], "-f", self.suite.get_target()] # Note: "args" field is not used in this mode
-        elif mode == "logisim":
-            return [Utility.find_java(), "-jar", self['logisim_jar'], "-f", self.suite.get_target()] + self['args']
-        else:
-            raise Exception("Internal error determining test target")
+        spec = self.get_spec()
+        if spec.uses_java:
+            return [Utility.find_java()] + spec.command
+        return list(spec.command)
     
     def check_prereq_missing(self, include_valgrind_check=False):
         """
         Raises a PrereqMissing exception if a key ingredient is missing.
         """
-        mode = self.suite['mode']
+        spec = self.get_spec()
+        mode = spec.mode
         
         # ensure java if needed
         if mode in ("java","logisim"):
@@ -804,62 +1830,288 @@ class Test(JSONWrapper):
                 raise PrereqMissing("Missing java interpreter -- install JVM 1.6/1.7/1.8 ('sudo apt install openjdk-8-jre' on Ubuntu Linux).")
                 
         if mode == "exe":
-            if not Utility.verify_executable(self.suite.get_target(), use_path=False):
-                raise PrereqMissing("Missing executable: %s -- did you forget to compile?" % self.suite.get_target())
+            if not Utility.verify_executable(spec.target, use_path=False):
+                raise PrereqMissing("Missing executable: %s -- did you forget to compile?" % spec.target)
         elif mode == "java": 
-            classfile = "%s.class" % self.suite.get_target()
+            classfile = spec.target_filename
             if not os.path.isfile(classfile):
                 raise PrereqMissing("Missing class file: %s -- did you forget to compile?" % classfile)
         elif mode == "spim":
             if not Utility.verify_executable(self['spim_command'],use_path=True):
                 raise PrereqMissing("Missing command-line spim -- install it ('sudo apt install spim' on Ubuntu Linux)")
-            if not os.path.isfile(self.suite.get_target()):
-                raise PrereqMissing("Missing program: %s" % self.suite.get_target())
+            if not os.path.isfile(spec.target):
+                raise PrereqMissing("Missing program: %s" % spec.target)
         elif mode == "logisim":
-            if not os.path.isfile(self.suite.get_target()):
-                raise PrereqMissing("Missing circuit: %s" % self.suite.get_target())
+            if not os.path.isfile(spec.target):
+                raise PrereqMissing("Missing circuit: %s" % spec.target)
         else:
             raise Exception("Internal error checking prereqs -- invalid mode")
         
         global has_valgrind
         if has_valgrind and include_valgrind_check and not Utility.verify_executable("valgrind",True):
             has_valgrind = False
-            print(TextColors.RED + "Missing valgrind tool -- install it ('sudo apt install valgrind' on Ubuntu Linux)\n\
+            self.suite.tester.reporter.warning("Missing valgrind tool -- install it ('sudo apt install valgrind' on Ubuntu Linux)\n\
 The tests below will skip the valgrind checks.\n\
-You should test on a platform with valgrind before turning this in!" + TextColors.END)
+You should test on a platform with valgrind before turning this in!")
 
         
     # filenames for the expected/generated files associated with this test
-    def expected_output_filename(self):         return os.path.join(self['test_dir'], "%s_expected_%d.txt" % (self.suite.name, self.test_num))
-    def actual_output_filename(self):           return os.path.join(self['test_dir'], "%s_actual_%d.txt" % (self.suite.name, self.test_num))
+    def expected_output_filename(self):         return self.get_spec().expected_output_filename
+    def actual_output_filename(self):           return self.get_spec().actual_output_filename
     def actual_output_backup_filename(self):    return "%s.orig" % self.actual_output_filename()
-    def diff_filename(self):                    return os.path.join(self['test_dir'], "%s_diff_%d.txt" % (self.suite.name, self.test_num))
+    def diff_filename(self):                    return self.get_spec().diff_filename
+    def asan_log_prefix(self):                  return self.get_spec().asan_log_prefix
+    def input_filename(self):                   return os.path.join(self['output_dir'], "%s_input_%d.txt" % (self.suite.name, self.test_num))
+    def unpacked_expected_output_filename(self): return os.path.join(self['output_dir'], "%s_unpacked_%d.txt" % (self.suite.name, self.test_num))
+    
+    def get_stdin_filename(self):
+        """
+        Returns the file to give the test as its standard input, if any: the 'stdin' setting, or else a file holding the text of
+        the 'input' setting (written here). A stdin file in the test archive is written out as the latter.
+        """
+        if self.has('input'):
+            with open(self.input_filename(), "w") as fp:
+                fp.write(self['input'])
+            return self.input_filename()
+        stdin_filename = self.get('stdin', None)
+        archive = self.suite.tester.get_archive()
+        if stdin_filename is not None and archive is not None:
+            data = archive.get(archive.get_member_name(stdin_filename))
+            if data is not None:
+                with open(self.input_filename(), "wb") as fp:
+                    fp.write(data)
+                return self.input_filename()
+        return stdin_filename
+        
+    def get_expected_output(self):
+        """
+        Returns the expected output (as bytes) from the test archive if there is one, else from the expected output file; None 
+        if there isn't any.
+        """
+        archive = self.suite.tester.get_archive()
+        if archive is not None and not self.has('oracle'):
+            return archive.get(archive.get_member_name(self.expected_output_filename()))
+        try:
+            with open(self.expected_output_filename(), "rb") as fp:
+                return fp.read()
+        except (IOError, OSError):
+            return None
+            
+    def get_expected_output_file(self):
+        """
+        Returns a file holding the expected output, for tools that need one: the expected output file, or if that's in the test
+        archive, a copy written out to the output_dir.
+        """
+        archive = self.suite.tester.get_archive()
+        if archive is None or self.has('oracle'):
+            return self.expected_output_filename()
+        data = self.get_expected_output()
+        if data is None:
+            return self.expected_output_filename() # missing, which the diff will point out
+        with open(self.unpacked_expected_output_filename(), "wb") as fp:
+            fp.write(data)
+        return self.unpacked_expected_output_filename()
+        
+    def hash_expected_output(self):
+        """
+        Returns the SHA-1 hex digest of the expected output, or None if there isn't any.
+        """
+        data = self.get_expected_output()
+        if data is None:
+            return None
+        return hashlib.sha1(data).hexdigest()
+        
+    def get_packable_filenames(self):
+        """
+        Returns the files of this test that belong in the test archive: the expected output and stdin files in the test_dir.
+        """
+        filenames = []
+        if not self.has('oracle'):
+            filenames.append(self.expected_output_filename())
+        if self.has('stdin'):
+            filenames.append(self['stdin'])
+        test_dir = os.path.abspath(self['test_dir'])
+        return [filename for filename in filenames if os.path.abspath(filename).startswith(test_dir + os.sep) and os.path.isfile(filename)]
+        
+    def run_oracle(self):
+        """
+        For a test with an 'oracle' setting, generate its expected output by running that command (from our directory, with the 
+        test's input) in place of the submission.
+        """
+        oracle = self['oracle']
+        if not Utility.verify_executable(oracle[0], use_path=os.path.basename(oracle[0]) == oracle[0]):
+            raise PrereqMissing("Missing oracle command: %s" % oracle[0])
+        verbose_print("Generating expected output: %s" % " ".join(oracle))
+        exitcode = Utility.run_process(oracle, output_file=self.expected_output_filename(), input_file=self.get_stdin_filename(), timeout=self['timeout'])
+        if exitcode != 0:
+            raise Exception("SETTINGS ERROR: The oracle command for %s failed (exit status %d): %s" % (self.name, exitcode, " ".join(oracle)))
+
+    def asan_log_filenames(self):
+        """
+        Returns the sanitizer report files left behind by the last sanitizer run of this test (one per process that reported an error).
+        """
+        return glob.glob("%s.*" % self.asan_log_prefix())
+
+    def get_timeout(self):
+        """
+        Returns the timeout in effect for this test. That's the 'timeout' setting, unless 'adaptive_timeout' is set and the test
+        has been calibrated (see Tester.calibrate_suites), in which case it's max(floor, multiplier * percentile of the reference 
+        solution's times), capped at 'timeout'. Times are CPU or wall clock according to timeout_kind.
+        """
+        adaptive = self.get('adaptive_timeout', None)
+        if not adaptive:
+            return self['timeout']
+        samples = self.suite.tester.get_calibration().get_samples(self, self['timeout_kind'])
+        if not samples:
+            return self['timeout']
+        setting = lambda name: adaptive.get(name, ADAPTIVE_TIMEOUT_DEFAULTS[name])
+        return min(self['timeout'], max(setting('floor'), setting('multiplier') * Utility.percentile(samples, setting('percentile'))))
+        
+    def get_asan_target(self):
+        """
+        Returns the sanitizer build to run in place of the usual target if this test checks memory with memcheck="asan", else None.
+        """
+        if self.has("penalty_valgrind") and self['memcheck'] == "asan":
+            return self.suite.get_asan_target()
+        return None
+        
+    def get_cost(self):
+        """
+        Returns a rough (cores, memory MB) estimate of what running this test takes, for the ConcurrencyGovernor.
+        """
+        cores, memory_mb = MODE_COSTS[self.get_spec().mode]
+        if self.has("penalty_valgrind"):
+            memory_mb *= MEMCHECK_COST_MULTIPLIER
+        return cores, memory_mb
+        
+    def get_rlimits(self, include_memory=True):
+        """
+        Translate the 'limits' setting, e.g. {"cpu_seconds": 5, "memory_mb": 256, "file_size_mb": 16, "processes": 64}, into a list of
+        (resource.RLIMIT_*, value) pairs for Utility.run_process. The memory limit caps address space rather than RSS, so it's left
+        off when include_memory is false and for JVM modes, all of which reserve far more address space than they ever touch.
+        Note that 'processes' counts every process of the user running the tester, and doesn't apply at all to root.
+        """
+        limits = self.get('limits', {})
+        if resource is None:
+            if limits:
+                verbose_print("Resource limits are not supported on this platform; ignoring 'limits'.")
+            return []
+        rlimits = []
+        for name, value in limits.items():
+            if name not in LIMIT_TYPES:
+                raise ValueError("SETTINGS ERROR: Invalid limit: %s (valid limits: %s)" % (name, ", ".join(LIMIT_TYPES)))
+            resource_name, multiplier, flag = LIMIT_TYPES[name]
+            if name == 'memory_mb' and (not include_memory or self.get_spec().mode in ("java","logisim")):
+                continue
+            rlimits.append((getattr(resource, resource_name), int(value * multiplier)))
+        return rlimits
+        
+    def get_limit_exceeded(self, exitcode, usage):
+        """
+        Work out whether a failed execution was stopped by one of our 'limits'. 
+        Returns an (error_flag, message) tuple if so, else None. A hit on the 'processes' limit just makes fork() fail inside the
+        program, so it can't be told apart from any other failure. The memory limit is judged by the child's own peak RSS, which 
+        is unknown (None) when it's no more than what the child inherited from us (see ResourceUsage.set_rusage), so a small 
+        program failing under a small limit isn't blamed on the limit.
+        """
+        limits = self.get('limits', {})
+        if 'cpu_seconds' in limits and (exitcode == -signal.SIGXCPU or (exitcode == -signal.SIGKILL and usage.get_cpu_time() is not None and usage.get_cpu_time() >= limits['cpu_seconds'])):
+            return 'cpu_limit', "Test exceeded its CPU time limit of %s seconds!\n" % limits['cpu_seconds']
+        if 'file_size_mb' in limits and (exitcode == -signal.SIGXFSZ or (usage.output_bytes is not None and usage.output_bytes >= limits['file_size_mb']*1024*1024)):
+            return 'file_size_limit', "Test exceeded its output file size limit of %s MB!\n" % limits['file_size_mb']
+        if 'memory_mb' in limits and exitcode != 0 and usage.max_rss_kb is not None and usage.max_rss_kb*1024 >= MEMORY_LIMIT_DETECT_FRACTION*limits['memory_mb']*1024*1024:
+            return 'memory_limit', "Test exceeded its memory limit of %s MB!\n" % limits['memory_mb']
+        return None
 
-    def execute(self, add_valgrind=False, suppress_output=False):
+    def execute(self, add_valgrind=False, suppress_output=False, asan_target=None, usage=None, timeout=None):
         """
         Execute a test, write output to usual files, return exitcode. 
         If add_valgrind is true, run with valgrind (in which case exitcode will be EXITCODE_VALGRIND_ERROR if valgrind reported an issue).
         If suppress_output is true, then the usual stdout redirect will be disabled.
+        If asan_target is given, it's run in place of the suite's executable (its exit status is still the program's own; see asan_log_filenames() for whether a sanitizer reported an issue).
+        If usage (a ResourceUsage) is given, it's filled in with what the process consumed.
+        If timeout is given, it's used in place of get_timeout(). With timeout_kind "cpu", EXITCODE_TIMEOUT means the process used up its CPU time or hit the wall-clock backstop.
         """
         
-        self.check_prereq_missing(include_valgrind_check=add_valgrind) # raise exception if we dont have the files we need
+        tester = self.suite.tester
+        if tester.cancelled.is_set():
+            raise Cancelled()
+        with tester.profiler.phase(self.suite, "prereqs"):
+            self.check_prereq_missing(include_valgrind_check=add_valgrind) # raise exception if we dont have the files we need
         
         command_argv = self.get_command()
+        env = None
         if has_valgrind and add_valgrind:
             command_argv = ["valgrind","-q","--error-exitcode=%d" % EXITCODE_VALGRIND_ERROR,"--show-reachable=yes","--leak-check=full"] + command_argv
+        elif asan_target is not None:
+            command_argv = [asan_target] + command_argv[1:]
+            for filename in self.asan_log_filenames():
+                os.remove(filename) # don't let a report from a previous run count against this one
+            # reports go to their own files so they don't pollute the output being diffed. like valgrind, the program carries on past
+            # errors and keeps its own exit status (exitcode=0 stops the leak checker from replacing it), so we go by the report files
+            env = dict(os.environ)
+            env['ASAN_OPTIONS'] = "halt_on_error=0:exitcode=0:detect_leaks=1:log_path=%s" % self.asan_log_prefix()
+            env['UBSAN_OPTIONS'] = "print_stacktrace=1:log_path=%s" % self.asan_log_prefix() # for when asan_cflags add -fsanitize=undefined
         
         if suppress_output:
             output_file = DEVNULL
         else:
             output_file = self.actual_output_filename()
             
-        # actually run it!
-        exitcode = Utility.run_process(command_argv, output_file=output_file, input_file=self.get('stdin',None), timeout=self['timeout'])
+        rlimits = self.get_rlimits(include_memory=not add_valgrind and asan_target is None)
+        if timeout is None:
+            timeout = self.get_timeout()
+        cpu_timeout = timeout
+        is_cpu_timeout = self['timeout_kind'] == "cpu" and resource is not None
+        if is_cpu_timeout:
+            # the kernel enforces the CPU timeout (in whole seconds, so we check the exact figure afterward); we just keep the backstop
+            cpu_rlimit = int(math.ceil(timeout))
+            is_cpu_rlimit_ours = True
+            for which, value in rlimits:
+                if which == resource.RLIMIT_CPU and value < cpu_rlimit: # a stricter 'limits' setting wins
+                    cpu_rlimit = value
+                    is_cpu_rlimit_ours = False
+            rlimits = [(which, value) for which, value in rlimits if which != resource.RLIMIT_CPU] + [(resource.RLIMIT_CPU, cpu_rlimit)]
+            timeout *= self['cpu_timeout_wall_factor']
+        if usage is None:
+            usage = ResourceUsage()
+        
+        # actually run it! (letting the tester know about the child, so that cancelling can kill it)
+        spawned = []
+        spawn_times = []
+        def on_spawn(process):
+            spawn_times.append(perf_counter())
+            spawned.append(process)
+            tester.process_spawned(self, process)
+        run_start_time = perf_counter()
+        try:
+            exitcode = Utility.run_process(command_argv, output_file=output_file, input_file=self.get_stdin_filename(), timeout=timeout, env=env, usage=usage, rlimits=rlimits, cwd=tester.get_cwd(), on_spawn=on_spawn)
+        finally:
+            for process in spawned:
+                tester.process_exited(self, process)
+        run_end_time = perf_counter()
+        if has_valgrind and add_valgrind:
+            tester.profiler.add(self.suite, "valgrind", run_end_time - run_start_time)
+        else:
+            spawn_time = (spawn_times or [run_start_time])[0] # without os.wait4, we can't tell when the child started
+            tester.profiler.add(self.suite, "spawn", spawn_time - run_start_time)
+            tester.profiler.add(self.suite, "program", run_end_time - spawn_time)
+        if tester.cancelled.is_set():
+            raise Cancelled()
+        
+        # translate running out of CPU time into a timeout (unless it was really the stricter cpu_seconds limit that was hit)
+        if is_cpu_timeout and is_cpu_rlimit_ours and exitcode != EXITCODE_TIMEOUT:
+            cpu_time = usage.get_cpu_time()
+            if exitcode in (-signal.SIGXCPU, -signal.SIGKILL) and cpu_time is not None and cpu_time >= cpu_rlimit - 0.1: # the kernel's accounting runs a hair ahead of rusage
+                exitcode = EXITCODE_TIMEOUT
+            elif cpu_time is not None and cpu_time > cpu_timeout:
+                exitcode = EXITCODE_TIMEOUT
         
         # apply filters to output if requested
         if self.has('output_filters') and not suppress_output:
-            ff = FileFilter(self['output_filters'])
-            ff.apply_to_file(self.actual_output_filename(), self.actual_output_backup_filename())
+            with tester.profiler.phase(self.suite, "filter"):
+                ff = FileFilter(self['output_filters'])
+                ff.apply_to_file(self.actual_output_filename(), self.actual_output_backup_filename())
             
         return exitcode
         
@@ -868,6 +2120,12 @@ You should test on a platform with valgrind before turning this in!" + TextColor
         Run a specific test case. Returns as TestResult object.
         """
         
+        self.suite.tester.reporter.test_started(self)
+        start_time = time.time()
+        profiler = self.suite.tester.profiler
+        profile_start_time = perf_counter()
+        counters = HarnessCounters() # (if an exception abandons the test, its counts go with it; the next test's start() takes over the thread)
+        counters.start()
         diff_type = self.get("diff", "normal") # default "normal"
         max_points = self.get("points",None) # this being None is how we tell if this is the grader or not in here
         
@@ -875,18 +2133,38 @@ You should test on a platform with valgrind before turning this in!" + TextColor
         penalty = 1.0 # base penalty rate
         error_flags = [] # text flags will be collected here to annotate failure
         
+        # with memcheck="asan", the one and only run is done against the sanitizer build instead of running again under valgrind
+        with profiler.phase(self.suite, "prereqs"):
+            asan_target = self.get_asan_target()
+        
         # run it!
-        exitcode = self.execute()
+        usage = ResourceUsage()
+        exitcode = self.execute(asan_target=asan_target, usage=usage)
         message = ""
         
+        # the sanitizers' verdict is in their report files
+        is_memcheck_error = False
+        if asan_target is not None:
+            asan_logs = self.asan_log_filenames()
+            is_memcheck_error = bool(asan_logs)
+        
         # complain about timeout or other bad exitcode
         if exitcode == EXITCODE_TIMEOUT:
             # no penalty for timing out (but odds of passing the output match with a timeout are very low)
             error_flags.append("timed_out")
-            message += "Test timed out after %d seconds!\n" % self['timeout']
+            if self['timeout_kind'] == "cpu":
+                message += "Test timed out after %.2f seconds of CPU time and %.2f seconds of wall clock time (limits: %g seconds CPU, %g seconds wall clock)!\n" % (
+                    usage.get_cpu_time() or 0, usage.wall_time or 0, self.get_timeout(), self.get_timeout()*self['cpu_timeout_wall_factor'])
+            else:
+                message += "Test timed out after %g seconds!\n" % self.get_timeout()
         elif exitcode != 0:
             is_pass = False
-            if exitcode == EXITCODE_SEGFAULT:
+            limit_exceeded = self.get_limit_exceeded(exitcode, usage)
+            if limit_exceeded:
+                flag, limit_message = limit_exceeded
+                error_flags.append(flag)
+                message += limit_message
+            elif exitcode == EXITCODE_SEGFAULT:
                 error_flags.append("segfault") # same penalty, but we label segfaults to make it clearer to students
                 message += "Segfault detected!\n"
             else:
@@ -897,8 +2175,18 @@ You should test on a platform with valgrind before turning this in!" + TextColor
                 penalty *= self['penalty_exitcode_nonzero']
                 message += "  ^ Test score will be multiplied by %.2f.\n" % self['penalty_exitcode_nonzero']
         
-        # run diff!
-        was_diff_ok = Diff.apply_diff(diff_type, self.expected_output_filename(), self.actual_output_filename(), self.diff_filename())
+        # run diff! (against freshly generated expected output, if there's an oracle) -- unless it's plain that they match
+        if self.has('oracle'):
+            with profiler.phase(self.suite, "oracle"):
+                self.run_oracle()
+        with profiler.phase(self.suite, "diff"):
+            if Diff.quick_match(diff_type, self.get_expected_output(), self.actual_output_filename()):
+                was_diff_ok = True
+                with open(self.diff_filename(), "w"):
+                    pass # as an empty diff
+            else:
+                expected_filename = self.get_expected_output_file()
+                was_diff_ok = Diff.apply_diff(diff_type, expected_filename, self.actual_output_filename(), self.diff_filename())
         
         # complain about diff mismatch
         if not was_diff_ok:
@@ -907,31 +2195,31 @@ You should test on a platform with valgrind before turning this in!" + TextColor
             error_flags.append("output_differs")
             message += "The actual output did not match the expected output!\n"
             
-            message += "\n###### DIFF ######\n"
-            try:
-                with open(self.diff_filename(),"r") as fp:
-                    content = fp.read(OUTPUT_MAX_BYTES)
-                    was_truncated = fp.read(1) != '' # if we can read another byte, than the first read didnt get it all
-                    if was_truncated:
-                        message += "\n###### The diff was truncated for being too long -- infinite loop?\n"
-                    message += content
-            except Exception as e: 
-                message += "\n###### Error: the diff could not be read: %s\n" % e
-                
-            message += "\n###### ACTUAL ######\n"
-            try:
-                with open(self.actual_output_filename(),"r") as fp:
-                    content = fp.read(OUTPUT_MAX_BYTES)
-                    was_truncated = fp.read(1) != '' # if we can read another byte, than the first read didnt get it all
-                    if was_truncated:
-                        message += "\n###### The actual output was truncated for being too long -- infinite loop?\n"
-                    message += content
-            except Exception as e: 
-                message += "\n###### Error: the actual output could not be read: %s\n" % e
-
-        # if requested, run it again with valgrind
-        if self.has("penalty_valgrind"):
-            exitcode_with_valgrind = self.execute(add_valgrind=True, suppress_output=True)
+            with profiler.phase(self.suite, "summarize"):
+                message += "\n###### DIFF ######\n"
+                try:
+                    message += OutputSummarizer.summarize_diff(self.diff_filename(), expected_filename, self['diff_max_hunks'], self['diff_context_lines'])
+                except Exception as e: 
+                    message += "\n###### Error: the diff could not be read: %s\n" % e
+                    
+                message += "\n###### ACTUAL ######\n"
+                try:
+                    message += OutputSummarizer.summarize_file(self.actual_output_filename())
+                except Exception as e: 
+                    message += "\n###### Error: the actual output could not be read: %s\n" % e
+
+        # if requested, run it again with valgrind (unless the sanitizer build already did the checking)
+        if asan_target is not None:
+            if is_memcheck_error:
+                is_pass = False
+                penalty *= self["penalty_valgrind"]
+                error_flags.append("valgrind_error")
+                message += "Memory error detected by the address sanitizer! (Test score will be multiplied by %.2f)\n" % (self["penalty_valgrind"])
+                for filename in asan_logs:
+                    with open(filename,"r") as fp:
+                        message += "\n###### SANITIZER REPORT ######\n" + fp.read(OUTPUT_MAX_BYTES)
+        elif self.has("penalty_valgrind"):
+            exitcode_with_valgrind = self.execute(add_valgrind=True, suppress_output=True, timeout=self['timeout']) # valgrind is too slow for a calibrated timeout
             if exitcode_with_valgrind==EXITCODE_VALGRIND_ERROR:
                 is_pass = False
                 penalty *= self["penalty_valgrind"]
@@ -945,20 +2233,137 @@ You should test on a platform with valgrind before turning this in!" + TextColor
             points = None
         
         # compile result into an object
-        result = TestResult(test=self, is_pass=is_pass, points=points, message=message, error_flags=error_flags)
+        counters.stop()
+        result = TestResult(test=self, is_pass=is_pass, points=points, message=message, error_flags=error_flags, usage=usage, elapsed_time=time.time()-start_time, counters=counters)
+        profiler.add(self.suite, "test", perf_counter() - profile_start_time)
             
         return result
         
     def bless(self):
         """
-        Bless the results of this test (rename actual -> expected).
+        Bless the results of this test (rename actual -> expected). Not for tests with an oracle, which says what's expected.
         """
+        if self.has('oracle'):
+            return
         src  = self.actual_output_filename()
         dest = self.expected_output_filename()
         verbose_print("Rename %s -> %s" % (src,dest))
-        os.rename(src,dest)
+        shutil.move(src,dest) # not os.rename, as the output_dir may be on another filesystem
     
 
+class TestGenerator(object):
+    """
+    Expands a suite's 'generate' setting into tests, for test matrices too big to spell out. For example:
+    
+        "generate": {
+            "params": {"N": {"range": [0, 501]}, "MODE": ["fast", "slow"]},
+            "desc": "N={N}, {MODE}",
+            "args": ["{N}", "{MODE}"],
+            "input": "{N}\\n",
+            "oracle": ["tests/recurse_reference", "{N}"],
+            "points": 0.1
+        }
+        
+    gives a test for every combination of the 'params' (each a list of values, or a {"range": [start, stop, step]} like 
+    python's range()), with the last one varying fastest. Strings in 'desc', 'args', 'input', 'stdin' and 'oracle' are 
+    templates filled in with str.format(); anything else is a setting of every generated test, as is "params" (this test's 
+    values). Like any test's, the expected outputs are in the usual files, numbered after the suite's literal 'tests' -- 
+    unless there's an 'oracle', a command that makes the expected output for the test instead (see Test.run_oracle).
+    
+    Nothing is generated up front: get_settings() works out the i'th test's settings on demand.
+    """
+    
+    TEMPLATES = ('desc', 'args', 'input', 'stdin', 'oracle')
+    
+    def __init__(self, generate):
+        self.generate = generate
+        self.names = []
+        self.values = []
+        for name, values in generate.get('params', {}).items():
+            if isinstance(values, dict):
+                if 'range' not in values:
+                    raise ValueError("SETTINGS ERROR: Invalid values for generated parameter %s (need a list or {\"range\": [...]})" % name)
+                values = range(*values['range']) # xrange in python 2 would avoid the list, but only goes up to sys.maxint [PY2]
+            self.names.append(name)
+            self.values.append(values)
+        self.count = 1
+        for values in self.values:
+            self.count *= len(values)
+            
+    def get_params(self, i):
+        """
+        Returns the parameter values of the i'th combination.
+        """
+        params = OrderedDict()
+        for name, values in reversed(list(zip(self.names, self.values))):
+            i, j = divmod(i, len(values))
+            params[name] = values[j]
+        return OrderedDict(reversed(list(params.items())))
+        
+    def get_settings(self, i):
+        """
+        Returns the settings of the i'th generated test.
+        """
+        params = self.get_params(i)
+        def fill(template):
+            if isinstance(template, list):
+                return [fill(t) for t in template]
+            return template.format(**params)
+        settings = OrderedDict()
+        for k, v in self.generate.items():
+            if k == 'params':
+                settings[k] = params
+            elif k in TestGenerator.TEMPLATES:
+                settings[k] = fill(v)
+            else:
+                settings[k] = v
+        settings.setdefault('desc', ", ".join("%s=%s" % item for item in params.items()))
+        settings.setdefault('args', [])
+        return settings
+        
+class SuiteTests(object):
+    """
+    The tests of a suite, as a read-only list: those in its 'tests' setting, then any from its 'generate' setting (see 
+    TestGenerator). Generated tests are only made when asked for -- iterating goes through them one at a time -- and are kept
+    only as long as they're in use elsewhere.
+    """
+    
+    def __init__(self, suite):
+        self.suite = suite
+        self.literal = [Test(suite, test_num) for test_num in range(len(suite.json.get('tests', [])))]
+        self.generator = None
+        if 'generate' in suite.json:
+            self.generator = TestGenerator(suite.json['generate'])
+        self.generated = weakref.WeakValueDictionary() # test number -> generated test
+        self.lock = threading.Lock()
+        
+    def __len__(self):
+        if self.generator is None:
+            return len(self.literal)
+        return len(self.literal) + self.generator.count
+        
+    def __getitem__(self, test_num):
+        if test_num < 0:
+            test_num += len(self)
+        if test_num < len(self.literal):
+            return self.literal[test_num]
+        if not test_num < len(self):
+            raise IndexError("test number out of range")
+        with self.lock:
+            test = self.generated.get(test_num, None)
+            if test is None:
+                test = Test(self.suite, test_num, settings=self.generator.get_settings(test_num - len(self.literal)))
+                self.generated[test_num] = test
+            return test
+            
+    def __iter__(self):
+        for test_num in range(len(self)):
+            yield self[test_num]
+            
+    def settings_changed(self):
+        for test in self.literal + list(self.generated.values()):
+            test.settings_changed()
+            
 class Suite(JSONWrapper):
     """
     Encapsulates a test suite, i.e. settings['test_suites'][suite_name].
@@ -968,15 +2373,27 @@ class Suite(JSONWrapper):
         super(Suite,self).__init__(tester.json['test_suites'][name], parent=tester)
         self.tester = tester
         self.name = name
+        self.asan_target = None # built on first use by get_asan_target(); False if the build failed
+        self.asan_lock = threading.Lock() # tests running in parallel mustn't both try the build
+        self.target_hash = None # computed on first use by get_target_hash()
         
-        self.tests = []
-        for test_num in range(len(self.json['tests'])):
-            self.tests.append(Test(self, test_num))
+        self.tests = SuiteTests(self)
+            
+    def settings_changed(self):
+        self.target_hash = None
+        self.tests.settings_changed()
             
     # shell globs for the various files associated with this suite (used for the clean and bless functions)
     def expected_output_filename_mask(self): return os.path.join(self['test_dir'], "%s_expected_*.txt" % (self.name))
-    def actual_output_filename_mask(self):   return os.path.join(self['test_dir'], "%s_actual_*.txt*" % (self.name))
-    def diff_filename_mask(self):            return os.path.join(self['test_dir'], "%s_diff_*.txt" % (self.name))
+    def actual_output_filename_mask(self):   return os.path.join(self['output_dir'], "%s_actual_*.txt*" % (self.name))
+    def diff_filename_mask(self):            return os.path.join(self['output_dir'], "%s_diff_*.txt" % (self.name))
+    def input_filename_mask(self):           return os.path.join(self['output_dir'], "%s_input_*.txt" % (self.name))
+    def oracle_filename_mask(self):          return os.path.join(self['output_dir'], "%s_oracle_*.txt" % (self.name))
+    def unpacked_filename_mask(self):        return os.path.join(self['output_dir'], "%s_unpacked_*.txt" % (self.name))
+    def asan_filename_mask(self):            return os.path.join(self['output_dir'], "%s_asan*" % (self.name))
+    def asan_target_filename(self):          return os.path.abspath(os.path.join(self['output_dir'], "%s_asan" % (self.name)))
+    def asan_build_output_filename(self):    return os.path.join(self['output_dir'], "%s_asan_build.txt" % (self.name))
+    def result_cache_filename(self, key):    return os.path.join(self['test_dir'], self['logisim_result_cache'], "%s_%s.json" % (self.name, key))
     
     def get_target(self):
         """
@@ -985,17 +2402,146 @@ class Suite(JSONWrapper):
         """
         mode = self['mode']
         if self.has('target'): 
-            return self['target']
+            target = self['target']
         elif mode == "exe":
-            return "./%s" % self.name
+            target = "./%s" % self.name
         elif mode == "java":
-            return self.name
+            return self.name # a class name, found via the classpath when run in the workdir
         elif mode == "spim":
-            return "%s.s" % self.name
+            target = "%s.s" % self.name
         elif mode == "logisim":
-            return "%s.circ" % self.name
+            target = "%s.circ" % self.name
         else:
             raise Exception("Internal error determining test target")
+        return self.tester.workdir_path(target)
+            
+    def get_target_filename(self):
+        """
+        Returns the file that get_target() refers to (which for java is the class file).
+        """
+        if self['mode'] == "java":
+            return self.tester.workdir_path("%s.class" % self.get_target())
+        return self.get_target()
+        
+    def get_target_hash(self):
+        """
+        Returns a hash of the target's content (memoized), or "missing" if it doesn't exist. 
+        Identifies the particular submission being tested, e.g. for the timing history.
+        """
+        if self.target_hash is None:
+            self.target_hash = Utility.hash_file(self.get_target_filename()) or "missing"
+        return self.target_hash
+        
+    def get_graded_files(self):
+        """
+        Returns the files of the submission that this suite's results depend on: the target (plus the other classes or circuits it
+        may load), and any files checked for penalties or compiled for the sanitizer build.
+        """
+        files = [self.get_target_filename()]
+        if self['mode'] == "java":
+            files += glob.glob(self.tester.workdir_path("*.class"))
+        elif self['mode'] == "logisim":
+            files += glob.glob(self.tester.workdir_path("*.circ"))
+        for penalty_name in ('penalty_c_math_or_modulo', 'penalty_c_modulo'):
+            if self.has(penalty_name):
+                files.append(self.tester.workdir_path(self[penalty_name]['file']))
+        if self.has('penalty_valgrind') and self['memcheck'] == "asan":
+            files += [self.tester.workdir_path(source) for source in self.get('asan_sources', ["%s.c" % self.name])]
+        return files
+        
+    def get_result_cache_key(self):
+        """
+        With the 'logisim_result_cache' setting, returns (key, fingerprint): the key under which this (logisim) suite's results 
+        are cached, a hash of the circuit's structural fingerprint, the settings, and the files the tests depend on; and that 
+        fingerprint. Returns None if the results aren't to be cached. Fingerprinting takes a while, so a run works this out once
+        and passes it to load_cached_result() and finish().
+        """
+        if self['mode'] != "logisim" or not self['logisim_result_cache']:
+            return None
+        target = self.get_target()
+        try:
+            fingerprint = LogisimFingerprint.fingerprint_file(target)
+        except Exception as e: # missing, malformed, or something we don't understand: just run the tests
+            verbose_print("%s: Not using the result cache, as the circuit couldn't be fingerprinted: %s" % (target, e))
+            return None
+        settings = OrderedDict((k, v) for k, v in self.tester.json.items() if k not in ('test_suites', 'test_dir', 'workdir', 'output_dir'))
+        files = [self.tester.harness_path(self['logisim_jar'])]
+        for test in self.tests:
+            if test.has('stdin'):
+                files.append(test['stdin'])
+        file_hashes = [Utility.hash_file(filename) for filename in files] + [test.hash_expected_output() for test in self.tests]
+        return hashlib.sha1(json.dumps([fingerprint, settings, self.json, file_hashes]).encode('utf-8')).hexdigest(), fingerprint
+        
+    def load_cached_result(self, cache_key):
+        """
+        Returns the cached TestResultSet of a structurally identical circuit (given the cache key from get_result_cache_key), 
+        or None if there isn't one.
+        """
+        if cache_key is None:
+            return None
+        try:
+            with open(self.result_cache_filename(cache_key[0]), "r") as fp:
+                cached = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+        test_result_set = TestResultSet([TestResult.from_dictionary(self, d) for d in cached['tests']], cached['message'], cached['elapsed_time'])
+        test_result_set.append_message("%s: These results were reused from an earlier run of a structurally identical circuit (fingerprint %s).\n" % (self.name, cached['fingerprint']))
+        return test_result_set
+        
+    def store_cached_result(self, test_result_set, cache_key):
+        """
+        Cache this suite's finished results under the given key, if there is one (see get_result_cache_key). Results involving a timeout aren't cached, as
+        those may have come down to how busy the machine was, and neither are those of only some of the tests.
+        """
+        if len(test_result_set.test_results) != len(self.tests) or any("timed_out" in tr.error_flags for tr in test_result_set.test_results):
+            return
+        if cache_key is None:
+            return
+        key, fingerprint = cache_key
+        filename = self.result_cache_filename(key)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        cached = OrderedDict([
+            ("fingerprint", fingerprint),
+            ("message", test_result_set.message),
+            ("elapsed_time", test_result_set.elapsed_time),
+            ("tests", [tr.to_dictionary() for tr in test_result_set.test_results]),
+        ])
+        Utility.write_file_atomically(filename, json.dumps(cached, indent=2, separators=(',', ': ')))
+        
+    def get_asan_target(self):
+        """
+        For memcheck="asan": compile the suite's C sources (the 'asan_sources' setting, default SUITENAME.c) with the address
+        sanitizer (plus whatever 'asan_cflags' add), once per run. Returns the path of the resulting executable, or None if the sanitizer build
+        isn't possible, in which case a warning is printed and the caller should fall back to valgrind.
+        """
+        with self.asan_lock:
+            if self.asan_target is None:
+                self.asan_target = self.build_asan_target() or False
+            return self.asan_target or None
+            
+    def build_asan_target(self):
+        """
+        Does the actual sanitizer build for get_asan_target().
+        """        
+        if self['mode'] != "exe":
+            self.tester.reporter.warning("%s: memcheck 'asan' only applies to mode 'exe'; falling back to valgrind." % self.name)
+            return None
+        if not Utility.verify_executable(self['asan_cc'], use_path=True):
+            self.tester.reporter.warning("%s: Missing compiler '%s' for the sanitizer build; falling back to valgrind." % (self.name, self['asan_cc']))
+            return None
+        sources = [self.tester.workdir_path(source) for source in self.get('asan_sources', ["%s.c" % self.name])]
+        for source in sources:
+            if not os.path.isfile(source):
+                raise PrereqMissing("Missing source file for the sanitizer build: %s" % source)
+                
+        target = self.asan_target_filename()
+        command_argv = [self['asan_cc']] + ASAN_CFLAGS + self['asan_cflags'] + ["-o", target] + sources + ["-lm"]
+        exitcode = Utility.run_process(command_argv, output_file=self.asan_build_output_filename())
+        if exitcode != 0:
+            self.tester.reporter.warning("%s: The sanitizer build failed (see %s); falling back to valgrind." % (self.name, self.asan_build_output_filename()))
+            return None
+        return target
             
     def check_suite_level_penalties(self):
         """
@@ -1025,7 +2571,7 @@ class Suite(JSONWrapper):
         if self.has('penalty_c_math_or_modulo'):
             penalty_info = self['penalty_c_math_or_modulo']
             this_penalty = penalty_info['penalty']
-            target = penalty_info['file']
+            target = self.tester.workdir_path(penalty_info['file'])
             verbose_print("%s: Checking for modulo and math.h" % target)
             if CodeCheck.check_c_modulus_used(target):
                 penalty *= this_penalty
@@ -1037,7 +2583,7 @@ class Suite(JSONWrapper):
         if self.has('penalty_c_modulo'):
             penalty_info = self['penalty_c_modulo']
             this_penalty = penalty_info['penalty']
-            target = penalty_info['file']
+            target = self.tester.workdir_path(penalty_info['file'])
             verbose_print("%s: Checking for modulo" % target)
             if CodeCheck.check_c_modulus_used(target):
                 penalty *= this_penalty
@@ -1048,39 +2594,85 @@ class Suite(JSONWrapper):
         else:
             return None
 
-    def run(self):
+    def run(self, test_filter=None):
         """
         Run a test suite. Returns an TestResultSet object.
+        If test_filter is given, only the tests for which test_filter(test) is true are run.
         """
-        print("Running tests for %s..." % (self.name))
+        cache_key = iff(test_filter is None, self.get_result_cache_key, lambda: None)()
+        cached = self.load_cached_result(cache_key)
+        if cached is not None:
+            self.tester.reporter.suite_started(self, is_cached=True)
+            for result in cached.test_results:
+                self.report_result(result)
+            self.tester.reporter.suite_finished(self, cached)
+            return cached
+            
+        self.tester.reporter.suite_started(self)
         
         start_time = time.time()
         
         test_result_set = TestResultSet()
         for test in self.tests:
+            if test_filter is not None and not test_filter(test):
+                continue
+            if (self.name, test.test_num) in self.tester.prior_results:
+                result = self.tester.prior_results[(self.name, test.test_num)]
+                self.report_result(result)
+                test_result_set.add_result(result)
+                continue
             try:
                 result = test.run()
-                print(result.get_console_line())
+                self.report_result(result)
                 test_result_set.add_result(result)
             except PrereqMissing as e:
-                print(TextColors.RED + str(e) + TextColors.END)
-                message_decorated = ("!"*80 + "\n") + "ERROR: %s\n"%str(e) + ("!"*80 + "\n")
-                test_result_set.append_message(message_decorated)
+                self.report_prereq_missing(test_result_set, e)
                 return test_result_set # abort the whole suite if we were missing a pre-req
                 
-        r = self.check_suite_level_penalties()
-        if r:
-            message, penalty = r
-            test_result_set.apply_penalty(penalty)
-            message_decorated = ("!"*80 + "\n") + message + ("!"*80 + "\n")
-            print(TextColors.RED + message_decorated + TextColors.END)
-            test_result_set.append_message(message_decorated)
-
-        print("Done running tests for %s.\n" % (self.name))
-        
         test_result_set.set_elapsed_time(time.time() - start_time)
+        
+        self.finish(test_result_set, cache_key)
 
         return test_result_set
+        
+    def report_result(self, result, show_suite=False):
+        """
+        Pass a finished test's result to the tester's reporter.
+        """
+        with self.tester.profiler.phase(self, "report"):
+            self.tester.reporter.test_finished(result, show_suite=show_suite)
+        
+    def report_prereq_missing(self, test_result_set, e):
+        """
+        Record, in the given TestResultSet, the PrereqMissing exception that aborted this suite (and report it).
+        """
+        self.tester.reporter.prereq_missing(self, e)
+        message_decorated = ("!"*80 + "\n") + "ERROR: %s\n"%str(e) + ("!"*80 + "\n")
+        test_result_set.append_message(message_decorated)
+        
+    def finish(self, test_result_set, cache_key=None):
+        """
+        Once all tests have run, apply any suite-level penalties to the suite's TestResultSet, then cache it under the given key
+        if there is one (see get_result_cache_key).
+        """
+        with self.tester.profiler.phase(self, "report"):
+            self.apply_penalties(test_result_set, self.check_suite_level_penalties())
+                
+            self.store_cached_result(test_result_set, cache_key)
+    
+            self.tester.reporter.suite_finished(self, test_result_set)
+            
+    def apply_penalties(self, test_result_set, penalties):
+        """
+        Apply the given suite-level penalties (as returned by check_suite_level_penalties()) to the suite's TestResultSet, noting
+        them in its message (and reporting them).
+        """
+        if penalties:
+            message, penalty = penalties
+            test_result_set.apply_penalty(penalty)
+            message_decorated = ("!"*80 + "\n") + message + ("!"*80 + "\n")
+            self.tester.reporter.penalties_applied(self, message_decorated, penalty)
+            test_result_set.append_message(message_decorated)
     
     def clean(self, echo=False):
         """
@@ -1089,9 +2681,11 @@ class Suite(JSONWrapper):
         If the echo argument is true, status info is printed as we go.
         """
         n = 0
+        masks = [self.actual_output_filename_mask(), self.diff_filename_mask(), self.asan_filename_mask(), self.input_filename_mask(), 
+            self.oracle_filename_mask(), self.unpacked_filename_mask()]
         if echo:
-            print("Removing %s %s" % (self.actual_output_filename_mask(), self.diff_filename_mask()))
-        for filename in glob.glob(self.actual_output_filename_mask()) + glob.glob(self.diff_filename_mask()):
+            print("Removing %s" % " ".join(masks))
+        for filename in [filename for mask in masks for filename in glob.glob(mask)]:
             verbose_print("Removing %s" % filename)
             os.remove(filename)
             n+=1
@@ -1121,116 +2715,2153 @@ class Suite(JSONWrapper):
         return r
     __str__ = __repr__
 
-class Tester(JSONWrapper):
+class TestArchive(object):
     """
-    Externally, eats JSON and does tests.
-    
-    Internally, it encapsulates settings JSON, but promotes test suites and tests to be objects.
-    Attributes of suites and their tests are looked up recursively, so a test can have a different timeout from a suite; and a suite can differ from the global settings.
-    
-    Use this object like a regular dictionary, except with the .suites['SUITENAME'] attribute.
-    Similarly, suites themselves have .tests[NUMBER] attribute.
-    
-    Some examples:
-    
-        tester = Tester("tests")
-        print(tester['mode'])
-        for suite_name,suite in tester.suites.items():
-            for test in suite.tests:
-                print(test)
-                print(test['timeout'])
-        print(tester.suites['byseven'].tests[0]['timeout'])
-    
+    The expected outputs and stdin files of a test_dir, packed into a single uncompressed zip file (see the 'test_archive' 
+    setting and --pack), for when there are so many tests that opening a file or two for each one is what takes the time -- 
+    on networked storage especially. Its index is read once and the whole thing memory-mapped, so getting at a file's content
+    is a matter of slicing. Where there's an archive, tests use it instead of the loose files.
     """
     
-    def __init__(self, test_dir):
-        # start with default settings
-        settings_json = OrderedDict(SETTINGS_DEFAULT)
-        settings_json['test_dir'] = test_dir # inject the test_dir in the json so our child objects can find it easily
-        
-        # read settings json
-        settings_path = os.path.join(test_dir,SETTINGS_FILENAME)
-        with open(settings_path, "r") as sfile:
-            settings_json.update(json.load(sfile, object_pairs_hook=OrderedDict)) # OrderedDict keeps dicts in read-order
+    def __init__(self, filename):
+        self.filename = filename
+        self.test_dir = os.path.dirname(filename)
+        self.members = {} # name (relative to the test_dir) -> (offset, size) of its content in the archive
+        with open(filename, "rb") as fp:
+            infos = zipfile.ZipFile(fp).infolist()
+            self.map = iff(infos, lambda: mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ), lambda: b"")() # (the map outlives the file)
+        for info in infos:
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError("%s: %s is compressed, which test archives mustn't be (see --pack)" % (filename, info.filename))
+            name_length, extra_length = struct.unpack("<HH", self.map[info.header_offset+26:info.header_offset+30]) # from the member's local header
+            self.members[info.filename] = (info.header_offset + 30 + name_length + extra_length, info.file_size)
+            
+    def get_member_name(self, filename):
+        """
+        Returns the name a file of the test_dir would have in the archive.
+        """
+        return os.path.relpath(filename, self.test_dir).replace(os.sep, "/")
         
-        # parent class constructor eats the json
-        super(Tester,self).__init__(settings_json)
+    def get(self, name):
+        """
+        Returns the content of the given member, or None if there's no such member.
+        """
+        member = self.members.get(name, None)
+        if member is None:
+            return None
+        offset, size = member
+        return self.map[offset:offset+size]
         
-        # validate settings
-        for s in ['mode','test_suites']:
-            if s not in settings_json:
-                raise KeyError("SETTINGS ERROR: Missing item: %s" % s)
-        if settings_json['mode'] not in VALID_TEST_MODES:
-            raise ValueError("SETTINGS ERROR: Invalid mode: %s" % settings['mode'])
+    def unpack(self):
+        """
+        Write every member out to its file in the test_dir. Returns how many there were. Raises ValueError, having written 
+        nothing, if any member would end up outside the test_dir (an absolute name, "..", or via a symlink).
+        """
+        test_dir = os.path.realpath(self.test_dir or ".")
+        filenames = {}
+        for name in sorted(self.members):
+            filename = os.path.realpath(os.path.join(test_dir, *name.split("/")))
+            if os.path.isabs(name) or not filename.startswith(os.path.join(test_dir, "")):
+                raise ValueError("%s: member %s would be unpacked outside of %s" % (self.filename, name, test_dir))
+            filenames[name] = filename
+        for name in sorted(filenames):
+            filename = filenames[name]
+            if not os.path.isdir(os.path.dirname(filename) or "."):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, "wb") as fp:
+                fp.write(self.get(name))
+        return len(self.members)
         
-        # build the suite objects
-        self.suites = OrderedDict()
-        for suite_name in self.json['test_suites']:
-            self.suites[suite_name] = Suite(self, suite_name)
-    
-    def run_suites(self, suite_names):
+    @staticmethod
+    def pack(filename, filenames, archive=None):
         """
-        Run a set of test suites and return a list of their results.
+        (Re)write the archive with the given files (a dictionary of member name -> file), plus any other members of the given 
+        existing archive. Written atomically, so tests running meanwhile see either the old archive or the new.
         """
+        tmp_filename = Utility.temp_filename_for(filename)
+        with open(tmp_filename, "wb") as fp:
+            zf = zipfile.ZipFile(fp, "w", zipfile.ZIP_STORED)
+            if archive is not None:
+                for name in sorted(archive.members):
+                    if name not in filenames:
+                        zf.writestr(name, archive.get(name))
+            for name, member_filename in filenames.items():
+                zf.write(member_filename, name)
+            zf.close()
+        Utility.replace_file(tmp_filename, filename)
         
-        test_result_set = TestResultSet() # start with an empty set of results and add in the suite results
-        for suite in self.each_suite(suite_names):
-            test_result_set += suite.run()
-            
-        return test_result_set
+class Profiler(object):
+    """
+    Adds up how long each phase of running the tests took, per suite, for --profile. The phases:
+    
+        prereqs    checking for the files a test needs (and making the sanitizer build, for memcheck="asan")
+        spawn      starting the child, up to when it's running
+        program    the child itself, until it's been reaped
+        filter     applying output_filters
+        oracle     generating expected output with an 'oracle'
+        diff       comparing the actual output to the expected
+        valgrind   running the test again under valgrind
+        summarize  building a failed test's message (see OutputSummarizer)
+        report     reporting results, penalties and suite results
+        other      the rest of each test's time, i.e. the harness's own overhead
         
-    def clean_suites(self, suite_names, echo=False):
+    Times are summed over tests, so they add up to more than the run took when tests run in parallel. When not enabled, phase()
+    does nothing. Optionally, a cProfile of the harness's own python code is made too (of the main thread only, so of a run 
+    without -j).
+    """
+    
+    PHASES = ["prereqs", "spawn", "program", "filter", "oracle", "diff", "valgrind", "summarize", "report", "other"]
+    RUN = "(results)" # where the time spent outside of any suite goes
+    
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.totals = OrderedDict() # suite name -> OrderedDict(phase -> seconds), with "test" being each test's whole run
+        self.num_tests = {} # suite name -> how many tests ran
+        self.start_time = None
+        self.pstats_filename = None
+        self.profile = None
+        
+    def start(self, pstats_filename=None):
         """
-        For each of the named suites, 'clean' (remove actual+diff). Returns number of files actually deleted.
-        If the echo argument is true, status info is printed as we go.
+        Start profiling, also with cProfile if a file to save its stats in is given.
         """
-        n=0
-        for suite in self.each_suite(suite_names):
-            n += suite.clean(echo=echo)
-        return n
-     
-    def bless_suites(self, suite_names, echo=False):
+        self.enabled = True
+        self.start_time = perf_counter()
+        if pstats_filename:
+            self.pstats_filename = pstats_filename
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            
+    def add(self, suite, phase, seconds):
+        if not self.enabled:
+            return
+        name = Profiler.RUN if suite is None else suite.name
+        with self.lock:
+            totals = self.totals.setdefault(name, OrderedDict())
+            totals[phase] = totals.get(phase, 0.0) + seconds
+            if phase == "test":
+                self.num_tests[name] = self.num_tests.get(name, 0) + 1
+            
+    @contextlib.contextmanager
+    def phase(self, suite, phase):
         """
-        For each of the named suites, 'bless' the results (convert actual -> expected).
-        If the echo argument is true, status info is printed as we go.
+        For timing a phase of one of the given suite's tests (or of the run as a whole, if the suite is None): with profiler.phase(suite, "diff"): ...
         """
-        for suite in self.each_suite(suite_names):
-            suite.bless(echo=echo)
-     
-    def each_suite(self, suite_names=None):
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(suite, phase, perf_counter() - start)
+            
+    def finish(self):
         """
-        Iterate the suites in this tester, either by names (if provided) or just all of them.
+        Stop profiling, print the table of phase times and save the cProfile stats, if any.
         """
-        if suite_names is None:
-            suite_names = self.suites.keys()
-        for suite_name in suite_names:
-            yield self.suites[suite_name]
-     
-    def __repr__(self):
-        r = "Tester:\n"
-        for k,v in self.json.items():
-            if k=='test_suites': continue
-            r += "  %s: %s\n" % (k,v)
-        r += "  test_suites (%d suites):\n" % (len(self.suites))
-        for suite_name,suite in self.suites.items():
-            r += indent(str(suite),4)
-        return r
-    __str__ = __repr__
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.pstats_filename)
+        elapsed_time = perf_counter() - self.start_time
+        
+        rows = []
+        grand_totals = OrderedDict()
+        for name, totals in self.totals.items():
+            totals = OrderedDict(totals)
+            totals['other'] = max(0.0, totals.get('test', 0.0) - sum(totals.get(phase, 0.0) for phase in Profiler.PHASES if phase != 'report'))
+            totals['total'] = totals.get('test', 0.0) + totals.get('report', 0.0)
+            rows.append((name, self.num_tests.get(name, 0), totals))
+            for phase, seconds in totals.items():
+                grand_totals[phase] = grand_totals.get(phase, 0.0) + seconds
+        rows.append(("TOTAL", sum(self.num_tests.values()), grand_totals))
+        
+        columns = [phase for phase in Profiler.PHASES if grand_totals.get(phase, 0.0) > 0] + ["total"] # hide the phases that never happened
+        print("")
+        print("Profile: %.3fs elapsed; seconds per phase, summed over tests:" % elapsed_time)
+        print("%-20s %6s" % ("Suite", "Tests") + "".join(" %9s" % column for column in columns))
+        for name, num_tests, totals in rows:
+            print("%-20s %6d" % (name, num_tests) + "".join(" %9.3f" % totals.get(column, 0.0) for column in columns))
+        if self.profile is not None:
+            print("cProfile stats saved in %s (python -m pstats %s)" % (self.pstats_filename, self.pstats_filename))
 
-def main():
+class TimingHistory(object):
     """
-    Parse arguments and run auto-tester/grader.
+    Remembers how long each test took, keyed by suite/test number and the hash of the target that was tested, so that tests can be
+    scheduled longest-first when running in parallel. Stored as JSON (see the 'timing_history' setting).
+    
+    Estimates for a target we've never seen fall back to the median of what the test took for other targets.
     """
-    global verbose
-
-    test_dir = DEFAULT_TEST_DIR # the default for the student auto-tester; to be changed with -t if you want the instructor auto-grader
     
-    # Allow manual override of test directory with "-t <test_dir>" -- this is done outside of argparse, since argparse needs settings to present a good help message
-    if len(sys.argv) >=3 and "-t" in sys.argv:
-        idx = sys.argv.index('-t') # find the -t
-        sys.argv.pop(idx) # lose the -t itself
-        test_dir = sys.argv.pop(idx) # pop out the test directory argument
-        
+    def __init__(self, filename):
+        self.filename = filename
+        self.timings = OrderedDict() # "suite/test_num" -> OrderedDict(target_hash -> seconds), oldest first
+        self.is_dirty = False
+        self.lock = threading.Lock() # one history may be shared by testers recording from several threads (see GradingServer)
+        try:
+            with open(filename, "r") as fp:
+                self.timings = json.load(fp, object_pairs_hook=OrderedDict)
+        except (IOError, OSError, ValueError) as e:
+            verbose_print("Timing history %s not loaded: %s" % (filename, e))
+            
+    @staticmethod
+    def key(suite, test_num):
+        return "%s/%d" % (suite.name, test_num)
+        
+    def estimate(self, suite, test_num):
+        """
+        Returns how long the given test of the given suite is expected to take, in seconds, or None if we've no idea.
+        """
+        by_target = self.timings.get(TimingHistory.key(suite, test_num), None)
+        if not by_target:
+            return None
+        target_hash = suite.get_target_hash()
+        if target_hash in by_target:
+            return by_target[target_hash]
+        durations = sorted(by_target.values())
+        return durations[len(durations)//2]
+        
+    def record(self, suite, test_num, duration):
+        """
+        Note how long a test took. Repeat runs of the same target are averaged.
+        """
+        target_hash = suite.get_target_hash()
+        with self.lock:
+            by_target = self.timings.setdefault(TimingHistory.key(suite, test_num), OrderedDict())
+            if target_hash in by_target:
+                duration = (by_target.pop(target_hash) + duration) / 2.0
+            by_target[target_hash] = duration # (re)inserted as the newest
+            while len(by_target) > TIMING_HISTORY_TARGETS_PER_TEST:
+                by_target.popitem(last=False)
+            self.is_dirty = True
+        
+    def save(self):
+        """
+        Write the history back out, if it changed. Failing to do so isn't fatal.
+        """
+        with self.lock:
+            if not self.is_dirty:
+                return
+            try:
+                Utility.write_file_atomically(self.filename, json.dumps(self.timings))
+                self.is_dirty = False
+            except (IOError, OSError) as e:
+                verbose_print("Timing history %s not saved: %s" % (self.filename, e))
+            
+    def order_longest_first(self, tests):
+        """
+        Sort tests, given as (suite, test number) pairs, longest-expected-first (tests with no history get the average of the 
+        known ones), which minimizes the total time when running in parallel. Returns (sorted list of pairs, dict of pair -> 
+        estimated seconds, number of tests with history). Pairs rather than Tests, so generated tests needn't all exist at once.
+        """
+        tests = list(tests)
+        estimates = dict((test, self.estimate(*test)) for test in tests)
+        known = [e for e in estimates.values() if e is not None]
+        default = iff(known, sum(known) / max(len(known),1), 0.0)
+        for test in tests:
+            if estimates[test] is None:
+                estimates[test] = default
+        tests.sort(key=lambda test: -estimates[test]) # stable, so ties keep settings order
+        return tests, estimates, len(known)
+        
+    @staticmethod
+    def estimate_makespan(durations, workers):
+        """
+        Simulate greedy scheduling of the given durations (in order) onto the given number of workers; returns when the last one finishes.
+        """
+        finish_times = [0.0] * max(1, int(workers))
+        for duration in durations:
+            i = finish_times.index(min(finish_times))
+            finish_times[i] += duration
+        return max(finish_times)
+
+class Calibration(object):
+    """
+    The reference solution's run times for each test, as measured by Tester.calibrate_suites, for use by Test.get_timeout.
+    Stored as JSON (see the 'calibration' setting): {"suite/test_num": {"wall": [seconds, ...], "cpu": [seconds, ...]}, ...}
+    """
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.samples = OrderedDict()
+        try:
+            with open(filename, "r") as fp:
+                self.samples = json.load(fp, object_pairs_hook=OrderedDict)
+        except (IOError, OSError, ValueError) as e:
+            verbose_print("Calibration %s not loaded: %s" % (filename, e))
+            
+    def get_samples(self, test, kind):
+        """
+        Returns the list of "wall" or "cpu" times recorded for the given test (empty if it wasn't calibrated).
+        """
+        return self.samples.get(TimingHistory.key(test.suite, test.test_num), {}).get(kind, [])
+        
+    def set_samples(self, test, wall_times, cpu_times):
+        self.samples[TimingHistory.key(test.suite, test.test_num)] = OrderedDict([("wall", wall_times), ("cpu", cpu_times)])
+        
+    def save(self):
+        Utility.write_file_atomically(self.filename, json.dumps(self.samples, indent=2))
+
+class RunHistory(object):
+    """
+    A record of every test run (see the 'run_history' setting), kept in SQLite so it can grow without bound and be queried for
+    trends: which tests are slowest, which pass and fail for the same target (flaky), and which are getting slower (see --report).
+    Each run's results are inserted in one transaction when it finishes.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started REAL, elapsed_time REAL, host TEXT, workdir TEXT, version TEXT);
+        CREATE TABLE IF NOT EXISTS test_runs (
+            run_id INTEGER REFERENCES runs(run_id), suite TEXT, test_num INTEGER, target_hash TEXT,
+            is_pass INTEGER, error_flags TEXT, points REAL, max_points REAL,
+            elapsed_time REAL, wall_time REAL, cpu_time REAL, max_rss_kb INTEGER);
+        CREATE INDEX IF NOT EXISTS test_runs_by_test ON test_runs (suite, test_num, run_id);
+    """
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock() # one history may be shared by testers recording from several threads (see GradingServer)
+        
+    def connect(self):
+        connection = sqlite3.connect(self.filename, timeout=30) # other graders may be writing to it too
+        connection.executescript(RunHistory.SCHEMA)
+        return connection
+        
+    def record(self, test_result_set, start_time, workdir):
+        """
+        Add a run's results to the history. Failing to do so isn't fatal.
+        """
+        rows = []
+        for tr in test_result_set.test_results:
+            usage = tr.usage or ResourceUsage()
+            rows.append((tr.suite.name, tr.test_num, tr.suite.get_target_hash(), int(bool(tr.is_pass)), " ".join(tr.error_flags), 
+                tr.points, tr.max_points, tr.elapsed_time, usage.wall_time, usage.get_cpu_time(), usage.max_rss_kb))
+        if not rows:
+            return
+        with self.lock:
+            try:
+                connection = self.connect()
+                try:
+                    with connection: # one transaction
+                        cursor = connection.execute("INSERT INTO runs (started, elapsed_time, host, workdir, version) VALUES (?, ?, ?, ?, ?)", 
+                            (start_time, time.time() - start_time, socket.gethostname(), os.path.abspath(workdir), VERSION))
+                        run_id = cursor.lastrowid
+                        connection.executemany("INSERT INTO test_runs VALUES (%d, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)" % run_id, rows)
+                finally:
+                    connection.close()
+            except sqlite3.Error as e:
+                verbose_print("Run history %s not saved: %s" % (self.filename, e))
+                
+    def query(self, sql, suite_names=()):
+        """
+        Run the given query, in which {runs} stands for the condition that a test_runs row is from one of the latest runs and 
+        {suites} that it's of one of the named suites. Returns the rows.
+        """
+        connection = self.connect()
+        try:
+            sql = sql.format(runs="run_id >= (SELECT MIN(run_id) FROM (SELECT run_id FROM runs ORDER BY run_id DESC LIMIT %d))" % RUN_HISTORY_REPORT_RUNS,
+                suites="suite IN (%s)" % ", ".join("?" * len(suite_names)))
+            return connection.execute(sql, iff("suite IN" in sql, list(suite_names), [])).fetchall()
+        finally:
+            connection.close()
+        
+    def report(self, suite_names):
+        """
+        Print the slowest, flakiest and most slowed-down of the named suites' tests over the latest runs.
+        """
+        suite_names = list(suite_names)
+        num_runs, num_test_runs, first, last = self.query("SELECT COUNT(DISTINCT run_id), COUNT(*), MIN(run_id), MAX(run_id) FROM test_runs WHERE {runs} AND {suites}", suite_names)[0]
+        if not num_test_runs:
+            print("No runs of %s recorded in %s." % (", ".join(suite_names), self.filename))
+            return
+        started = self.query("SELECT MIN(started), MAX(started) FROM runs WHERE run_id BETWEEN %d AND %d" % (first, last))[0]
+        print("%d test runs in %d runs, %s to %s (from %s)\n" % (num_test_runs, num_runs, 
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(started[0])), time.strftime("%Y-%m-%d %H:%M", time.localtime(started[1])), self.filename))
+        
+        print(TextColors.BLUE + "Slowest tests" + TextColors.END)
+        print("%-30s %6s %10s %10s %10s %12s" % ("Test", "Runs", "Mean", "Max", "Mean CPU", "Max RSS"))
+        for suite, test_num, runs, mean_time, max_time, mean_cpu, max_rss in self.query("""
+                SELECT suite, test_num, COUNT(*), AVG(elapsed_time), MAX(elapsed_time), AVG(cpu_time), MAX(max_rss_kb) FROM test_runs 
+                WHERE {runs} AND {suites} AND elapsed_time IS NOT NULL GROUP BY suite, test_num ORDER BY AVG(elapsed_time) DESC LIMIT %d""" % RUN_HISTORY_REPORT_ROWS, suite_names):
+            print("%-30s %6d %9.3fs %9.3fs %10s %12s" % ("%s/%d" % (suite, test_num), runs, mean_time, max_time, 
+                iff(mean_cpu is None, "?", "%.3fs" % (mean_cpu or 0)), iff(max_rss is None, "?", "%s KiB" % max_rss)))
+        print("")
+        
+        print(TextColors.BLUE + "Flaky tests (passed and failed for the same target)" + TextColors.END)
+        rows = self.query("""
+            SELECT suite, test_num, COUNT(*), SUM(runs), SUM(passes), GROUP_CONCAT(flags, ' ') FROM (
+                SELECT suite, test_num, target_hash, COUNT(*) AS runs, SUM(is_pass) AS passes, GROUP_CONCAT(DISTINCT NULLIF(error_flags, '')) AS flags FROM test_runs 
+                WHERE {runs} AND {suites} GROUP BY suite, test_num, target_hash HAVING SUM(is_pass) > 0 AND SUM(is_pass) < COUNT(*))
+            GROUP BY suite, test_num ORDER BY COUNT(*) DESC, SUM(runs) - SUM(passes) DESC LIMIT %d""" % RUN_HISTORY_REPORT_ROWS, suite_names)
+        if rows:
+            print("%-30s %8s %12s   %s" % ("Test", "Targets", "Passed", "Failures"))
+        for suite, test_num, targets, runs, passes, flags in rows:
+            print("%-30s %8d %12s   %s" % ("%s/%d" % (suite, test_num), targets, "%d/%d" % (passes, runs), 
+                " ".join(sorted(set((flags or "").replace(",", " ").split())))))
+        if not rows:
+            print("None.")
+        print("")
+        
+        print(TextColors.BLUE + "Runtime regressions (latest %d runs vs. those before)" % RUN_HISTORY_RECENT_RUNS + TextColors.END)
+        by_test = OrderedDict()
+        for suite, test_num, elapsed_time in self.query("""
+                SELECT suite, test_num, elapsed_time FROM test_runs WHERE {runs} AND {suites} AND elapsed_time IS NOT NULL ORDER BY run_id""", suite_names):
+            by_test.setdefault((suite, test_num), []).append(elapsed_time)
+        regressions = []
+        for (suite, test_num), times in by_test.items():
+            if len(times) <= RUN_HISTORY_RECENT_RUNS:
+                continue
+            before = Utility.percentile(times[:-RUN_HISTORY_RECENT_RUNS], 50)
+            recent = Utility.percentile(times[-RUN_HISTORY_RECENT_RUNS:], 50)
+            if recent >= before * RUN_HISTORY_REGRESSION_FACTOR and recent - before >= RUN_HISTORY_REGRESSION_FLOOR:
+                regressions.append((recent / max(before, 0.001), suite, test_num, before, recent))
+        regressions.sort(reverse=True)
+        if regressions:
+            print("%-30s %10s %10s %8s" % ("Test", "Before", "Recently", "Change"))
+        for ratio, suite, test_num, before, recent in regressions[:RUN_HISTORY_REPORT_ROWS]:
+            print("%-30s %9.3fs %9.3fs %7.1fx" % ("%s/%d" % (suite, test_num), before, recent, ratio))
+        if not regressions:
+            print("None.")
+        print("")
+
+class ConcurrencyGovernor(object):
+    """
+    Decides how many tests may run at once when running in parallel. 
+    
+    It keeps a concurrency limit, measured in cores' worth of per-test cost estimates (see Test.get_cost), which it ramps up while
+    the machine has idle cores and backs off when the CPUs are saturated or available memory runs low. Every change is logged
+    (in verbose mode, and in the history attribute as (seconds since start, limit, idle cores, available MB) tuples).
+    
+    Load is measured from /proc/stat and /proc/meminfo where they exist; elsewhere it falls back to the load average and
+    does without the memory check.
+    """
+    
+    def __init__(self, max_jobs=None):
+        self.cpu_count = multiprocessing.cpu_count()
+        self.max_jobs = iff(max_jobs, max_jobs, self.cpu_count)
+        self.limit = float(min(self.max_jobs, self.cpu_count)) # in cores' worth of running test cost
+        self.running = 0
+        self.running_cores = 0.0
+        self.running_memory_mb = 0.0
+        self.idle_cores = None
+        self.available_memory_mb = None
+        self.total_memory_mb = None
+        self.last_cpu_times = None
+        self.last_sample_time = None
+        self.start_time = time.time()
+        self.history = []
+        self.sample()
+        
+    def read_cpu_times(self):
+        """
+        Returns (idle, total) jiffies from /proc/stat, or None if unavailable.
+        """
+        try:
+            with open("/proc/stat", "r") as fp:
+                fields = [int(x) for x in fp.readline().split()[1:]]
+            return fields[3] + fields[4], sum(fields) # idle + iowait
+        except (IOError, OSError, ValueError, IndexError):
+            return None
+            
+    def read_memory(self):
+        """
+        Returns (available MB, total MB) from /proc/meminfo, or (None, None) if unavailable.
+        """
+        info = {}
+        try:
+            with open("/proc/meminfo", "r") as fp:
+                for line in fp:
+                    key, value = line.split(":", 1)
+                    info[key] = int(value.split()[0]) # in KiB
+        except (IOError, OSError, ValueError):
+            return None, None
+        if 'MemAvailable' not in info:
+            return None, None
+        return info['MemAvailable'] / 1024.0, info['MemTotal'] / 1024.0
+        
+    def sample(self):
+        """
+        Measure the machine's load, adjust the concurrency limit to suit, and log the limit if it changed.
+        """
+        now = time.time()
+        cpu_times = self.read_cpu_times()
+        if cpu_times is not None and self.last_cpu_times is not None and cpu_times[1] > self.last_cpu_times[1]:
+            idle_fraction = float(cpu_times[0] - self.last_cpu_times[0]) / (cpu_times[1] - self.last_cpu_times[1])
+            self.idle_cores = idle_fraction * self.cpu_count
+        elif cpu_times is None and hasattr(os, 'getloadavg'):
+            self.idle_cores = self.cpu_count - os.getloadavg()[0]
+        self.last_cpu_times = cpu_times
+        self.last_sample_time = now
+        self.available_memory_mb, self.total_memory_mb = self.read_memory()
+        
+        old_limit = self.limit
+        if self.is_memory_low():
+            self.limit = max(1.0, min(self.limit, self.running_cores) - 1) # back off
+        elif self.idle_cores is not None and self.idle_cores >= 1.0 and self.running_cores >= self.limit - 1:
+            self.limit = min(float(self.max_jobs), self.limit + 1) # spare cores and we're using what we're allowed: ramp up
+        elif self.idle_cores is not None and self.idle_cores < 0.25:
+            self.limit = max(1.0, self.limit - 1) # saturated: back off
+        if self.limit != old_limit or not self.history:
+            self.history.append((now - self.start_time, self.limit, self.idle_cores, self.available_memory_mb))
+            verbose_print("concurrency: limit %g (running %d tests using ~%g cores; idle cores %s; available memory %s)" % (
+                self.limit, self.running, self.running_cores, 
+                iff(self.idle_cores is None, "unknown", "%.1f" % (self.idle_cores or 0)), 
+                iff(self.available_memory_mb is None, "unknown", "%d MB" % (self.available_memory_mb or 0))))
+        
+    def maybe_sample(self):
+        """
+        Re-measure if the sample interval has passed.
+        """
+        if time.time() - self.last_sample_time >= CONCURRENCY_SAMPLE_INTERVAL:
+            self.sample()
+            
+    def is_memory_low(self, extra_mb=0):
+        """
+        True if starting something needing extra_mb more would leave too little memory available.
+        """
+        if self.available_memory_mb is None:
+            return False
+        return self.available_memory_mb - extra_mb < MEMORY_RESERVE_FRACTION * self.total_memory_mb
+        
+    def can_start(self, cost):
+        """
+        True if a test with the given (cores, memory MB) cost may start now. Something is always allowed to run, so we can't stall.
+        """
+        cores, memory_mb = cost
+        if self.running == 0:
+            return True
+        if self.running >= self.max_jobs or self.running_cores + cores > self.limit:
+            return False
+        # tests we just started may not have grown to their full size yet, so count what they're expected to use
+        return not self.is_memory_low(extra_mb=memory_mb)
+        
+    def started(self, cost):
+        self.running += 1
+        self.running_cores += cost[0]
+        if self.available_memory_mb is not None:
+            self.available_memory_mb -= cost[1]
+        
+    def finished(self, cost):
+        self.running -= 1
+        self.running_cores -= cost[0]
+        
+class ParallelRunner(object):
+    """
+    Runs tests on worker threads (the real work happens in child processes), as many at a time as a ConcurrencyGovernor allows.
+    """
+    
+    def __init__(self, governor):
+        self.governor = governor
+        
+    def run(self, tests, on_result, should_skip=None):
+        """
+        Run the given tests. As each finishes, on_result(test, result, exception) is called from the calling thread, with
+        exception being whatever the test raised (in which case result is None). Tests for which should_skip(test) returns 
+        true at the time they'd be started are never run. Tests may be any iterable, which is only advanced as tests are started.
+        """
+        pending = iter(tests)
+        next_test = next(pending, None) # held back until there's room to start it
+        done_queue = queue.Queue()
+        costs = {}
+        
+        def work(test):
+            try:
+                done_queue.put((test, test.run(), None))
+            except Exception as e:
+                done_queue.put((test, None, e))
+        
+        while next_test is not None or self.governor.running:
+            self.governor.maybe_sample()
+            while next_test is not None:
+                test = next_test
+                if should_skip is not None and should_skip(test):
+                    next_test = next(pending, None)
+                    continue
+                cost = test.get_cost()
+                if not self.governor.can_start(cost):
+                    break
+                next_test = next(pending, None)
+                costs[test] = cost
+                self.governor.started(cost)
+                thread = threading.Thread(target=work, args=(test,))
+                thread.daemon = True
+                thread.start()
+            if not self.governor.running:
+                continue
+            try:
+                test, result, exception = done_queue.get(timeout=CONCURRENCY_SAMPLE_INTERVAL)
+            except queue.Empty:
+                continue
+            self.governor.finished(costs.pop(test))
+            on_result(test, result, exception)
+
+class Reporter(object):
+    """
+    Hears about what a Tester is doing as it runs tests. This base class ignores it all, which makes for quiet programmatic use
+    (see Tester.run_suites_async); ConsoleReporter prints the usual console output, and EventReporter logs events as JSON.
+    """
+    
+    def quieted(self):
+        """Returns the flavor of this reporter for testers running in the background of something else (see BatchGrader)."""
+        return self
+        
+    def run_started(self, tester, suite_names):
+        """The given tester is about to run the named suites."""
+        pass
+        
+    def run_finished(self, tester, test_result_set):
+        pass
+        
+    def parallel_started(self, suites, max_jobs):
+        """The tests of the given suites are about to run in parallel, up to max_jobs at a time."""
+        pass
+        
+    def suite_started(self, suite, is_cached=False):
+        """The given suite's tests are about to run one after another (or, if is_cached, its results came from the result cache)."""
+        pass
+        
+    def test_started(self, test):
+        pass
+        
+    def process_spawned(self, test, process):
+        """A child process (a subprocess.Popen) was started for the given test."""
+        pass
+        
+    def test_finished(self, result, show_suite=False):
+        """A test finished with the given TestResult; show_suite means the results of different suites are interleaved."""
+        pass
+        
+    def prereq_missing(self, suite, exception):
+        """The given suite was aborted by a PrereqMissing exception."""
+        pass
+        
+    def penalties_applied(self, suite, message, penalty):
+        """Suite-level penalties multiplied the given suite's scores by penalty, for reasons explained in message."""
+        pass
+        
+    def suite_finished(self, suite, test_result_set):
+        pass
+        
+    def warning(self, message):
+        """Something the user should know about went wrong (but we carried on)."""
+        pass
+        
+    def note(self, message):
+        """General progress information."""
+        pass
+
+class ConsoleReporter(Reporter):
+    """
+    Prints test progress to the console. If quiet, only warnings are printed.
+    """
+    
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        
+    def quieted(self):
+        return ConsoleReporter(quiet=True)
+        
+    def parallel_started(self, suites, max_jobs):
+        if not self.quiet:
+            print("Running tests for %s (up to %d at a time)..." % (", ".join(suite.name for suite in suites), max_jobs))
+            
+    def suite_started(self, suite, is_cached=False):
+        if self.quiet:
+            return
+        if is_cached:
+            print("Reusing cached results for %s (the circuit is structurally identical to one tested before)..." % (suite.name))
+        else:
+            print("Running tests for %s..." % (suite.name))
+        
+    def test_finished(self, result, show_suite=False):
+        if not self.quiet:
+            print(result.get_console_line(show_suite=show_suite))
+            verbose_print(" "*11 + result.usage.get_summary())
+            if result.counters is not None:
+                verbose_print(" "*11 + result.counters.get_summary())
+        
+    def prereq_missing(self, suite, exception):
+        if not self.quiet:
+            print(TextColors.RED + str(exception) + TextColors.END)
+        
+    def penalties_applied(self, suite, message, penalty):
+        if not self.quiet:
+            print(TextColors.RED + message + TextColors.END)
+        
+    def suite_finished(self, suite, test_result_set):
+        if not self.quiet:
+            counters = HarnessCounters.total(tr.counters for tr in test_result_set.test_results)
+            if counters is not None:
+                verbose_print("Suite total %s" % counters.get_summary())
+            print("Done running tests for %s.\n" % (suite.name))
+        
+    def warning(self, message):
+        print(TextColors.RED + message + TextColors.END)
+        
+    def note(self, message):
+        if not self.quiet:
+            print(message)
+
+class ForwardingReporter(Reporter):
+    """
+    A reporter that passes everything on to another one (if given); the base for reporters that add to what's reported.
+    """
+    
+    def __init__(self, next_reporter=None):
+        self.next_reporter = next_reporter or Reporter()
+        
+    def quieted(self):
+        reporter = copy.copy(self) # sharing whatever it writes to
+        reporter.next_reporter = self.next_reporter.quieted()
+        return reporter
+        
+    def run_started(self, tester, suite_names):    self.next_reporter.run_started(tester, suite_names)
+    def run_finished(self, tester, test_result_set): self.next_reporter.run_finished(tester, test_result_set)
+    def parallel_started(self, suites, max_jobs):  self.next_reporter.parallel_started(suites, max_jobs)
+    def suite_started(self, suite, is_cached=False): self.next_reporter.suite_started(suite, is_cached=is_cached)
+    def test_started(self, test):                  self.next_reporter.test_started(test)
+    def process_spawned(self, test, process):      self.next_reporter.process_spawned(test, process)
+    def test_finished(self, result, show_suite=False): self.next_reporter.test_finished(result, show_suite=show_suite)
+    def prereq_missing(self, suite, exception):    self.next_reporter.prereq_missing(suite, exception)
+    def penalties_applied(self, suite, message, penalty): self.next_reporter.penalties_applied(suite, message, penalty)
+    def suite_finished(self, suite, test_result_set): self.next_reporter.suite_finished(suite, test_result_set)
+    def warning(self, message):                    self.next_reporter.warning(message)
+    def note(self, message):                       self.next_reporter.note(message)
+
+class EventReporter(ForwardingReporter):
+    """
+    Writes one JSON object per line to a stream as things happen, for live monitoring (see --events), passing everything on to
+    another reporter as well, if given. Every event has "event" (its type), "time", and "host" and "pid" to tell concurrent
+    harness instances apart, plus "submission" when the submission isn't in the current directory. By type:
+    
+        run_started       suites
+        parallel_started  suites, max_jobs
+        suite_started     suite, cached
+        test_started      suite, test, desc
+        process_spawned   suite, test, pid, argv, since_launch (seconds since this harness instance started)
+        test_finished     suite, test, desc, passed, points, max_points, error_flags, elapsed_time, usage, counters (the harness's own work; see HarnessCounters)
+        prereq_missing    suite, error
+        penalty_applied   suite, penalty, message
+        suite_finished    suite, points, max_points, counters (summed over the suite's tests)
+        warning           message
+        run_finished      points, max_points, elapsed_time
+        
+    Points are null when not grading. Each line goes out in a single write, so several instances can append to one file.
+    """
+    
+    def __init__(self, stream, next_reporter=None):
+        super(EventReporter,self).__init__(next_reporter)
+        self.stream = stream
+        self.lock = threading.Lock() # events come from test worker threads too
+        self.host = socket.gethostname()
+        
+    def emit(self, event, tester, **fields):
+        record = OrderedDict([("event", event), ("time", time.time()), ("host", self.host), ("pid", os.getpid())])
+        if tester is not None and tester['workdir'] != ".":
+            record["submission"] = tester['workdir']
+        for k in sorted(fields):
+            record[k] = fields[k]
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.stream.write(line)
+            self.stream.flush()
+            
+    @staticmethod
+    def get_points(test_result_set):
+        if any(tr.points is None for tr in test_result_set.test_results):
+            return None, None
+        return test_result_set.get_points(), test_result_set.get_max_points()
+        
+    def run_started(self, tester, suite_names):
+        self.emit("run_started", tester, suites=list(suite_names))
+        super(EventReporter,self).run_started(tester, suite_names)
+        
+    def run_finished(self, tester, test_result_set):
+        points, max_points = self.get_points(test_result_set)
+        self.emit("run_finished", tester, points=points, max_points=max_points, elapsed_time=test_result_set.elapsed_time)
+        super(EventReporter,self).run_finished(tester, test_result_set)
+        
+    def parallel_started(self, suites, max_jobs):
+        self.emit("parallel_started", suites[0].tester if suites else None, suites=[suite.name for suite in suites], max_jobs=max_jobs)
+        super(EventReporter,self).parallel_started(suites, max_jobs)
+        
+    def suite_started(self, suite, is_cached=False):
+        self.emit("suite_started", suite.tester, suite=suite.name, cached=is_cached)
+        super(EventReporter,self).suite_started(suite, is_cached=is_cached)
+        
+    def test_started(self, test):
+        self.emit("test_started", test.suite.tester, suite=test.suite.name, test=test.test_num, desc=test['desc'])
+        super(EventReporter,self).test_started(test)
+        
+    def process_spawned(self, test, process):
+        self.emit("process_spawned", test.suite.tester, suite=test.suite.name, test=test.test_num, pid=process.pid, 
+            argv=getattr(process, 'args', None), since_launch=time.time() - LAUNCH_TIME) # no args before python 3.3 [PY2]
+        super(EventReporter,self).process_spawned(test, process)
+        
+    def test_finished(self, result, show_suite=False):
+        self.emit("test_finished", result.suite.tester, suite=result.suite.name, test=result.test_num, desc=result.desc, passed=result.is_pass,
+            points=result.points, max_points=result.max_points, error_flags=result.error_flags, elapsed_time=result.elapsed_time,
+            usage=None if result.usage is None else result.usage.to_dictionary(), counters=None if result.counters is None else result.counters.to_dictionary())
+        super(EventReporter,self).test_finished(result, show_suite=show_suite)
+        
+    def prereq_missing(self, suite, exception):
+        self.emit("prereq_missing", suite.tester, suite=suite.name, error=str(exception))
+        super(EventReporter,self).prereq_missing(suite, exception)
+        
+    def penalties_applied(self, suite, message, penalty):
+        self.emit("penalty_applied", suite.tester, suite=suite.name, penalty=penalty, message=message)
+        super(EventReporter,self).penalties_applied(suite, message, penalty)
+        
+    def suite_finished(self, suite, test_result_set):
+        points, max_points = self.get_points(test_result_set)
+        counters = HarnessCounters.total(tr.counters for tr in test_result_set.test_results)
+        self.emit("suite_finished", suite.tester, suite=suite.name, points=points, max_points=max_points, counters=None if counters is None else counters.to_dictionary())
+        super(EventReporter,self).suite_finished(suite, test_result_set)
+        
+    def warning(self, message):
+        self.emit("warning", None, message=message)
+        super(EventReporter,self).warning(message)
+        
+class ResultsJournal(ForwardingReporter):
+    """
+    Keeps a grading run's results safe as it goes: each finished test is appended to a journal (RESULTS.journal, flushed to
+    disk), and RESULTS itself is atomically rewritten as a valid results.json of everything so far, marked incomplete until the
+    final one is written. If the grader is killed, resume() lets the next run pick the recorded results back up (see --resume)
+    instead of running those tests again.
+    
+    Rewriting RESULTS takes time in proportion to the results so far, so with many quick tests, doing it after every one would
+    make the run quadratic: it's done after a test only if it hasn't been for COMPACT_INTERVAL seconds (and after every suite).
+    The journal is always up to date.
+    """
+    
+    COMPACT_INTERVAL = 1.0
+    INCOMPLETE_MESSAGE = "\n!!! INCOMPLETE: saved while grading was in progress (%d of %d tests done). If you can read this, grading was interrupted.\n"
+    
+    def __init__(self, json_filename, next_reporter=None):
+        super(ResultsJournal,self).__init__(next_reporter)
+        self.json_filename = json_filename
+        self.journal_filename = json_filename + ".journal"
+        self.journal = None
+        self.lock = threading.Lock()
+        self.suite_names = []
+        self.num_tests = 0
+        self.finished_suites = {} # suite name -> its complete TestResultSet
+        self.suite_results = {}   # suite name -> TestResults so far, for suites in progress
+        self.resumed = set()      # ids of the TestResults resume() loaded
+        self.compact_time = 0     # when compact() last ran
+        
+    @staticmethod
+    def get_test_key(test):
+        """
+        A recorded result still applies to a test if the target and the expected output are the same as when it was recorded.
+        """
+        return [test.suite.get_target_hash(), test.hash_expected_output()]
+        
+    def resume(self, tester):
+        """
+        Put the still-applicable results recorded in the journal by an interrupted run in the tester's prior_results, so they
+        aren't run again. Returns how many there were.
+        """
+        try:
+            with open(self.journal_filename, "r") as fp:
+                lines = fp.readlines()
+        except (IOError, OSError):
+            return 0
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue # the last line may have been cut short
+            suite = tester.suites.get(entry['suite'], None)
+            if suite is None or entry['result']['test_num'] >= len(suite.tests):
+                continue
+            test = suite.tests[entry['result']['test_num']]
+            if entry['key'] != self.get_test_key(test):
+                continue
+            result = TestResult.from_dictionary(suite, entry['result'])
+            tester.prior_results[(suite.name, test.test_num)] = result
+            self.resumed.add(id(result))
+        return len(tester.prior_results)
+        
+    def run_started(self, tester, suite_names):
+        self.suite_names = list(suite_names)
+        self.num_tests = sum(len(tester.suites[suite_name].tests) for suite_name in self.suite_names)
+        self.journal = open(self.journal_filename, iff(tester.prior_results, "a", "w"))
+        super(ResultsJournal,self).run_started(tester, suite_names)
+        
+    def test_finished(self, result, show_suite=False):
+        with self.lock:
+            if id(result) not in self.resumed:
+                test = result.suite.tests[result.test_num] # normally still in use by whoever ran it, so not made again
+                entry = OrderedDict([("suite", result.suite.name), ("key", self.get_test_key(test)), ("result", result.to_dictionary())])
+                self.journal.write(json.dumps(entry) + "\n")
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+            self.suite_results.setdefault(result.suite.name, []).append(result)
+            if time.time() - self.compact_time >= ResultsJournal.COMPACT_INTERVAL:
+                self.compact()
+        super(ResultsJournal,self).test_finished(result, show_suite=show_suite)
+        
+    def suite_finished(self, suite, test_result_set):
+        with self.lock:
+            self.finished_suites[suite.name] = test_result_set
+            self.suite_results.pop(suite.name, None)
+            self.compact()
+        super(ResultsJournal,self).suite_finished(suite, test_result_set)
+        
+    def compact(self):
+        """
+        Rewrite the results.json with everything so far: finished suites as they'll be in the end, tests of unfinished suites 
+        without suite-level penalties.
+        """
+        test_result_set = TestResultSet()
+        for suite_name in self.suite_names:
+            if suite_name in self.finished_suites:
+                test_result_set += self.finished_suites[suite_name]
+            else:
+                test_result_set += TestResultSet(sorted(self.suite_results.get(suite_name, []), key=lambda tr: tr.test_num))
+        test_result_set.append_message(ResultsJournal.INCOMPLETE_MESSAGE % (len(test_result_set.test_results), self.num_tests))
+        Utility.write_file_atomically(self.json_filename, json.dumps(test_result_set.get_gradescope_dictionary())) # not indented, which json does much faster
+        self.compact_time = time.time()
+        
+    def finish(self):
+        """
+        Call once the final results.json is written, as the journal is no longer needed.
+        """
+        if self.journal is not None:
+            self.journal.close()
+            os.remove(self.journal_filename)
+
+class LazySuites(Mapping):
+    """
+    A Tester's suites by name, in settings order. Each Suite (with its tests, and their TestSpecs) is built the first time it's
+    asked for, so running one suite, or just cleaning up, doesn't pay for setting up all of them.
+    """
+    
+    def __init__(self, tester):
+        self.tester = tester
+        self.built = {}
+        self.lock = threading.Lock() # in case test threads are the first to want a suite
+        
+    def __getitem__(self, suite_name):
+        suite = self.built.get(suite_name, None)
+        if suite is None:
+            if suite_name not in self.tester.json['test_suites']:
+                raise KeyError(suite_name)
+            with self.lock:
+                if suite_name not in self.built:
+                    self.built[suite_name] = Suite(self.tester, suite_name)
+                suite = self.built[suite_name]
+        return suite
+        
+    def __iter__(self):
+        return iter(self.tester.json['test_suites'])
+        
+    def __len__(self):
+        return len(self.tester.json['test_suites'])
+        
+    def get_built(self):
+        """
+        Returns the suites that have been built so far.
+        """
+        return list(self.built.values())
+        
+class Tester(JSONWrapper):
+    """
+    Externally, eats JSON and does tests.
+    
+    Internally, it encapsulates settings JSON, but promotes test suites and tests to be objects.
+    Attributes of suites and their tests are looked up recursively, so a test can have a different timeout from a suite; and a suite can differ from the global settings.
+    
+    Use this object like a regular dictionary, except with the .suites['SUITENAME'] attribute.
+    Similarly, suites themselves have .tests[NUMBER] attribute.
+    
+    Some examples:
+    
+        tester = Tester("tests")
+        print(tester['mode'])
+        for suite_name,suite in tester.suites.items():
+            for test in suite.tests:
+                print(test)
+                print(test['timeout'])
+        print(tester.suites['byseven'].tests[0]['timeout'])
+    
+    """
+    
+    def __init__(self, test_dir, workdir=None, output_dir=None, settings=None, reporter=None):
+        """
+        Load the settings from test_dir, unless already-loaded settings are given (see clone()).
+        By default, the submission under test is in the current directory and generated files go in the test_dir; 
+        workdir and output_dir change that. Progress goes to the given Reporter, by default a ConsoleReporter.
+        """
+        # start with default settings
+        settings_json = OrderedDict(SETTINGS_DEFAULT)
+        
+        # read settings json
+        if settings is None:
+            settings_path = os.path.join(test_dir,SETTINGS_FILENAME)
+            with open(settings_path, "r") as sfile:
+                settings = json.load(sfile, object_pairs_hook=OrderedDict) # OrderedDict keeps dicts in read-order
+        settings_json.update(copy.deepcopy(settings))
+        
+        # inject the directories in the json so our child objects can find them easily
+        settings_json['test_dir'] = test_dir 
+        settings_json['workdir'] = iff(workdir is None, ".", os.path.abspath(workdir or ".")) # absolute, as the children run in it
+        settings_json['output_dir'] = iff(output_dir is None, test_dir, output_dir)
+        if not os.path.isdir(settings_json['output_dir']):
+            os.makedirs(settings_json['output_dir'])
+        
+        # parent class constructor eats the json
+        super(Tester,self).__init__(settings_json)
+        
+        # validate settings
+        for s in ['mode','test_suites']:
+            if s not in settings_json:
+                raise KeyError("SETTINGS ERROR: Missing item: %s" % s)
+        if settings_json['mode'] not in VALID_TEST_MODES:
+            raise ValueError("SETTINGS ERROR: Invalid mode: %s" % settings['mode'])
+        if settings_json['timeout_kind'] not in VALID_TIMEOUT_KINDS:
+            raise ValueError("SETTINGS ERROR: Invalid timeout_kind: %s" % settings_json['timeout_kind'])
+        if settings_json['memcheck'] not in VALID_MEMCHECK_TYPES:
+            raise ValueError("SETTINGS ERROR: Invalid memcheck: %s" % settings_json['memcheck'])
+        
+        self.timing_history = None # loaded on first use by get_timing_history()
+        self.run_history = None # opened on first use by get_run_history(); False if there isn't to be one
+        self.calibration = None # loaded on first use by get_calibration()
+        self.archive = None # opened on first use by get_archive(); False if there isn't one
+        self.reporter = reporter or ConsoleReporter()
+        self.cancelled = threading.Event() # set by cancel()
+        self.processes = set() # children of running tests, for cancel() to kill
+        self.processes_lock = threading.Lock()
+        self.prior_results = {} # (suite name, test number) -> TestResult recorded by an interrupted run, to use instead of running the test (see ResultsJournal)
+        self.message_spill = MessageSpill() # where our long test messages are kept
+        self.profiler = Profiler() # times the phases of each test, if enabled (see --profile)
+        
+        # the suite objects, built as needed
+        self.suites = LazySuites(self)
+                
+    def settings_changed(self):
+        for suite in getattr(self, 'suites', LazySuites(self)).get_built(): # none yet while loading
+            suite.settings_changed()
+    
+    def run_suites(self, suite_names, jobs=None, test_filter=None):
+        """
+        Run a set of test suites and return a list of their results.
+        If jobs is given, tests from all the suites run in parallel, up to that many at once (0 means as many as there are cores),
+        with the actual concurrency adapting to the machine's load.
+        If test_filter is given, only the tests for which test_filter(test) is true are run.
+        """
+        if suite_names is None:
+            suite_names = list(self.suites)
+        start_time = time.time()
+        self.reporter.run_started(self, suite_names)
+        if jobs is not None and jobs != 1:
+            test_result_set = self.run_suites_parallel(suite_names, jobs, test_filter=test_filter)
+            self.record_timings(test_result_set) # only runs that schedule by the timing history add to it
+        else:
+            test_result_set = TestResultSet() # start with an empty set of results and add in the suite results
+            for suite in self.each_suite(suite_names):
+                test_result_set += suite.run(test_filter=test_filter)
+            
+        self.record_run(test_result_set, start_time)
+        self.reporter.run_finished(self, test_result_set)
+        return test_result_set
+        
+    def run_suites_async(self, suite_names=None, jobs=None, test_filter=None, overrides=None):
+        """
+        Like run_suites() (for all suites if suite_names is None), but returns an asynchronous iterator of each TestResult as it 
+        completes, for use with 'async for' in a coroutine (see AsyncTestRun). Nothing is printed. The tests are run by a clone 
+        of this Tester with the given overrides (see apply_overrides).
+        """
+        tester = self.clone(workdir=iff(self['workdir'] == ".", None, self['workdir']), output_dir=self['output_dir'], reporter=Reporter(), overrides=overrides)
+        return AsyncTestRun(tester, suite_names, jobs, test_filter)
+        
+    def clone(self, workdir=None, output_dir=None, reporter=None, overrides=None):
+        """
+        Returns a new Tester with the same settings (including any changes made to ours since loading), to test a different
+        submission. The timing history and calibration are shared, as is the reporter unless another is given. 
+        Any overrides are applied to the new Tester's settings (see apply_overrides).
+        """
+        tester = Tester(self['test_dir'], workdir=workdir, output_dir=output_dir, settings=self.json, reporter=reporter or self.reporter)
+        tester.timing_history = self.get_timing_history()
+        tester.run_history = self.get_run_history()
+        tester.calibration = self.calibration
+        tester.archive = self.archive
+        tester.profiler = self.profiler
+        if overrides:
+            tester.apply_overrides(overrides)
+        return tester
+        
+    def apply_overrides(self, overrides):
+        """
+        Set each of the settings in the given dictionary (e.g. {"mode": "exe", "timeout": 5}) for every suite and test, replacing
+        whatever the suites and tests set themselves.
+        """
+        if overrides.get('mode', self['mode']) not in VALID_TEST_MODES:
+            raise ValueError("Invalid mode: %s" % overrides['mode'])
+        for k, v in overrides.items():
+            self[k] = v
+            for suite_json in self.json['test_suites'].values(): # built or not (see LazySuites)
+                suite_json.pop(k, None)
+                suite_json.get('generate', {}).pop(k, None)
+                for test_json in suite_json.get('tests', []):
+                    test_json.pop(k, None)
+        self.settings_changed()
+                        
+    def cancel(self):
+        """
+        Stop running tests, from any thread: tests not yet started won't be, and the children of running ones are killed (those 
+        tests raise Cancelled).
+        """
+        self.cancelled.set()
+        with self.processes_lock:
+            for test, process in self.processes:
+                try:
+                    process.kill()
+                except OSError:
+                    pass # already gone
+                    
+    def process_spawned(self, test, process):
+        """
+        Called by the given test with each child process (a Popen object) it starts.
+        The first of these marks the end of startup, so in verbose mode, how long that took is shown.
+        """
+        global first_spawn_time
+        with self.processes_lock:
+            self.processes.add((test, process))
+            if first_spawn_time is None:
+                first_spawn_time = time.time()
+                verbose_print("Startup: the first test process started %.3fs after launch." % (first_spawn_time - LAUNCH_TIME))
+        if self.cancelled.is_set(): # cancelled while it was starting
+            process.kill()
+        self.reporter.process_spawned(test, process)
+        
+    def process_exited(self, test, process):
+        """
+        Called by the given test once a child process it started has been reaped.
+        """
+        with self.processes_lock:
+            self.processes.discard((test, process))
+        
+    def workdir_path(self, path):
+        """
+        Resolve a path to a file of the submission under test, which lives in the current directory unless a workdir was given.
+        """
+        if self['workdir'] == "." or os.path.isabs(path):
+            return path
+        return os.path.join(self['workdir'], path)
+        
+    def harness_path(self, path):
+        """
+        Resolve a path to a tester-provided file that's relative to our own directory (like logisim_jar), for use by a child 
+        running in the workdir.
+        """
+        if self['workdir'] == "." or os.path.isabs(path) or not os.path.exists(path):
+            return path
+        return os.path.abspath(path)
+        
+    def get_submission_hash(self, suite_names):
+        """
+        Returns a hash identifying the submission under test as far as the named suites are concerned: two submissions with the
+        same hash get the same results. Covers the content (and names) of each suite's graded files, plus the compile output.
+        """
+        h = hashlib.sha1()
+        files = set([self.workdir_path("compile_output.txt")])
+        for suite in self.each_suite(suite_names):
+            h.update(("suite %s\n" % suite.name).encode('utf-8'))
+            files.update(suite.get_graded_files())
+        for filename in sorted(files):
+            relative_filename = os.path.relpath(filename, self['workdir'])
+            h.update(("file %s %s\n" % (relative_filename, Utility.hash_file(filename) or "missing")).encode('utf-8'))
+        return h.hexdigest()
+        
+    def get_cwd(self):
+        """
+        Returns the directory test children should run in (None for our own).
+        """
+        return iff(self['workdir'] == ".", None, self['workdir'])
+        
+    def get_timing_history(self):
+        """
+        Returns our TimingHistory (loading it on first use), or None if the 'timing_history' setting disables it.
+        """
+        if self.timing_history is None and self['timing_history']:
+            self.timing_history = TimingHistory(os.path.join(self['test_dir'], self['timing_history']))
+        return self.timing_history
+        
+    def get_run_history(self):
+        """
+        Returns our RunHistory (opening it on first use), or None if the 'run_history' setting disables it or we've no sqlite3.
+        """
+        if self.run_history is None:
+            self.run_history = False
+            if self['run_history']:
+                try:
+                    sqlite3.connect # [PY2] some builds lack sqlite3
+                    self.run_history = RunHistory(os.path.join(self['test_dir'], self['run_history']))
+                except ImportError as e:
+                    verbose_print("Run history not kept: %s" % e)
+        return self.run_history or None
+        
+    def get_archive(self):
+        """
+        Returns our TestArchive (opening it on first use), or None if the test_dir doesn't have one.
+        """
+        if self.archive is None:
+            filename = iff(self['test_archive'], lambda: os.path.join(self['test_dir'], self['test_archive']), lambda: None)()
+            self.archive = iff(filename and os.path.isfile(filename), lambda: TestArchive(filename), lambda: False)()
+        return self.archive or None
+        
+    def pack_suites(self, suite_names):
+        """
+        Pack the expected outputs and stdin files of the named suites' tests into the test archive, keeping whatever else is in
+        it already. Returns the number of files packed.
+        """
+        filenames = OrderedDict()
+        for suite in self.each_suite(suite_names):
+            for test in suite.tests:
+                for filename in test.get_packable_filenames():
+                    filenames[os.path.relpath(filename, self['test_dir'])] = filename
+        TestArchive.pack(os.path.join(self['test_dir'], self['test_archive']), filenames, self.get_archive())
+        self.archive = None # to be reopened
+        return len(filenames)
+        
+    def get_calibration(self):
+        """
+        Returns our Calibration, loading it on first use.
+        """
+        if self.calibration is None:
+            self.calibration = Calibration(os.path.join(self['test_dir'], self['calibration']))
+        return self.calibration
+        
+    def calibrate_suites(self, suite_names, runs):
+        """
+        Run the target of each of the named suites -- this should be the reference solution -- the given number of times per
+        test, and save the run times so 'adaptive_timeout' can base each test's timeout on them.
+        """
+        calibration = self.get_calibration()
+        for suite in self.each_suite(suite_names):
+            print("Calibrating timeouts for %s (%d runs per test)..." % (suite.name, runs))
+            try:
+                for test in suite.tests:
+                    asan_target = test.get_asan_target()
+                    wall_times = []
+                    cpu_times = []
+                    exitcodes = set()
+                    for i in range(runs):
+                        usage = ResourceUsage()
+                        exitcodes.add(test.execute(suppress_output=True, asan_target=asan_target, usage=usage, timeout=test['timeout']))
+                        wall_times.append(usage.wall_time)
+                        cpu_times.append(usage.get_cpu_time())
+                    if exitcodes != set([0]):
+                        print(TextColors.RED + "Test %d: the reference solution failed (exit status %s) -- is this really the reference solution?" % (test.test_num, ", ".join(str(e) for e in sorted(exitcodes))) + TextColors.END)
+                    cpu_times = [t for t in cpu_times if t is not None] # unknown without os.wait4
+                    calibration.set_samples(test, wall_times, cpu_times)
+                    print("%-10s %-50s max %.3fs wall, %.3fs cpu -> timeout %gs" % ("Test %d " % test.test_num, test['desc'], 
+                        max(wall_times), max(cpu_times + [0]), test.get_timeout()))
+            except PrereqMissing as e:
+                print(TextColors.RED + str(e) + TextColors.END)
+            print("")
+        calibration.save()
+        
+    def record_timings(self, test_result_set):
+        """
+        Add how long each test in the given results took to the timing history, and save it.
+        """
+        timing_history = self.get_timing_history()
+        if timing_history is None:
+            return
+        for tr in test_result_set.test_results:
+            if tr.elapsed_time is not None:
+                timing_history.record(tr.suite, tr.test_num, tr.elapsed_time)
+        timing_history.save()
+        
+    def record_run(self, test_result_set, start_time, workdir=None):
+        """
+        Add the given results of a run started at the given time to the run history, if we're keeping one. The run was of the
+        submission in the given workdir (by default, ours).
+        """
+        run_history = self.get_run_history()
+        if run_history is not None:
+            run_history.record(test_result_set, start_time, workdir or self['workdir'])
+        
+    def run_suites_parallel(self, suite_names, jobs, test_filter=None):
+        """
+        Parallel flavor of run_suites(). Results are reported as they come in, but collected per suite and in test order.
+        """
+        start_time = time.time()
+        suites = list(self.each_suite(suite_names))
+        suite_result_sets = OrderedDict((suite.name, TestResultSet()) for suite in suites)
+        aborted_suites = set() # suites missing a pre-req
+        cached_suites = set()  # suites whose results came from the result cache
+        cache_keys = {}        # suite name -> its result cache key, if any
+        for suite in suites:
+            cache_keys[suite.name] = iff(test_filter is None, suite.get_result_cache_key, lambda: None)()
+            cached = suite.load_cached_result(cache_keys[suite.name])
+            if cached is not None:
+                suite_result_sets[suite.name] = cached
+                cached_suites.add(suite.name)
+                self.reporter.suite_started(suite, is_cached=True)
+        governor = ConcurrencyGovernor(max_jobs=jobs or None)
+        
+        self.reporter.parallel_started(suites, governor.max_jobs)
+        
+        def on_result(test, result, exception):
+            test_result_set = suite_result_sets[test.suite.name]
+            if isinstance(exception, PrereqMissing):
+                if test.suite.name not in aborted_suites:
+                    aborted_suites.add(test.suite.name)
+                    test.suite.report_prereq_missing(test_result_set, exception)
+            elif exception is not None:
+                raise exception
+            else:
+                test.suite.report_result(result, show_suite=True)
+                test_result_set.add_result(result)
+        
+        def each_test():
+            # one at a time, as a suite can generate more tests than we'd want in memory at once
+            for suite in suites:
+                if suite.name in cached_suites:
+                    continue
+                for test in suite.tests:
+                    if test_filter is not None and not test_filter(test):
+                        continue
+                    if (suite.name, test.test_num) in self.prior_results:
+                        on_result(test, self.prior_results[(suite.name, test.test_num)], None)
+                        continue
+                    yield test
+        
+        tests = each_test()
+        timing_history = self.get_timing_history()
+        num_known = 0
+        if timing_history is not None:
+            order, estimates, num_known = timing_history.order_longest_first((test.suite, test.test_num) for test in tests)
+            expected_durations = [estimates[pair] for pair in order]
+            tests = (suite.tests[test_num] for suite, test_num in order)
+        ParallelRunner(governor).run(tests, on_result, should_skip=lambda test: test.suite.name in aborted_suites or self.cancelled.is_set())
+        self.reporter.note("")
+        if num_known:
+            self.reporter.note("Expected time: %.2fs (%.2fs of tests at concurrency %g); actual time: %.2fs.\n" % (
+                TimingHistory.estimate_makespan(expected_durations, governor.history[0][1]), sum(expected_durations), 
+                governor.history[0][1], time.time() - start_time))
+        
+        test_result_set = TestResultSet()
+        for suite in suites:
+            suite_result_set = suite_result_sets[suite.name]
+            suite_result_set.test_results.sort(key=lambda tr: tr.test_num)
+            if suite.name in cached_suites:
+                for result in suite_result_set.test_results:
+                    suite.report_result(result, show_suite=True)
+            elif suite.name not in aborted_suites:
+                suite.finish(suite_result_set, cache_keys[suite.name])
+            test_result_set += suite_result_set
+        test_result_set.set_elapsed_time(time.time() - start_time)
+        return test_result_set
+        
+    def get_shard(self, suite_names, shard, num_shards):
+        """
+        Deterministically partition the tests of the named suites into num_shards parts of about equal expected duration: tests
+        are dealt longest-first (per the timing history, if any) to whichever shard has the least work so far. Returns the tests 
+        of the given shard (numbered from 1) as (suite, test number) pairs, and an id of the whole partition.
+        
+        Every shard computes the same partition as long as they all see the same settings and timing history, which is why 
+        shards leave the history alone (see merge_shards).
+        """
+        tests = [(suite, test_num) for suite in self.each_suite(suite_names) for test_num in range(len(suite.tests))]
+        timing_history = self.get_timing_history()
+        if timing_history is not None:
+            tests, estimates, num_known = timing_history.order_longest_first(tests)
+        else:
+            estimates = None
+        loads = [0.0] * num_shards
+        assignment = OrderedDict()
+        for test in tests:
+            i = loads.index(min(loads))
+            loads[i] += max(1.0 if estimates is None else estimates[test], 0.001) # without history, this deals them out round-robin
+            assignment[TimingHistory.key(*test)] = i + 1
+        partition_id = hashlib.sha1(json.dumps(list(assignment.items())).encode('utf-8')).hexdigest()
+        return [test for test in tests if assignment[TimingHistory.key(*test)] == shard], partition_id
+        
+    def run_shard(self, suite_names, shard, num_shards, jobs=None):
+        """
+        Run one shard of the named suites (see get_shard), optionally with jobs as in run_suites(). Returns its partial results, a
+        dictionary to be JSON-ified and later combined with the other shards' by merge_shards(). Test scores in it are before 
+        suite-level penalties, which are recorded separately so they can be applied once for the whole suite.
+        """
+        start_time = time.time()
+        shard_tests, partition_id = self.get_shard(suite_names, shard, num_shards)
+        suites = list(self.each_suite(suite_names))
+        suite_result_sets = OrderedDict((suite.name, TestResultSet()) for suite in suites)
+        aborted_suites = set()
+        self.reporter.note("Running shard %d/%d (%d of %d tests)..." % (shard, num_shards, len(shard_tests), sum(len(suite.tests) for suite in suites)))
+        
+        def on_result(test, result, exception):
+            if isinstance(exception, PrereqMissing):
+                if test.suite.name not in aborted_suites:
+                    aborted_suites.add(test.suite.name)
+                    test.suite.report_prereq_missing(suite_result_sets[test.suite.name], exception)
+            elif exception is not None:
+                raise exception
+            else:
+                test.suite.report_result(result, show_suite=True)
+                suite_result_sets[test.suite.name].add_result(result)
+                
+        governor = ConcurrencyGovernor(max_jobs=iff(jobs is None, 1, jobs or None))
+        tests = (suite.tests[test_num] for suite, test_num in shard_tests)
+        ParallelRunner(governor).run(tests, on_result, should_skip=lambda test: test.suite.name in aborted_suites)
+        self.reporter.note("")
+        
+        partial_suites = OrderedDict()
+        for suite in suites:
+            suite_result_set = suite_result_sets[suite.name]
+            suite_result_set.test_results.sort(key=lambda tr: tr.test_num)
+            partial_suites[suite.name] = OrderedDict([
+                ("target_hash", suite.get_target_hash()),
+                ("aborted", suite.name in aborted_suites),
+                ("penalties", iff(suite.name in aborted_suites, None, suite.check_suite_level_penalties())),
+                ("message", suite_result_set.message),
+                ("tests", [tr.to_dictionary() for tr in suite_result_set.test_results]),
+            ])
+        return OrderedDict([
+            ("shard", shard),
+            ("num_shards", num_shards),
+            ("partition", partition_id),
+            ("elapsed_time", time.time() - start_time),
+            ("suites", partial_suites),
+        ])
+        
+    def merge_shards(self, partials):
+        """
+        Combine the partial results of all shards of a run (see run_shard) into one TestResultSet, applying each suite's penalties
+        once, and add the shards' timings to the timing history. Raises ValueError if the partials don't add up to a whole run.
+        """
+        num_shards = partials[0]['num_shards']
+        if any(p['num_shards'] != num_shards or p['partition'] != partials[0]['partition'] for p in partials):
+            raise ValueError("The partial results are from different runs (or the shards disagreed on the partition)")
+        shards = sorted(p['shard'] for p in partials)
+        if shards != list(range(1, num_shards+1)):
+            raise ValueError("Need the partial results of shards 1-%d exactly once each; got shards %s" % (num_shards, ", ".join(str(s) for s in shards)))
+            
+        test_result_set = TestResultSet()
+        for suite_name in partials[0]['suites']:
+            suite = self.suites[suite_name]
+            suite.target_hash = partials[0]['suites'][suite_name]['target_hash'] # for the timing history
+            suite_result_set = TestResultSet()
+            is_aborted = False
+            for p in partials:
+                partial_suite = p['suites'][suite_name]
+                for d in partial_suite['tests']:
+                    suite_result_set.add_result(TestResult.from_dictionary(suite, d))
+                if partial_suite['message'] not in suite_result_set.message: # shards that hit the same missing pre-req say so once
+                    suite_result_set.append_message(partial_suite['message'])
+                is_aborted = is_aborted or partial_suite['aborted']
+            suite_result_set.test_results.sort(key=lambda tr: tr.test_num)
+            if not is_aborted:
+                if len(suite_result_set.test_results) != len(suite.tests):
+                    raise ValueError("%s: the partial results have %d of the suite's %d tests" % (suite_name, len(suite_result_set.test_results), len(suite.tests)))
+                suite.apply_penalties(suite_result_set, partials[0]['suites'][suite_name]['penalties'])
+            test_result_set += suite_result_set
+        test_result_set.set_elapsed_time(max(p['elapsed_time'] for p in partials))
+        self.record_timings(test_result_set)
+        return test_result_set
+        
+    def clean_suites(self, suite_names, echo=False):
+        """
+        For each of the named suites, 'clean' (remove actual+diff). Returns number of files actually deleted.
+        If the echo argument is true, status info is printed as we go.
+        """
+        n=0
+        for suite in self.each_suite(suite_names):
+            n += suite.clean(echo=echo)
+        return n
+     
+    def bless_suites(self, suite_names, echo=False):
+        """
+        For each of the named suites, 'bless' the results (convert actual -> expected).
+        If the echo argument is true, status info is printed as we go.
+        """
+        for suite in self.each_suite(suite_names):
+            suite.bless(echo=echo)
+        if self.get_archive() is not None:
+            self.reporter.warning("The new expected outputs won't be used until they're packed into %s (see --pack)." % self.get_archive().filename)
+     
+    def each_suite(self, suite_names=None):
+        """
+        Iterate the suites in this tester, either by names (if provided) or just all of them.
+        """
+        if suite_names is None:
+            suite_names = self.suites.keys()
+        for suite_name in suite_names:
+            yield self.suites[suite_name]
+     
+    def __repr__(self):
+        r = "Tester:\n"
+        for k,v in self.json.items():
+            if k=='test_suites': continue
+            r += "  %s: %s\n" % (k,v)
+        r += "  test_suites (%d suites):\n" % (len(self.suites))
+        for suite_name,suite in self.suites.items():
+            r += indent(str(suite),4)
+        return r
+    __str__ = __repr__
+
+class AsyncTestRun(object):
+    """
+    The asynchronous iterator returned by Tester.run_suites_async(). Runs the tests on a background thread and produces each 
+    TestResult as it completes:
+    
+        async def grade(tester):
+            run = tester.run_suites_async(["byseven"], overrides={"timeout": 5}, test_filter=lambda test: test.test_num < 3)
+            async for result in run:
+                print(result.name, result.is_pass)
+            return run.test_result_set    # complete, with suite-level penalties applied
+            
+    Cancelling the task that's waiting on it (or calling cancel()) kills the running tests' children and skips the rest. 
+    No async syntax here, as this file still has to parse under Python 2.
+    """
+    
+    END = object() # marks the end of the results
+    
+    def __init__(self, tester, suite_names, jobs, test_filter):
+        self.tester = tester
+        self.suite_names = suite_names
+        self.jobs = jobs
+        self.test_filter = test_filter
+        self.test_result_set = None # the whole TestResultSet, once done
+        self.loop = None            # the event loop we're iterated from; set on first use
+        self.items = []             # results (or an exception, or END) not yet asked for
+        self.waiter = None          # the future handed out by __anext__ and not yet resolved
+        self.tester.reporter = AsyncTestRun.ResultForwarder(self)
+        
+    class ResultForwarder(Reporter):
+        def __init__(self, run):
+            self.run = run
+        def test_finished(self, result, show_suite=False):
+            self.run.deliver(result)
+            
+    def __aiter__(self):
+        return self
+        
+    def __anext__(self):
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+        future = self.loop.create_future()
+        future.add_done_callback(self.on_future_done)
+        if self.items:
+            self.resolve(future, self.items.pop(0))
+        else:
+            self.waiter = future
+        return future
+        
+    def work(self):
+        try:
+            self.test_result_set = self.tester.run_suites(self.suite_names, jobs=self.jobs, test_filter=self.test_filter)
+            self.deliver(AsyncTestRun.END)
+        except Exception as e:
+            self.deliver(e)
+            
+    def deliver(self, item):
+        """
+        From the worker thread: hand over a result (or the exception that ended the run, or END).
+        """
+        try:
+            self.loop.call_soon_threadsafe(self.deliver_in_loop, item)
+        except RuntimeError:
+            pass # the event loop is gone, and nobody's listening any more
+        
+    def deliver_in_loop(self, item):
+        if self.waiter is not None and not self.waiter.done():
+            waiter, self.waiter = self.waiter, None
+            self.resolve(waiter, item)
+        else:
+            self.items.append(item)
+            
+    def resolve(self, future, item):
+        if item is AsyncTestRun.END:
+            future.set_exception(StopAsyncIteration())
+        elif isinstance(item, BaseException):
+            future.set_exception(item)
+        else:
+            future.set_result(item)
+            
+    def on_future_done(self, future):
+        if future.cancelled():
+            self.cancel()
+            
+    def cancel(self):
+        """
+        Stop the run (see Tester.cancel).
+        """
+        self.tester.cancel()
+
+class BatchGrader(object):
+    """
+    Grades a directory of many submissions (one per subdirectory) with a single Tester's settings, running the tests of all
+    of them through one shared ParallelRunner.
+    
+    Each submission is copied into an isolated workdir under the output directory, next to its generated files and its
+    results.json:
+    
+        OUTPUT_DIR/SUBMISSION/work/          copy of the submission, where its tests run
+        OUTPUT_DIR/SUBMISSION/output/        actual and diff files
+        OUTPUT_DIR/SUBMISSION/results.json   written once the submission is fully graded
+        OUTPUT_DIR/scores.csv                consolidated scores, rebuilt from all the results.json files at the end
+        
+    A submission with a results.json is considered done, so an interrupted batch can simply be run again to resume it.
+    
+    Submissions whose graded files are identical (see Tester.get_submission_hash) are only tested once: the others get a copy
+    of the first one's results, noting where they came from. This also applies across runs, via the submission_hash 
+    recorded in each results.json.
+    """
+    
+    def __init__(self, tester, submissions_dir, output_dir):
+        self.tester = tester
+        self.submissions_dir = submissions_dir
+        self.output_dir = output_dir
+        self.submission_hashes = {} # name -> hash, for submissions being graded
+        self.cached_suites = set()  # suites whose results came from the result cache
+        self.cache_keys = {}        # suite -> its result cache key, if any
+        
+    def results_filename(self, name):  return os.path.join(self.output_dir, name, "results.json")
+    def scores_filename(self):         return os.path.join(self.output_dir, "scores.csv")
+        
+    def discover(self):
+        """
+        Returns the names of the submissions, i.e. the subdirectories of the submissions directory.
+        """
+        output_dir = os.path.abspath(self.output_dir)
+        names = []
+        for name in sorted(os.listdir(self.submissions_dir)):
+            path = os.path.join(self.submissions_dir, name)
+            if name.startswith(".") or not os.path.isdir(path) or os.path.abspath(path) == output_dir:
+                continue
+            names.append(name)
+        return names
+        
+    def prepare(self, name):
+        """
+        Set up a fresh isolated workdir for the named submission and return a Tester for it.
+        """
+        submission_output_dir = os.path.join(self.output_dir, name)
+        workdir = os.path.join(submission_output_dir, "work")
+        if os.path.exists(workdir):
+            shutil.rmtree(workdir) # left over from an interrupted run
+        shutil.copytree(os.path.join(self.submissions_dir, name), workdir, symlinks=True)
+        return self.tester.clone(workdir=workdir, output_dir=os.path.join(submission_output_dir, "output"), reporter=self.tester.reporter.quieted())
+        
+    def run(self, suite_names, jobs=0, extra_credit_multiplier=None):
+        """
+        Grade every submission not already graded, then write the consolidated scores. 
+        Returns the number of submissions graded by this run.
+        """
+        start_time = time.time()
+        names = self.discover()
+        pending = [name for name in names if not os.path.exists(self.results_filename(name))]
+        print("Batch grading %d submissions in %s (%d already graded)..." % (len(names), self.submissions_dir, len(names) - len(pending)))
+        
+        governor = ConcurrencyGovernor(max_jobs=jobs or None)
+        timing_history = self.tester.get_timing_history()
+        testers = OrderedDict()
+        suites = {}              # name -> list of suites
+        tests = []               # (suite, test number) pairs, each test made only as it's started
+        outstanding = {}         # name -> number of tests not yet finished
+        result_sets = {}         # suite -> TestResultSet
+        aborted_suites = set()
+        graded_hashes = self.load_graded_hashes(names) # submission hash -> name of a graded submission
+        duplicates = {}          # name -> names of identical submissions waiting on its results
+        for name in pending:
+            tester = testers[name] = self.prepare(name)
+            submission_hash = self.submission_hashes[name] = tester.get_submission_hash(suite_names)
+            if submission_hash in graded_hashes:
+                self.reuse(name, graded_hashes[submission_hash])
+                continue
+            original = [n for n in duplicates if self.submission_hashes[n] == submission_hash]
+            if original:
+                duplicates[original[0]].append(name)
+                continue
+            duplicates[name] = []
+            suites[name] = list(tester.each_suite(suite_names))
+            outstanding[name] = 0
+            for suite in suites[name]:
+                self.cache_keys[suite] = suite.get_result_cache_key()
+                result_sets[suite] = suite.load_cached_result(self.cache_keys[suite])
+                if result_sets[suite] is not None:
+                    self.cached_suites.add(suite)
+                    continue
+                result_sets[suite] = TestResultSet()
+                tests += [(suite, test_num) for test_num in range(len(suite.tests))]
+                outstanding[name] += len(suite.tests)
+        for name in list(outstanding):
+            if not outstanding[name]:
+                self.finish(name, suites[name], result_sets, aborted_suites, extra_credit_multiplier, duplicates[name])
+        if timing_history is not None:
+            tests = timing_history.order_longest_first(tests)[0]
+        name_of = dict((id(tester), name) for name, tester in testers.items())
+            
+        def on_result(test, result, exception):
+            name = name_of[id(test.suite.tester)]
+            if isinstance(exception, PrereqMissing):
+                if test.suite not in aborted_suites:
+                    aborted_suites.add(test.suite)
+                    test.suite.report_prereq_missing(result_sets[test.suite], exception)
+            elif exception is not None:
+                raise exception
+            elif result is not None:
+                result_sets[test.suite].add_result(result)
+            outstanding[name] -= 1
+            if outstanding[name] == 0:
+                self.finish(name, suites[name], result_sets, aborted_suites, extra_credit_multiplier, duplicates[name])
+                
+        def should_skip(test):
+            if test.suite not in aborted_suites:
+                return False
+            on_result(test, None, None) # count it as done
+            return True
+            
+        ParallelRunner(governor).run((suite.tests[test_num] for suite, test_num in tests), on_result, should_skip=should_skip)
+        
+        self.write_scores(names)
+        print("Done. Graded %d submissions in %.2fs; scores are in %s" % (len(pending), time.time() - start_time, self.scores_filename()))
+        return len(pending)
+        
+    def finish(self, name, suites, result_sets, aborted_suites, extra_credit_multiplier, duplicate_names):
+        """
+        All tests of the named submission are done: apply suite-level penalties and write its results.json, then give copies of
+        them to the named identical submissions.
+        """
+        test_result_set = TestResultSet()
+        for suite in suites:
+            suite_result_set = result_sets.pop(suite)
+            suite_result_set.test_results.sort(key=lambda tr: tr.test_num)
+            cache_key = self.cache_keys.pop(suite, None)
+            if suite not in aborted_suites and suite not in self.cached_suites:
+                suite.finish(suite_result_set, cache_key)
+            test_result_set += suite_result_set
+        if extra_credit_multiplier:
+            test_result_set.apply_penalty(extra_credit_multiplier)
+        test_result_set.set_elapsed_time(sum(tr.elapsed_time or 0 for tr in test_result_set.test_results))
+        test_result_set.generate_gradescope_results(json_filename=self.results_filename(name), 
+            compile_output_filename=os.path.join(self.output_dir, name, "work", "compile_output.txt"),
+            extra_data={"submission_hash": self.submission_hashes[name]})
+        self.tester.record_timings(test_result_set)
+        self.tester.record_run(test_result_set, time.time() - test_result_set.elapsed_time, workdir=os.path.join(self.output_dir, name, "work"))
+        print("%-40s %.2f / %.2f" % (name, test_result_set.get_points(), test_result_set.get_max_points()))
+        for suite in suites[:1]:
+            suite.tester.message_spill.close() # all of this submission's testing is done
+        for duplicate_name in duplicate_names:
+            self.reuse(duplicate_name, name)
+            
+    def load_graded_hashes(self, names):
+        """
+        Returns a dictionary of submission hash -> submission name for those of the named submissions graded by an earlier run.
+        """
+        graded_hashes = {}
+        for name in names:
+            try:
+                with open(self.results_filename(name), "r") as fp:
+                    results = json.load(fp)
+            except (IOError, OSError, ValueError):
+                continue
+            submission_hash = results.get('extra_data', {}).get('submission_hash', None)
+            if submission_hash and 'reused_from' not in results['extra_data']:
+                graded_hashes.setdefault(submission_hash, name)
+        return graded_hashes
+        
+    def reuse(self, name, original_name):
+        """
+        Give the named submission a copy of the results of the identical, already graded, original_name submission.
+        """
+        with open(self.results_filename(original_name), "r") as fp:
+            results = json.load(fp, object_pairs_hook=OrderedDict)
+        submission_hash = results['extra_data']['submission_hash']
+        results['output'] += "\nThese results were reused from submission '%s', whose graded files are identical (hash %s).\n" % (original_name, submission_hash)
+        results['extra_data'] = OrderedDict([("submission_hash", submission_hash), ("reused_from", original_name)])
+        Utility.write_file_atomically(self.results_filename(name), json.dumps(results, indent=2, separators=(',', ': ')))
+        print("%-40s %.2f / %.2f (identical to %s)" % (name, results['score'], sum(t['max_score'] or 0 for t in results['tests']), original_name))
+        
+    def write_scores(self, names):
+        """
+        Write the consolidated scores CSV from the results.json of each of the named submissions that has one.
+        """
+        rows = []
+        for name in names:
+            try:
+                with open(self.results_filename(name), "r") as fp:
+                    results = json.load(fp)
+            except (IOError, OSError, ValueError):
+                continue
+            rows.append([name, results['score'], sum(t['max_score'] or 0 for t in results['tests']), results.get('extra_data', {}).get('reused_from', "")])
+        tmp_filename = Utility.temp_filename_for(self.scores_filename())
+        with open(tmp_filename, "w") as fp:
+            writer = csv.writer(fp)
+            writer.writerow(["submission", "score", "max_score", "reused_from"])
+            writer.writerows(rows)
+        Utility.replace_file(tmp_filename, self.scores_filename())
+
+class Benchmark(object):
+    """
+    Measures the harness's own performance (for --benchmark), to compare versions of it. Each workload is a synthetic suite 
+    (settings, expected outputs and target, made up in a scratch directory) whose programs take next to no time, so what's 
+    measured is our overhead in running them:
+    
+        trivial         the target is 'true': nothing but spawning and reaping
+        cat             the target is 'cat', echoing the test's 'input'
+        large_output    cat, with BENCHMARK_OUTPUT_BYTES of output (half of the tests differing on a line, to be diffed and summarized)
+        float_diff      cat, with a diff "float" of BENCHMARK_FLOAT_LINES lines that all differ slightly
+        output_filters  cat, through BENCHMARK_FILTER_PASSES passes of output_filters
+        logisim_parse   not a suite: each "test" reads a .circ of BENCHMARK_CIRCUIT_COMPONENTS gates the ways the harness does
+                        (penalty checks and fingerprinting), as simulating it needs java; a tenth as many, as each takes far longer
+        
+    Each is run with each of BENCHMARK_SCALES tests, at each of BENCHMARK_JOBS levels of parallelism, measuring tests per
+    second, our own CPU time (not our children's) per test, and our peak memory. The last is the high-water mark of the whole 
+    process, so the growth it shows is credited to the workload that caused it.
+    
+    For each of the WORKLOADS, a workload_NAME method returns the suite settings for a given number of tests (each test with
+    its "expected" output), having put any files they need in the given test directory and the target in the workdir.
+    """
+    
+    WORKLOADS = ["trivial", "cat", "large_output", "float_diff", "output_filters", "logisim_parse"]
+    
+    def __init__(self, scales=None, jobs_levels=None):
+        self.scales = scales or BENCHMARK_SCALES
+        self.jobs_levels = jobs_levels or BENCHMARK_JOBS
+        
+    @staticmethod
+    def get_cpu_time():
+        """
+        Returns the CPU seconds used by this process (all threads, but none of its children).
+        """
+        if resource is not None: # finer-grained than os.times()
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            return usage.ru_utime + usage.ru_stime
+        times = os.times()
+        return times[0] + times[1]
+        
+    @staticmethod
+    def get_peak_rss_kb():
+        if resource is None:
+            return None
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return iff(sys.platform == "darwin", max_rss // 1024, max_rss) # mac says bytes, everyone else KiB
+        
+    @staticmethod
+    def link_target(workdir, program):
+        """
+        Put a link to the given program (found in the PATH) in the workdir, as the suite's target. Returns its name there.
+        """
+        path = Utility.verify_executable(program, use_path=True)
+        if not path:
+            raise PrereqMissing("The benchmark needs '%s' in the PATH." % program)
+        os.symlink(path, os.path.join(workdir, program))
+        return "./%s" % program
+        
+    def workload_trivial(self, test_dir, workdir, num_tests):
+        return OrderedDict([("target", Benchmark.link_target(workdir, "true")), 
+            ("tests", [OrderedDict([("desc", "true %d" % i), ("expected", "")]) for i in range(num_tests)])])
+        
+    def workload_cat(self, test_dir, workdir, num_tests):
+        tests = []
+        for i in range(num_tests):
+            text = "Test %d says hello.\n" % i
+            tests.append(OrderedDict([("desc", "cat %d" % i), ("input", text), ("expected", text)]))
+        return OrderedDict([("target", Benchmark.link_target(workdir, "cat")), ("tests", tests)])
+        
+    def workload_large_output(self, test_dir, workdir, num_tests):
+        line = "%s\n" % ("0123456789" * 7)
+        output = line * (BENCHMARK_OUTPUT_BYTES // len(line))
+        with open(os.path.join(test_dir, "large_output_stdin.txt"), "w") as fp:
+            fp.write(output)
+        different_output = output[:len(output)//2] + "something else\n" + output[len(output)//2 + len(line):]
+        tests = [OrderedDict([("desc", "cat %d" % i), ("stdin", os.path.join(test_dir, "large_output_stdin.txt")), 
+            ("expected", iff(i % 2, different_output, output))]) for i in range(num_tests)]
+        return OrderedDict([("target", Benchmark.link_target(workdir, "cat")), ("tests", tests)])
+        
+    def workload_float_diff(self, test_dir, workdir, num_tests):
+        tests = []
+        for i in range(num_tests):
+            values = [1000.0 + i + j * 0.25 for j in range(BENCHMARK_FLOAT_LINES)]
+            tests.append(OrderedDict([("desc", "float %d" % i), ("diff", "float"), 
+                ("input", "".join("key%d %.4f\n" % (j, value) for j, value in enumerate(values))),
+                ("expected", "".join("key%d %.4f\n" % (j, value * 1.0001) for j, value in enumerate(values)))])) # within float_diff's tolerance
+        return OrderedDict([("target", Benchmark.link_target(workdir, "cat")), ("tests", tests)])
+        
+    def workload_output_filters(self, test_dir, workdir, num_tests):
+        filters = ["filter_remove_colon_prompts", "filter_x2y", "filter_y2z"] * BENCHMARK_FILTER_PASSES
+        tests = []
+        for i in range(num_tests):
+            text = "".join("Enter x for %d: %d x %d\n\n" % (i, j, j) for j in range(100))
+            tests.append(OrderedDict([("desc", "filtered %d" % i), ("input", text), ("expected", "".join(FileFilter(filters).apply(text.splitlines(True))))]))
+        return OrderedDict([("target", Benchmark.link_target(workdir, "cat")), ("output_filters", filters), ("tests", tests)])
+        
+    @staticmethod
+    def write_circuit(filename, num_gates):
+        """
+        Write a .circ with num_gates AND gates in chains of 10, spread over subcircuits of 100, each used once by main.
+        """
+        with open(filename, "w") as fp:
+            fp.write('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n<project source="2.15.0" version="1.0">\n')
+            fp.write('  <lib desc="#Wiring" name="0"/>\n  <lib desc="#Gates" name="1"/>\n  <main name="main"/>\n')
+            fp.write('  <options>\n    <a name="sim_limit" val="1000"/>\n  </options>\n')
+            num_circuits = (num_gates + 99) // 100
+            fp.write('  <circuit name="main">\n')
+            for c in range(num_circuits):
+                fp.write('    <comp loc="(%d,%d)" name="sub%d"/>\n' % (100, 100 + 100*c, c))
+            fp.write('  </circuit>\n')
+            for c in range(num_circuits):
+                fp.write('  <circuit name="sub%d">\n' % c)
+                for g in range(min(100, num_gates - 100*c)):
+                    x, y = 200 + 100*(g % 10), 100 + 100*(g // 10)
+                    if g % 10 == 0:
+                        fp.write('    <comp lib="0" loc="(%d,%d)" name="Pin"><a name="label" val="in%d"/></comp>\n' % (x - 60, y - 10, g))
+                    fp.write('    <comp lib="1" loc="(%d,%d)" name="AND Gate"/>\n' % (x, y))
+                    fp.write('    <wire from="(%d,%d)" to="(%d,%d)"/>\n' % (x, y, x + 40, y - 10))
+                fp.write('  </circuit>\n')
+            fp.write('</project>\n')
+            
+    def run_circuit_workload(self, scratch_dir, num_tests):
+        """
+        The logisim_parse workload, which isn't a suite: returns (wall seconds, our CPU seconds, number of "tests" passed) for 
+        reading a made-up .circ num_tests times.
+        """
+        filename = os.path.join(scratch_dir, "benchmark.circ")
+        Benchmark.write_circuit(filename, BENCHMARK_CIRCUIT_COMPONENTS)
+        start_time, start_cpu_time = time.time(), Benchmark.get_cpu_time()
+        for i in range(num_tests):
+            Utility.logisim_get_components(filename)
+            Utility.logisim_get_components_used_per_circuit(filename)
+            LogisimFingerprint.fingerprint_file(filename)
+        return time.time() - start_time, Benchmark.get_cpu_time() - start_cpu_time, num_tests
+        
+    def run_suite_workload(self, scratch_dir, name, num_tests, jobs):
+        """
+        Make up the named workload's suite (with the given number of tests) in the scratch directory, and time running it. 
+        Returns (wall seconds, our CPU seconds, number of tests passed).
+        """
+        test_dir, workdir, output_dir = [os.path.join(scratch_dir, d) for d in ("tests", "work", "output")]
+        for d in (test_dir, workdir):
+            os.makedirs(d)
+        suite_settings = getattr(self, "workload_" + name)(test_dir, workdir, num_tests)
+        expected_outputs = []
+        for test_settings in suite_settings['tests']:
+            expected_outputs.append(test_settings.pop("expected"))
+            test_settings.setdefault("args", [])
+        settings = OrderedDict([("mode", "exe"), ("timing_history", None), ("test_archive", None), ("test_suites", OrderedDict([(name, suite_settings)]))])
+        with open(os.path.join(test_dir, SETTINGS_FILENAME), "w") as fp:
+            json.dump(settings, fp, indent=2)
+        tester = Tester(test_dir, workdir=workdir, output_dir=output_dir, reporter=Reporter())
+        for test, expected_output in zip(tester.suites[name].tests, expected_outputs):
+            with open(test.expected_output_filename(), "w") as fp:
+                fp.write(expected_output)
+        
+        start_time, start_cpu_time = time.time(), Benchmark.get_cpu_time()
+        test_result_set = tester.run_suites([name], jobs=jobs)
+        return time.time() - start_time, Benchmark.get_cpu_time() - start_cpu_time, sum(1 for tr in test_result_set.test_results if tr.is_pass)
+        
+    def run(self):
+        """
+        Run every workload at every scale and level of parallelism, printing progress; returns the report.
+        """
+        report = OrderedDict([
+            ("version", VERSION),
+            ("python", sys.version.split()[0]),
+            ("platform", sys.platform),
+            ("cpu_count", multiprocessing.cpu_count()),
+            ("started", time.time()),
+            ("results", []),
+        ])
+        print("%-16s %6s %4s %10s %12s %14s %12s" % ("Workload", "Tests", "-j", "Passed", "Tests/s", "CPU/test", "Peak RSS"))
+        for name in Benchmark.WORKLOADS:
+            for num_tests in self.scales:
+                if name == "logisim_parse":
+                    num_tests = max(1, num_tests // 10)
+                for jobs in iff(name == "logisim_parse", [1], self.jobs_levels): # parsing isn't parallel
+                    scratch_dir = tempfile.mkdtemp(prefix="hwtest_benchmark")
+                    try:
+                        rss_before = Benchmark.get_peak_rss_kb()
+                        if name == "logisim_parse":
+                            wall_time, cpu_time, num_passed = self.run_circuit_workload(scratch_dir, num_tests)
+                        else:
+                            wall_time, cpu_time, num_passed = self.run_suite_workload(scratch_dir, name, num_tests, jobs)
+                        peak_rss = Benchmark.get_peak_rss_kb()
+                    finally:
+                        shutil.rmtree(scratch_dir, ignore_errors=True)
+                    result = OrderedDict([
+                        ("workload", name),
+                        ("tests", num_tests),
+                        ("jobs", jobs),
+                        ("passed", num_passed),
+                        ("wall_time", wall_time),
+                        ("tests_per_second", num_tests / max(wall_time, 1e-9)),
+                        ("harness_cpu_per_test", cpu_time / num_tests),
+                        ("peak_rss_kb", peak_rss),
+                        ("peak_rss_growth_kb", iff(peak_rss is None, None, (peak_rss or 0) - (rss_before or 0))),
+                    ])
+                    report['results'].append(result)
+                    print("%-16s %6d %4d %10s %12.1f %12.2fms %12s" % (name, num_tests, jobs, "%d/%d" % (num_passed, num_tests), 
+                        result['tests_per_second'], result['harness_cpu_per_test'] * 1000, iff(peak_rss is None, "?", "%s KiB" % peak_rss)))
+        report['elapsed_time'] = time.time() - report['started']
+        return report
+
+class GradingServer(object):
+    """
+    Keeps a Tester resident and grades submissions on request over a Unix domain socket, sparing each request the interpreter
+    startup, settings parsing and tool discovery of a fresh run. Each request is graded by a clone of the resident Tester.
+    
+    The protocol is newline-delimited JSON, one response per request, any number of requests per connection:
+    
+        {"submission": "/path/to/submission", "suites": ["byseven"]}
+        -> {"ok": true, "score": 6.0, "max_score": 6.0, "elapsed_time": 1.23, "results": {...content of a results.json...}}
+        
+        {"command": "ping"}
+        -> {"ok": true, "version": "3.0.0"}
+        
+    "suites" is optional, defaulting to those chosen on the command line. A request may also give an "output_dir" in which to
+    keep the actual and diff files; otherwise they go in a temporary directory that's removed afterward. Failed requests get
+    {"ok": false, "error": "..."}. At most max_requests submissions are graded at once; further requests wait their turn.
+    """
+    
+    def __init__(self, tester, socket_path, suite_names, max_requests=None):
+        self.tester = tester
+        self.socket_path = socket_path
+        self.suite_names = list(suite_names)
+        self.max_requests = max_requests or multiprocessing.cpu_count()
+        self.semaphore = threading.Semaphore(self.max_requests)
+        self.print_lock = threading.Lock()
+        
+    def log(self, message):
+        with self.print_lock:
+            print(message)
+            sys.stdout.flush()
+        
+    def serve(self):
+        """
+        Listen for and handle requests until interrupted.
+        """
+        # look up now what each request would otherwise look up for itself
+        if any(suite['mode'] in ("java", "logisim") for suite in self.tester.each_suite()):
+            Utility.find_java()
+        self.tester.get_timing_history()
+        self.tester.get_calibration()
+        
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                in_use = True
+            except socket.error:
+                in_use = False
+            probe.close()
+            if in_use:
+                raise ValueError("Another server is already listening on %s" % self.socket_path)
+            os.remove(self.socket_path) # left over from a server that didn't exit cleanly
+            
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen(16)
+        self.log("Serving on %s (grading up to %d submissions at a time); Ctrl-C to stop." % (self.socket_path, self.max_requests))
+        try:
+            while True:
+                connection, address = server.accept()
+                thread = threading.Thread(target=self.handle_connection, args=(connection,))
+                thread.daemon = True
+                thread.start()
+        except KeyboardInterrupt:
+            self.log("Stopping.")
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+            
+    def handle_connection(self, connection):
+        """
+        Answer each request that comes in on the given connection, until the client closes it.
+        """
+        try:
+            for line in connection.makefile("rb"):
+                if line.strip():
+                    response = self.handle_request(line)
+                    connection.sendall((json.dumps(response) + "\n").encode('utf-8'))
+        except socket.error as e:
+            self.log("Connection error: %s" % e)
+        finally:
+            connection.close()
+            
+    def handle_request(self, line):
+        """
+        Returns the response (a dictionary) to the given request (a line of JSON).
+        """
+        try:
+            request = json.loads(line.decode('utf-8'))
+            command = request.get('command', "grade")
+            if command == "ping":
+                return OrderedDict([("ok", True), ("version", VERSION)])
+            elif command == "grade":
+                return self.grade(request)
+            else:
+                raise ValueError("Unknown command: %s" % command)
+        except Exception as e:
+            self.log(TextColors.RED + "Request failed: %s" % e + TextColors.END)
+            return OrderedDict([("ok", False), ("error", str(e))])
+            
+    def grade(self, request):
+        """
+        Grade the submission named by a request; returns the response.
+        """
+        submission = request.get('submission', None)
+        if not submission or not os.path.isdir(submission):
+            raise ValueError("The submission must be a directory: %s" % submission)
+        suite_names = request.get('suites', None) or self.suite_names
+        unknown_suites = [suite_name for suite_name in suite_names if suite_name not in self.tester.suites]
+        if unknown_suites:
+            raise ValueError("Unknown suite(s): %s" % ", ".join(unknown_suites))
+            
+        with self.semaphore:
+            start_time = time.time()
+            temp_dir = None
+            output_dir = request.get('output_dir', None)
+            if output_dir is None:
+                output_dir = temp_dir = tempfile.mkdtemp(prefix="hwtest")
+            try:
+                tester = self.tester.clone(workdir=submission, output_dir=output_dir, reporter=self.tester.reporter.quieted())
+                test_result_set = tester.run_suites(suite_names)
+                results = test_result_set.get_gradescope_dictionary(compile_output_filename=tester.workdir_path("compile_output.txt"))
+                tester.message_spill.close()
+            finally:
+                if temp_dir is not None:
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+            elapsed_time = time.time() - start_time
+            
+        self.log("%-40s %.2f / %.2f (%.2fs)" % (submission, test_result_set.get_points(), test_result_set.get_max_points(), elapsed_time))
+        return OrderedDict([
+            ("ok", True),
+            ("score", test_result_set.get_points()),
+            ("max_score", test_result_set.get_max_points()),
+            ("elapsed_time", elapsed_time),
+            ("results", results),
+        ])
+
+def main():
+    """
+    Parse arguments and run auto-tester/grader.
+    """
+    global verbose
+
+    test_dir = DEFAULT_TEST_DIR # the default for the student auto-tester; to be changed with -t if you want the instructor auto-grader
+    
+    # Allow manual override of test directory with "-t <test_dir>" -- this is done outside of argparse, since argparse needs settings to present a good help message
+    if len(sys.argv) >=3 and "-t" in sys.argv:
+        idx = sys.argv.index('-t') # find the -t
+        sys.argv.pop(idx) # lose the -t itself
+        test_dir = sys.argv.pop(idx) # pop out the test directory argument
+        
     # create the tester!
     tester = Tester(test_dir)
     
@@ -1238,16 +4869,31 @@ def main():
     
     # argument setup
     parser = argparse.ArgumentParser(description=iff(is_grader,"Instructor auto-grader version %s." % VERSION,"Student auto-tester version %s." % VERSION))
-    parser.add_argument("test_suite", metavar='<SUITE_NAME>', choices=['ALL']+list(tester['test_suites'].keys()), help="A test suite name to run (%s), or 'ALL' for all of them." % ', '.join("'%s'" % s for s in tester['test_suites'].keys()))
+    parser.add_argument("test_suite", metavar='<SUITE_NAME>', nargs='?', default=None, choices=['ALL']+list(tester['test_suites'].keys()), help="A test suite name to run (%s), or 'ALL' for all of them.%s" % (', '.join("'%s'" % s for s in tester['test_suites'].keys()), 
+        iff(is_grader, " Not needed with --benchmark, --merge or --unpack; with --report or --serve, defaults to 'ALL'.", "")))
     parser.add_argument('-C', '--clean', action='store_true', help="Remove generated actual and diff files for chosen suite(s).")
     parser.add_argument('-G', '--generate-expected', help=argparse.SUPPRESS, action='store_true') # not for common use! assumes program is correct and uses it to generate the expected outputs
     #parser.add_argument_group('group')
     parser.add_argument('--mode', help=argparse.SUPPRESS, type=str, default=None) # Override default mode specified by settings file
     parser.add_argument('-v', '--verbose', action='store_true', help="Verbose mode. Shows the commands executed.")
+    parser.add_argument('--batch', metavar='SUBMISSIONS_DIR', type=str, default=None, help="Grade every submission (subdirectory) of SUBMISSIONS_DIR in parallel; rerun to resume an interrupted batch.")
+    parser.add_argument('--batch-output', metavar='DIR', type=str, default="batch_results", help="Where --batch puts each submission's workdir and results, plus scores.csv. Default: %(default)s")
+    parser.add_argument('--events', metavar='FILE', type=str, default=None, help="Append a JSON line to FILE for each event (test started, finished, etc.) as it happens; '-' for stdout, in which case the usual output goes to stderr.")
+    parser.add_argument('-j', '--jobs', metavar='N', type=str, default=None, help="Run tests in parallel, up to N at a time ('auto' for one per core), adapting to the machine's load.")
+    parser.add_argument('--profile', metavar='PSTATS_FILE', nargs='?', const="", default=None, help="Show how long each phase of the tests took, per suite. If PSTATS_FILE is given, also save a cProfile of the harness there (of the main thread only, so best without -j).")
     parser.add_argument('-t', dest="test_dir", metavar="TESTDIR", type=str, help="Choose the directory with the "+DEFAULT_TEST_DIR+" and test content. Default: %(default)s", default=DEFAULT_TEST_DIR)
     # ^ Note: we don't actually *use* this parser option, as it's manually pulled out before the parser is created (see earlier in this function). It's here so the help message includes it. 
     if is_grader:
         parser.add_argument('-e', '--extra-credit-multiplier', metavar='M', help='Multiply the total score by the given value.', type=float, default=None) 
+        parser.add_argument('--resume', action='store_true', help="Pick up where an interrupted run left off, skipping the tests whose results it recorded.")
+        parser.add_argument('--calibrate', metavar='RUNS', type=int, default=None, help="Time the reference solution RUNS times per test and save the results for 'adaptive_timeout'.")
+        parser.add_argument('--shard', metavar='K/N', type=str, default=None, help="Run only the K'th of N balanced parts of the tests, writing partial results to be combined with --merge.")
+        parser.add_argument('--merge', metavar='PARTIAL', nargs='+', default=None, help="Combine the partial results of all the shards of a --shard run into results.json.")
+        parser.add_argument('--pack', action='store_true', help="Pack the expected outputs and stdin files of the chosen suite(s) into the test archive (%s in the test directory), which tests then read instead." % tester['test_archive'])
+        parser.add_argument('--unpack', action='store_true', help="Write the contents of the test archive out as the usual files (remove the archive to have them used).")
+        parser.add_argument('--report', action='store_true', help="Summarize the run history of the chosen suite(s): the slowest tests, flaky tests, and tests that have gotten slower.")
+        parser.add_argument('--benchmark', metavar='FILE', type=str, default=None, help="Measure the harness's own speed on synthetic workloads, saving the results in FILE as JSON.")
+        parser.add_argument('--serve', metavar='SOCKET', type=str, default=None, help="Stay resident, grading submissions on request over the Unix domain socket SOCKET (at most -j at a time).")
         
 
     # argpase is very restrictive - if it doesn't get a test_suite, it prints a robo-generated error message that's not very helpful
@@ -1257,15 +4903,34 @@ def main():
         sys.exit(1)
         
     args = parser.parse_args()
+    if args.test_suite is None: # only some modes can do without
+        if is_grader and (args.report or args.serve):
+            args.test_suite = 'ALL'
+        elif not (is_grader and (args.benchmark or args.merge or args.unpack)):
+            parser.error("the following arguments are required: <SUITE_NAME>")
     
     # apply command line mode override
     if args.mode:
         tester['mode'] = args.mode
     verbose = args.verbose
     
+    # profile what follows, if requested (printing the results as we exit, whichever way that is)
+    if args.profile is not None:
+        tester.profiler.start(args.profile)
+        atexit.register(tester.profiler.finish)
+    
+    # stream events, if requested
+    if args.events == "-":
+        tester.reporter = EventReporter(sys.stdout, next_reporter=tester.reporter)
+        sys.stdout = sys.stderr # keep the event stream clean
+    elif args.events:
+        tester.reporter = EventReporter(open(args.events, "a"), next_reporter=tester.reporter)
+    
     # figure out the suite(s) to do (or do the special clean mode)
     if args.test_suite == 'ALL':
         suite_names = tester.suites.keys()
+    elif args.test_suite is None:
+        suite_names = [] # for the modes that don't run suites
     else:
         suite_names = [args.test_suite]
     
@@ -1276,8 +4941,84 @@ def main():
         print("Files removed: %d" % num_files_removed)
         return # stop here
         
-    # actually run the tests!
-    test_result_set = tester.run_suites(suite_names)
+    if is_grader and args.pack:
+        print("Packed %d files into %s" % (tester.pack_suites(suite_names), os.path.join(tester['test_dir'], tester['test_archive'])))
+        return # stop here
+        
+    if is_grader and args.unpack:
+        if tester.get_archive() is None:
+            print("There's no test archive to unpack.")
+            sys.exit(1)
+        try:
+            print("Unpacked %d files from %s" % (tester.get_archive().unpack(), tester.get_archive().filename))
+        except ValueError as e:
+            print(TextColors.RED + "Can't unpack: %s" % e + TextColors.END)
+            sys.exit(1)
+        return # stop here
+        
+    if is_grader and args.benchmark:
+        report = Benchmark().run()
+        Utility.write_file_atomically(args.benchmark, json.dumps(report, indent=2))
+        print("Done. Benchmark results are in %s" % args.benchmark)
+        return # stop here
+        
+    if is_grader and args.report:
+        if tester.get_run_history() is None:
+            print("There's no run history to report on (see the 'run_history' setting).")
+            sys.exit(1)
+        tester.get_run_history().report(suite_names)
+        return # stop here
+        
+    if is_grader and args.calibrate:
+        tester.calibrate_suites(suite_names, args.calibrate)
+        return # stop here
+        
+    shard = None
+    if is_grader and args.shard:
+        m = re.match(r'^(\d+)/(\d+)$', args.shard)
+        if not m or not 1 <= int(m.group(1)) <= int(m.group(2)):
+            parser.error("--shard must be K/N, with 1 <= K <= N")
+        shard, num_shards = int(m.group(1)), int(m.group(2))
+        
+    jobs = None
+    if args.jobs == 'auto':
+        jobs = 0
+    elif args.jobs is not None:
+        jobs = int(args.jobs)
+        
+    if is_grader and args.serve:
+        GradingServer(tester, args.serve, suite_names, max_requests=jobs or None).serve()
+        return # stop here
+        
+    if args.batch:
+        extra_credit_multiplier = iff(is_grader, getattr(args, 'extra_credit_multiplier', None), None)
+        BatchGrader(tester, args.batch, args.batch_output).run(suite_names, jobs=jobs or 0, extra_credit_multiplier=extra_credit_multiplier)
+        return # stop here
+        
+    if shard is not None:
+        partial = tester.run_shard(suite_names, shard, num_shards, jobs=jobs)
+        partial_filename = "results.shard%dof%d.json" % (shard, num_shards)
+        Utility.write_file_atomically(partial_filename, json.dumps(partial, indent=2, separators=(',', ': ')))
+        print("Done. Partial results for shard %d/%d are in %s" % (shard, num_shards, partial_filename))
+        return # stop here
+        
+    if is_grader and args.merge:
+        partials = []
+        for partial_filename in args.merge:
+            with open(partial_filename, "r") as fp:
+                partials.append(json.load(fp, object_pairs_hook=OrderedDict))
+        try:
+            test_result_set = tester.merge_shards(partials)
+        except ValueError as e:
+            print(TextColors.RED + "Can't merge: %s" % e + TextColors.END)
+            sys.exit(1)
+    else:
+        # actually run the tests! (as the grader, saving the results as we go, so they survive an interruption)
+        if is_grader and not args.generate_expected:
+            journal = tester.reporter = ResultsJournal("results.json", next_reporter=tester.reporter)
+            if args.resume:
+                print("Resuming: %d test results recovered from %s.\n" % (journal.resume(tester), journal.journal_filename))
+        test_result_set = tester.run_suites(suite_names, jobs=jobs)
     
     # extra credit multiplier
     if is_grader and args.extra_credit_multiplier:
@@ -1292,7 +5033,10 @@ def main():
         
     # generate gradescope result json
     if is_grader:
-        test_result_set.generate_gradescope_results()
+        with tester.profiler.phase(None, "report"):
+            test_result_set.generate_gradescope_results()
+        if isinstance(tester.reporter, ResultsJournal):
+            tester.reporter.finish()
             
         print("Done. Score: %.2f / %.2f" % (test_result_set.get_points(), test_result_set.get_max_points()))
         print("")